@@ -0,0 +1,215 @@
+'''
+Compressed archive of old orders.
+
+archive_orders() moves the bookings made before a cut-off date out of the live
+order file into a compressed segment, so the live file (read in full at every
+start) only holds recent bookings. Segments keep the rows exactly as they were
+in the order file, so they parse the same way. The archive directory holds:
+
+    index.json                                     the segments, oldest first
+    orders.<first day>-<last day>.<n>.csv.<ext>   one compressed segment per run
+
+Each index entry records the segment's file, codec, row count and the first and
+last booking day in it (ISO dates), so readers only open the segments whose
+days overlap the range they were asked for:
+
+    for guest_name, booking in read_bookings("orders_archive", since=date(2024, 1, 1)):
+        ...
+
+Codecs come from the standard library: gzip (the default), bz2 and lzma, plus
+zstd on Python versions that ship compression.zstd. Rows whose booking date
+cannot be read stay in the live file, and so do bookings whose stay checks out
+today or later: their nights are still reserved from the live file at start-up
+(see read_open_stays() in order_import.py), so they are archived once the stay
+is over.
+
+A run adds its segment to the index as pending, together with the inode of the
+new live file it wrote, and only then replaces the live file. Readers count a
+pending segment once the live file is that new file, so a crash between the two
+steps never shows a booking twice or not at all. The next run finishes the
+entry, or removes the segment if the live file was never replaced.
+'''
+import importlib
+import json
+import os
+import re
+from datetime import date
+
+from order_import import parse_order_line, rename_order_guests
+
+INDEX = 'index.json'
+
+# Codec -> (module, file extension); modules are imported when a segment is opened
+CODECS = {
+    'gzip': ('gzip', 'gz'),
+    'bz2': ('bz2', 'bz2'),
+    'lzma': ('lzma', 'xz'),
+    'zstd': ('compression.zstd', 'zst'),
+}
+
+
+# Day of a booking date such as "12-09-2024" or "12/9/2024 19:55", or None
+def booking_day(booking_date):
+    try:
+        day, month, year = re.split(r'[-/]', booking_date.split()[0])
+        return date(int(year), int(month), int(day))
+    except (ValueError, IndexError):
+        return None
+
+
+# Whether a day is within since..until, both inclusive and either one open when None
+def in_range(day, since=None, until=None):
+    if day is None:
+        return since is None and until is None
+    return (since is None or day >= since) and (until is None or day <= until)
+
+
+def open_segment(path, codec, mode='rt'):
+    try:
+        module = importlib.import_module(CODECS[codec][0])
+    except ImportError:
+        raise ValueError(f"The {codec} codec is not available in this Python version.")
+    return module.open(path, mode, encoding='utf-8')
+
+
+class ArchiveIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        path = os.path.join(directory, INDEX)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.segments = json.load(file)['segments']
+
+    # Segments with bookings between since and until (dates, either may be None), oldest first
+    def segments_for(self, since=None, until=None):
+        return [segment for segment in self.segments if self.committed(segment)
+                and (since is None or date.fromisoformat(segment['last']) >= since)
+                and (until is None or date.fromisoformat(segment['first']) <= until)]
+
+    # Whether a segment's bookings are gone from the live file, i.e. its run replaced the live file
+    @staticmethod
+    def committed(segment):
+        pending = segment.get('pending')
+        if pending is None:
+            return True
+        try:
+            return os.stat(pending['live']).st_ino == pending['inode']
+        except OSError:
+            return False
+
+    # Finishes the entries of runs that stopped before clearing their pending mark: kept if the
+    # live file was replaced, removed with their segment otherwise
+    def finish_pending(self):
+        pending = [segment for segment in self.segments if 'pending' in segment]
+        for segment in pending:
+            if self.committed(segment):
+                del segment['pending']
+            else:
+                self.segments.remove(segment)
+                if os.path.exists(self.path(segment)):
+                    os.remove(self.path(segment))
+        if pending:
+            self.save()
+
+    def path(self, segment):
+        return os.path.join(self.directory, segment['file'])
+
+    def save(self):
+        path = os.path.join(self.directory, INDEX)
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'segments': self.segments}, file, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+# Moves the bookings of the order file made before the day `before` into a new segment, in one
+# pass over the file, keeping those whose stay has not ended by `today`; returns the new index
+# entry, or None when nothing was old enough
+def archive_orders(order_file, directory, before, codec='gzip', today=None):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec '{codec}'. Choose from {', '.join(CODECS)}.")
+    today = today or date.today()
+    os.makedirs(directory, exist_ok=True)
+    index = ArchiveIndex(directory)
+    index.finish_pending()
+    ext = CODECS[codec][1]
+    pending = os.path.join(directory, f".pending.csv.{ext}")
+    live_pending = order_file + '.live.tmp'
+    rows, first, last = 0, None, None
+    try:
+        with open(order_file, 'r') as source, open(live_pending, 'w') as live, \
+                open_segment(pending, codec, 'wt') as segment:
+            for line in source:
+                try:
+                    parsed = parse_order_line(line)
+                except ValueError:
+                    parsed = None
+                day = booking_day(parsed[1]['booking_date']) if parsed else None
+                check_out = booking_day(parsed[1].get('check_out_date', '')) if parsed else None
+                if day is not None and day < before and (check_out is None or check_out < today):
+                    segment.write(line if line.endswith('\n') else line + '\n')
+                    rows += 1
+                    first = day if first is None or day < first else first
+                    last = day if last is None or day > last else last
+                else:
+                    live.write(line)
+            live.flush()
+            os.fsync(live.fileno())
+            live_inode = os.fstat(live.fileno()).st_ino
+        if rows == 0:
+            return None
+        name = f"orders.{first:%Y%m%d}-{last:%Y%m%d}.{len(index.segments) + 1}.csv.{ext}"
+        os.replace(pending, os.path.join(directory, name))
+        entry = {'file': name, 'codec': codec, 'rows': rows, 'first': first.isoformat(), 'last': last.isoformat(),
+                 'pending': {'live': os.path.abspath(order_file), 'inode': live_inode}}
+        index.segments.append(entry)
+        index.save()
+        os.replace(live_pending, order_file)
+        del entry['pending']
+        index.save()
+        return entry
+    finally:
+        for path in (pending, live_pending):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Renames guests (old name -> new name) in every segment, rewriting only the segments that hold
+# one of them; returns the number of bookings renamed
+def rename_guests(directory, renamed):
+    index = ArchiveIndex(directory)
+    count = 0
+    for segment in index.segments_for():
+        path = index.path(segment)
+        pending = path + '.tmp'
+        try:
+            with open_segment(path, segment['codec']) as source, open_segment(pending, segment['codec'], 'wt') as out:
+                renamed_here = rename_order_guests(source, out, renamed)
+            if renamed_here:
+                os.replace(pending, path)
+                count += renamed_here
+        finally:
+            if os.path.exists(pending):
+                os.remove(pending)
+    return count
+
+
+# Archived bookings between since and until as (guest name, booking), oldest segment first,
+# only opening the segments that can hold such bookings. With guest_name, only that guest's.
+def read_bookings(directory, since=None, until=None, guest_name=None):
+    index = ArchiveIndex(directory)
+    for segment in index.segments_for(since, until):
+        with open_segment(index.path(segment), segment['codec']) as file:
+            for line in file:
+                if guest_name is not None and guest_name not in line:
+                    continue  # cheap substring test before parsing
+                try:
+                    parsed = parse_order_line(line)
+                except ValueError:
+                    continue
+                if parsed is None or (guest_name is not None and parsed[0] != guest_name):
+                    continue
+                if (since is not None or until is not None) and \
+                        not in_range(booking_day(parsed[1]['booking_date']), since, until):
+                    continue
+                yield parsed
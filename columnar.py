@@ -0,0 +1,226 @@
+'''
+Columnar export of the order history for analytics.
+
+orders.csv keeps all the products of a booking in one free-form field
+("2 x U12swan, 4 x SI2"). export_orders() streams an order file into two
+normalized tables, one file per column:
+
+    orders        order_id (int64), guest, total_cents (int64), reward_points (int64), booking_date
+    order_lines   order_id (int64), line (int32), product, quantity (int32)
+
+order_id is the position of the booking in the order file, starting at 0, and
+joins the two tables. Money is in whole cents (see money.py).
+
+Layout of an export directory:
+
+    manifest.json                      tables, row counts and columns
+    <table>.<column>.npy               one NumPy .npy file (format 1.0, little-endian) per column
+    <table>.<column>.dictionary.json   for string columns: the distinct values, as a JSON list
+
+String columns are dictionary-encoded: the .npy file holds int32 codes into
+the dictionary, so a guest name or product ID is stored once however many
+rows use it. Every column file is a standard .npy file that numpy.load() reads
+(memory-mapped if wished); NumPy is not needed to write or read the export.
+
+Rows are written in batches of batch_rows as the order file is read, so memory
+use stays bounded by the batch size and the dictionaries, not the history.
+Readers open only the columns they ask for:
+
+    python index3__HDlevel.py export orders_columnar
+    columns = ColumnarOrders("orders_columnar")
+    revenue = sum(columns.column("orders", "total_cents"))
+'''
+import json
+import os
+import struct
+import sys
+from array import array
+
+from order_import import parse_order_line
+
+MANIFEST = 'manifest.json'
+FORMAT = 'pos-columnar'
+VERSION = 1
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_HEADER_BYTES = 128  # fixed, so the row count can be filled in once the column is complete
+
+# Column name -> (array typecode, .npy dtype, dictionary-encoded) for each table
+TABLES = {
+    'orders': {
+        'order_id': ('q', '<i8', False),
+        'guest': ('i', '<i4', True),
+        'total_cents': ('q', '<i8', False),
+        'reward_points': ('q', '<i8', False),
+        'booking_date': ('i', '<i4', True),
+    },
+    'order_lines': {
+        'order_id': ('q', '<i8', False),
+        'line': ('i', '<i4', False),
+        'product': ('i', '<i4', True),
+        'quantity': ('i', '<i4', False),
+    },
+}
+
+
+# Magic, header length, then the header dict padded with spaces to NPY_HEADER_BYTES in all
+def npy_header(descr, rows):
+    size = NPY_HEADER_BYTES - len(NPY_MAGIC) - 2
+    text = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({rows},), }}".ljust(size - 1) + '\n'
+    return NPY_MAGIC + struct.pack('<H', size) + text.encode('latin1')
+
+
+class ColumnFile:
+    def __init__(self, path, typecode, descr):
+        self.path = path
+        self.typecode = typecode
+        self.descr = descr
+        self.rows = 0
+        self.file = open(path, 'wb')
+        self.file.write(npy_header(descr, 0))
+
+    def append(self, values):
+        data = array(self.typecode, values)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        data.tofile(self.file)
+        self.rows += len(data)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(npy_header(self.descr, self.rows))
+        self.file.close()
+
+
+# Value -> code in first-seen order; looking up a new value gives it the next code, so encoding
+# a value that has been seen before is a single dict lookup
+class Dictionary(dict):
+    def __init__(self):
+        super().__init__()
+        self.values = []
+
+    def __missing__(self, value):
+        code = self[value] = len(self.values)
+        self.values.append(value)
+        return code
+
+
+class ColumnarWriter:
+    def __init__(self, directory, batch_rows=65536):
+        self.directory = directory
+        self.batch_rows = batch_rows
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        self.batches = {}
+        self.dictionaries = {}
+        for table, columns in TABLES.items():
+            for name, (typecode, descr, encoded) in columns.items():
+                self.files[table, name] = ColumnFile(os.path.join(directory, f"{table}.{name}.npy"), typecode, descr)
+                self.batches[table, name] = []
+                if encoded:
+                    self.dictionaries[table, name] = Dictionary()
+        self.orders = 0
+
+    # Called once per booking, so the columns are spelled out rather than looked up by name
+    def add(self, guest_name, booking):
+        batches, dictionaries = self.batches, self.dictionaries
+        order_id = self.orders
+        self.orders += 1
+        batches['orders', 'order_id'].append(order_id)
+        batches['orders', 'guest'].append(dictionaries['orders', 'guest'][guest_name])
+        batches['orders', 'total_cents'].append(booking['total_cents'])
+        batches['orders', 'reward_points'].append(booking['reward_points'])
+        batches['orders', 'booking_date'].append(dictionaries['orders', 'booking_date'][booking['booking_date']])
+        line_ids, lines = batches['order_lines', 'order_id'], batches['order_lines', 'line']
+        products, quantities = batches['order_lines', 'product'], batches['order_lines', 'quantity']
+        product_codes = dictionaries['order_lines', 'product']
+        for line, (product, quantity) in enumerate(booking['orders']):
+            line_ids.append(order_id)
+            lines.append(line)
+            products.append(product_codes[product])
+            quantities.append(quantity)
+        if len(line_ids) >= self.batch_rows or len(batches['orders', 'order_id']) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        for key, batch in self.batches.items():
+            if batch:
+                self.files[key].append(batch)
+                batch.clear()
+
+    # Writes the last batch, the dictionaries and the manifest; returns the manifest
+    def close(self):
+        self.flush()
+        manifest = {'format': FORMAT, 'version': VERSION, 'tables': {}}
+        for table, columns in TABLES.items():
+            described = {}
+            for name, (typecode, descr, encoded) in columns.items():
+                column = self.files[table, name]
+                column.close()
+                described[name] = {'file': os.path.basename(column.path), 'dtype': descr}
+                if encoded:
+                    dictionary_file = f"{table}.{name}.dictionary.json"
+                    with open(os.path.join(self.directory, dictionary_file), 'w') as file:
+                        json.dump(self.dictionaries[table, name].values, file)
+                    described[name]['dictionary'] = dictionary_file
+            manifest['tables'][table] = {'rows': self.files[table, 'order_id'].rows, 'columns': described}
+        with open(os.path.join(self.directory, MANIFEST), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        return manifest
+
+
+# Streams an order file into a columnar export; returns (bookings, order lines, invalid lines)
+def export_orders(order_file, directory, batch_rows=65536):
+    writer = ColumnarWriter(directory, batch_rows)
+    invalid = []
+    with open(order_file, 'r') as file:
+        for line in file:
+            try:
+                parsed = parse_order_line(line)
+            except ValueError:
+                invalid.append(line.strip())
+                continue
+            if parsed is not None:
+                writer.add(*parsed)
+    manifest = writer.close()
+    return manifest['tables']['orders']['rows'], manifest['tables']['order_lines']['rows'], invalid
+
+
+class ColumnarOrders:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), 'r') as file:
+            self.manifest = json.load(file)
+        if self.manifest.get('format') != FORMAT or self.manifest.get('version') != VERSION:
+            raise ValueError(f"{directory} is not a version {VERSION} columnar order export.")
+
+    def rows(self, table):
+        return self.manifest['tables'][table]['rows']
+
+    def columns(self, table):
+        return list(self.manifest['tables'][table]['columns'])
+
+    # The values of one column (codes, for a string column) as an array('q') or array('i'); only
+    # that column's file is read
+    def column(self, table, name):
+        info = self.manifest['tables'][table]['columns'][name]
+        typecode = TABLES[table][name][0]
+        values = array(typecode)
+        with open(os.path.join(self.directory, info['file']), 'rb') as file:
+            if file.read(len(NPY_MAGIC)) != NPY_MAGIC:
+                raise ValueError(f"{info['file']} is not a .npy file.")
+            (header_size,) = struct.unpack('<H', file.read(2))
+            file.seek(len(NPY_MAGIC) + 2 + header_size)
+            values.fromfile(file, self.rows(table))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def dictionary(self, table, name):
+        info = self.manifest['tables'][table]['columns'][name]
+        with open(os.path.join(self.directory, info['dictionary']), 'r') as file:
+            return json.load(file)
+
+    # A string column decoded to its values
+    def strings(self, table, name):
+        values = self.dictionary(table, name)
+        return [values[code] for code in self.column(table, name)]
@@ -0,0 +1,211 @@
+'''
+Local daemon mode: a long-running process keeps the records and order history in
+memory and answers commands over a Unix domain socket.
+
+Start the daemon with
+
+    python index3__HDlevel.py serve --socket pos.sock
+
+and send it commands with the thin client in this file:
+
+    python daemon.py --socket pos.sock history Alyssa
+    python daemon.py --socket pos.sock stats --top 5
+    python daemon.py --socket pos.sock quote Alyssa 2 U12swan 01-01-2027 05-01-2027 --item SI1 1
+    python daemon.py --socket pos.sock book <quote ID>
+
+Each message is a 4-byte big-endian length followed by that many bytes of UTF-8
+JSON. A request is {"command": ..., "args": {...}} and the reply is
+{"ok": true, "result": ...} or {"ok": false, "error": <exception name>,
+"message": ...}. A connection can carry any number of requests.
+
+The socket is created readable and writable by its owner only. A daemon refuses
+to start when the path is taken by anything other than the socket of a daemon
+that is no longer running.
+'''
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import time
+
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 16 << 20  # refuse anything larger than 16 MB
+
+
+def send_message(sock, message):
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def _receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+# The next message on the socket, or None once the other side has closed it
+def receive_message(sock):
+    header = _receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ValueError(f"Message of {size} bytes is too large.")
+    payload = _receive_exactly(sock, size)
+    if payload is None:
+        return None
+    return json.loads(payload.decode('utf-8'))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (ValueError, OSError):
+                return
+            if request is None:
+                return
+            try:
+                result = self.server.dispatch(request.get('command'), request.get('args') or {})
+                reply = {'ok': True, 'result': result}
+            except Exception as e:
+                reply = {'ok': False, 'error': type(e).__name__, 'message': str(e)}
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class SocketInUseError(Exception):
+    pass
+
+
+# Removes the socket file of a daemon that did not shut down cleanly. Anything else at the path,
+# a file or the socket of a daemon that still answers, raises SocketInUseError.
+def remove_stale_socket(path):
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise SocketInUseError(f"{path} exists and is not a socket; not replacing it.")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise SocketInUseError(f"A daemon is already listening on {path}.")
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # dispatch(command, args) returns a JSON-serializable result or raises
+    def __init__(self, path, dispatch):
+        remove_stale_socket(path)
+        self.path = path
+        self.dispatch = dispatch
+        super().__init__(path, _Handler)
+
+    # Creates the socket file with mode 0600, so other local users cannot connect
+    def server_bind(self):
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(path, dispatch):
+    try:
+        server = DaemonServer(path, dispatch)
+    except SocketInUseError as e:
+        print(e)
+        return
+    signal.signal(signal.SIGTERM, _stop)  # shut down cleanly and remove the socket file
+    print(f"Listening on {path}. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class Client:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+    def call(self, command, **args):
+        send_message(self.sock, {'command': command, 'args': args})
+        reply = receive_message(self.sock)
+        if reply is None:
+            raise ConnectionError("The daemon closed the connection.")
+        return reply
+
+    def close(self):
+        self.sock.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Send a command to a running booking system daemon.")
+    parser.add_argument("--socket", default="pos.sock")
+    commands = parser.add_subparsers(dest="command", required=True)
+    history = commands.add_parser("history")
+    history.add_argument("guest_name")
+    stats = commands.add_parser("stats")
+    stats.add_argument("--top", type=int, default=3)
+    quote = commands.add_parser("quote")
+    quote.add_argument("guest_name")
+    quote.add_argument("number_of_guests", type=int)
+    quote.add_argument("apartment_id")
+    quote.add_argument("check_in")
+    quote.add_argument("check_out")
+    quote.add_argument("--item", nargs=2, action="append", default=[], metavar=("PRODUCT_ID", "QUANTITY"))
+    book = commands.add_parser("book")
+    book.add_argument("quote_id", type=int)
+    book.add_argument("--use-rewards", action="store_true")
+    cancel = commands.add_parser("cancel")
+    cancel.add_argument("quote_id", type=int)
+    args = vars(parser.parse_args(argv))
+    path, command = args.pop('socket'), args.pop('command')
+    if command == 'stats':
+        args['top_n'] = args.pop('top')
+    if command == 'quote':
+        args['items'] = [[product_id, int(quantity)] for product_id, quantity in args.pop('item')]
+
+    client = Client(path)
+    start = time.perf_counter()
+    reply = client.call(command, **args)
+    elapsed = time.perf_counter() - start
+    client.close()
+    print(json.dumps(reply.get('result') if reply['ok'] else reply, indent=2))
+    print(f"{command} took {elapsed * 1000:.2f} ms", file=sys.stderr)
+    return 0 if reply['ok'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,156 @@
+'''
+Finding duplicate guests among millions without comparing every pair.
+
+Each guest gets two blocking keys:
+
+- its normalized name: accents, case, punctuation and extra spaces removed
+  ("  ALYSSA  né" -> "alyssa ne");
+- the Soundex code of each word of that name ("Alysa Ne" -> "A420 N000").
+
+Only guests that share a key are compared. Guests with the same normalized
+name are duplicates outright and are joined without scoring. The distinct
+names that only share a Soundex key are scored by string similarity
+(difflib's ratio, 0 to 1) and joined at or above the threshold. The cheap
+upper bounds real_quick_ratio() and quick_ratio() rule out most pairs before
+ratio() is computed. A Soundex block with more than MAX_BLOCK distinct names is
+sorted and each name is compared with the next WINDOW names only, so the work
+grows linearly with the number of guests.
+
+Joined guests are collected with union-find, so duplicates of duplicates end
+up in one group.
+
+    python dedup.py guests.csv --threshold 0.9
+'''
+import argparse
+import time
+import unicodedata
+from difflib import SequenceMatcher
+
+MAX_BLOCK = 200  # distinct names a Soundex block may have before it is compared by sorted window
+WINDOW = 20
+
+SOUNDEX_CODES = {letter: code for letters, code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'),
+                                                    ('mn', '5'), ('r', '6'))
+                 for letter in letters}
+
+
+def normalize_name(name):
+    if name.isascii() and name.replace(' ', '').isalpha():  # the usual case, as guest names are letters and spaces
+        return ' '.join(name.casefold().split())
+    decomposed = unicodedata.normalize('NFKD', name)
+    letters = ''.join(char if char.isalpha() else ' ' for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(letters.casefold().split())
+
+
+# American Soundex of one word: first letter and three digits, e.g. "Robert" -> "R163"
+def soundex(word):
+    if not word:
+        return ''
+    code = word[0].upper()
+    previous = SOUNDEX_CODES.get(word[0].lower(), '')
+    for char in word[1:].lower():
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in 'hw':  # letters separated by h or w count as adjacent
+            previous = digit
+    return code.ljust(4, '0')
+
+
+# Soundex codes of the words of a normalized name; codes caches them by word
+def phonetic_key(normalized, codes=None):
+    if codes is None:
+        return ' '.join([soundex(word) for word in normalized.split()])
+    key = []
+    for word in normalized.split():
+        code = codes.get(word)
+        if code is None:
+            code = codes[word] = soundex(word)
+        key.append(code)
+    return ' '.join(key)
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent
+        root = parent.setdefault(item, item)
+        while parent[root] != root:
+            parent[root] = parent[parent[root]]  # path halving
+            root = parent[root]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+
+# Pairs of distinct names in one Soundex block whose similarity reaches the threshold. The matcher
+# keeps what it computed about its second sequence, so each name is set as that once.
+def _similar_pairs(names, threshold):
+    names = sorted(names)
+    window = len(names) if len(names) <= MAX_BLOCK else WINDOW
+    matcher = SequenceMatcher(None, autojunk=False)
+    for index, a in enumerate(names):
+        matcher.set_seq2(a)
+        for b in names[index + 1:index + 1 + window]:
+            matcher.set_seq1(b)
+            if matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold \
+                    and matcher.ratio() >= threshold:
+                yield a, b
+
+
+# guests: (guest ID, name) pairs. Returns the groups of duplicate guest IDs, each in input order,
+# largest group first; guests without duplicates are left out.
+def find_duplicate_groups(guests, threshold=0.9):
+    by_name = {}  # normalized name -> guest IDs
+    order = {}
+    for position, (guest_id, name) in enumerate(guests):
+        order[guest_id] = position
+        by_name.setdefault(normalize_name(name), []).append(guest_id)
+
+    union = UnionFind()
+    blocks = {}  # Soundex key -> normalized names
+    codes = {}
+    for normalized, guest_ids in by_name.items():
+        for guest_id in guest_ids[1:]:
+            union.union(guest_ids[0], guest_id)
+        blocks.setdefault(phonetic_key(normalized, codes), []).append(normalized)
+
+    for names in blocks.values():
+        if len(names) < 2:
+            continue
+        for a, b in _similar_pairs(names, threshold):
+            union.union(by_name[a][0], by_name[b][0])
+
+    groups = {}
+    for guest_id in union.parent:
+        groups.setdefault(union.find(guest_id), []).append(guest_id)
+    groups = [sorted(group, key=order.get) for group in groups.values() if len(group) > 1]
+    groups.sort(key=lambda group: (-len(group), order[group[0]]))
+    return groups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List duplicate guests in a guest file without changing it.")
+    parser.add_argument("guest_file")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--show", type=int, default=20, help="groups to print")
+    args = parser.parse_args()
+    names = {}
+    with open(args.guest_file, 'r') as file:
+        for line in file:
+            parts = [part.strip() for part in line.split(',')]
+            if len(parts) >= 2:
+                names[parts[0]] = parts[1]
+    start = time.perf_counter()
+    groups = find_duplicate_groups(names.items(), args.threshold)
+    elapsed = time.perf_counter() - start
+    for group in groups[:args.show]:
+        print(', '.join([f"{guest_id} ({names[guest_id]})" for guest_id in group]))
+    print(f"{len(groups)} groups covering {sum(map(len, groups))} of {len(names)} guests, found in {elapsed:.2f} s.")
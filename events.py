@@ -0,0 +1,216 @@
+'''
+Change-data-capture log of bookings, reward changes and catalog edits.
+
+Every event gets the next sequence number and is written as one frame:
+
+    4-byte big-endian payload length | 8-byte big-endian sequence number | UTF-8 JSON payload
+
+The payload is {"type": ..., "time": <unix seconds>, "data": {...}}. Frames go
+to segment files named events.<first sequence number>.log in the log
+directory, and a new segment is started once the current one reaches
+segment_bytes. Only the newest keep_segments segments are kept.
+
+emit() only appends the event to an in-memory buffer. A background thread
+writes the buffer out every flush_interval seconds, so the booking path never
+waits for the disk; flush() waits until everything emitted so far is written.
+Consumers read from any sequence number with read_events(), or follow the log:
+
+    python events.py events --from 120 --follow
+
+The booking system writes the log when POS_EVENTS names its directory
+(POS_EVENTS_SEGMENT_BYTES and POS_EVENTS_KEEP change the rotation).
+'''
+import argparse
+import atexit
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+FRAME = struct.Struct('>IQ')
+SEGMENT_PREFIX = 'events.'
+SEGMENT_SUFFIX = '.log'
+
+
+def segment_name(first_seq):
+    return f"{SEGMENT_PREFIX}{first_seq:020d}{SEGMENT_SUFFIX}"
+
+
+# (first sequence number, path) of each segment, oldest first
+def list_segments(directory):
+    segments = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                number = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+                if number.isdigit():
+                    segments.append((int(number), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+# Frames of one segment as (sequence number, payload bytes, end offset). Stops at a frame cut
+# short by a crash.
+def read_frames(path):
+    with open(path, 'rb') as file:
+        offset = 0
+        while True:
+            header = file.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            size, seq = FRAME.unpack(header)
+            payload = file.read(size)
+            if len(payload) < size:
+                return
+            offset += FRAME.size + size
+            yield seq, payload, offset
+
+
+# Events with a sequence number of at least from_seq, as (sequence number, event dict)
+def read_events(directory, from_seq=0):
+    segments = list_segments(directory)
+    for index, (first_seq, path) in enumerate(segments):
+        if index + 1 < len(segments) and segments[index + 1][0] <= from_seq:
+            continue  # every event in this segment is older than from_seq
+        for seq, payload, _ in read_frames(path):
+            if seq >= from_seq:
+                yield seq, json.loads(payload.decode('utf-8'))
+
+
+class EventLog:
+    def __init__(self, directory, segment_bytes=16 << 20, keep_segments=10, flush_interval=0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.next_seq = self._recover()
+        self.written_seq = self.next_seq - 1  # highest sequence number on disk
+        self.pending = []  # (sequence number, type, time, data)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.file = None  # segment being written, opened by the first write
+        self.file_size = 0
+        self.thread = threading.Thread(target=self._flush_loop, name="event-log", daemon=True)
+        self.thread.start()
+
+    # Next sequence number after the last complete frame; a partly written final frame is cut off
+    def _recover(self):
+        segments = list_segments(self.directory)
+        if not segments:
+            return 1
+        first_seq, path = segments[-1]
+        last_seq, end = first_seq - 1, 0
+        for seq, _, offset in read_frames(path):
+            last_seq, end = seq, offset
+        if os.path.getsize(path) != end:
+            with open(path, 'r+b') as file:
+                file.truncate(end)
+        return last_seq + 1
+
+    # Queues an event and returns its sequence number; data must be JSON-serializable
+    def emit(self, event_type, data):
+        with self.condition:
+            if self.closed:
+                raise ValueError("The event log is closed.")
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending.append((seq, event_type, time.time(), data))
+        return seq
+
+    # Waits until every event emitted so far is written and synced
+    def flush(self):
+        with self.condition:
+            target = self.next_seq - 1
+            self.condition.notify_all()
+            while self.written_seq < target and self.thread.is_alive():
+                self.condition.wait(0.1)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                if not self.pending and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                batch, self.pending = self.pending, []
+                closing = self.closed
+            if batch:
+                self._write(batch)
+                with self.condition:
+                    self.written_seq = batch[-1][0]
+                    self.condition.notify_all()
+            if closing and not batch:
+                if self.file is not None:
+                    self.file.close()
+                return
+
+    def _write(self, batch):
+        if self.file is None:
+            self._open_segment(batch[0][0])
+        chunks = []
+        for seq, event_type, timestamp, data in batch:
+            payload = json.dumps({'type': event_type, 'time': timestamp, 'data': data},
+                                 separators=(',', ':')).encode('utf-8')
+            if self.file_size >= self.segment_bytes:
+                self._sync(chunks)
+                chunks = []
+                self.file.close()
+                self._open_segment(seq, new=True)
+            chunks.append(FRAME.pack(len(payload), seq) + payload)
+            self.file_size += FRAME.size + len(payload)
+        self._sync(chunks)
+
+    def _sync(self, chunks):
+        self.file.write(b''.join(chunks))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # Carries on with the newest segment after a restart, unless it is full; otherwise starts a
+    # segment at first_seq and removes the oldest ones beyond keep_segments
+    def _open_segment(self, first_seq, new=False):
+        segments = list_segments(self.directory)
+        if segments and not new and os.path.getsize(segments[-1][1]) < self.segment_bytes:
+            path = segments[-1][1]
+        else:
+            path = os.path.join(self.directory, segment_name(first_seq))
+            for _, old in (segments + [(first_seq, path)])[:-self.keep_segments]:
+                os.remove(old)
+        self.file = open(path, 'ab')
+        self.file_size = self.file.tell()
+
+
+# The event log named by POS_EVENTS, closed (and so flushed) at exit, or None when it is not set
+def open_from_env(environ=os.environ):
+    directory = environ.get('POS_EVENTS')
+    if not directory:
+        return None
+    log = EventLog(directory, segment_bytes=int(environ.get('POS_EVENTS_SEGMENT_BYTES', 16 << 20)),
+                   keep_segments=int(environ.get('POS_EVENTS_KEEP', 10)))
+    atexit.register(log.close)
+    return log
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Print the events of a change-data-capture log as JSON lines.")
+    parser.add_argument("directory")
+    parser.add_argument("--from", dest="from_seq", type=int, default=0)
+    parser.add_argument("--follow", action="store_true", help="keep waiting for new events")
+    args = parser.parse_args(argv)
+    next_seq = args.from_seq
+    while True:
+        for seq, event in read_events(args.directory, next_seq):
+            print(json.dumps(dict(event, seq=seq)), flush=True)
+            next_seq = seq + 1
+        if not args.follow:
+            return
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
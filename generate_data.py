@@ -0,0 +1,288 @@
+'''
+Synthetic data generator for load testing the booking system.
+
+Writes guests.csv, products.csv and orders.csv in the same formats that
+Records.read_guests, Records.read_products and Operations.load_orders read.
+Every row is derived from the seed and its own index, so the output is the
+same on every run and memory stays constant however many rows are written.
+
+Usage:
+    python generate_data.py --out-dir data --guests 100000 --orders 5000000
+'''
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+# Building names used for apartment IDs, extended with made up names when more are needed
+BUILDINGS = ["swan", "duck", "goose", "heron", "crane", "ibis", "egret", "pelican", "stork", "finch"]
+
+# The standard supplementary items from products.csv, always written first as SI1..SI6
+BASE_ITEMS = [
+    ("Car Park", 25.00),
+    ("Breakfast", 25.30),
+    ("Tooth brush", 10.00),
+    ("Tooth paste", 5.00),
+    ("Shampoo", 20.50),
+    ("Double extra bed (2 people)", 50.00),
+]
+
+FIRST_NAMES = ["Alyssa", "Luigi", "James", "Mia", "Noah", "Olivia", "Liam", "Ava", "Ethan", "Zoe",
+               "Lucas", "Chloe", "Oscar", "Ruby", "Henry", "Grace", "Jack", "Isla", "Leo", "Emily"]
+SYLLABLES = ["ba", "ko", "ri", "ta", "mu", "ne", "lo", "sa", "vi", "de", "ga", "pu", "ze", "ho", "fi", "ma"]
+
+# Relative check-in demand for each month (January first), peaking over the summer holidays
+SEASON_WEIGHTS = [14, 10, 7, 8, 5, 4, 6, 5, 5, 7, 9, 14]
+
+BUFFER_ROWS = 10000
+MASK64 = (1 << 64) - 1
+
+
+# Deterministic 64-bit mixing function, so an entity's attributes depend only on (seed, kind, index)
+def splitmix64(value):
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def entity_hash(seed, kind, index):
+    return splitmix64(splitmix64(seed * 31 + kind) ^ index)
+
+
+def building_name(index):
+    if index < len(BUILDINGS):
+        return BUILDINGS[index]
+    return syllable_word(index) + "wing"
+
+
+def syllable_word(index):
+    word = ""
+    while True:
+        word += SYLLABLES[index % len(SYLLABLES)]
+        index //= len(SYLLABLES)
+        if index == 0:
+            return word
+
+
+# Guest names are unique letters-and-spaces strings so they pass the booking name validation
+def guest_name(index):
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    return f"{first} {syllable_word(index // len(FIRST_NAMES)).capitalize()}"
+
+
+class ZipfSampler:
+    # Rejection-inversion sampling of ranks 1..n with P(k) ~ 1/k^s, in O(1) memory
+    # (W. Hormann and G. Derflinger, "Rejection-inversion to generate variates from
+    # monotone discrete distributions", 1996).
+    def __init__(self, n, skew, rng):
+        self.n = n
+        self.skew = skew
+        self.rng = rng
+        if skew > 0:
+            self.h_integral_x1 = self.h_integral(1.5) - 1.0
+            self.h_integral_n = self.h_integral(n + 0.5)
+            self.s = 2 - self.h_integral_inverse(self.h_integral(2.5) - self.h(2))
+
+    def sample(self):
+        if self.skew <= 0:
+            return self.rng.randrange(self.n) + 1
+        while True:
+            u = self.h_integral_n + self.rng.random() * (self.h_integral_x1 - self.h_integral_n)
+            x = self.h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), self.n)
+            if k - x <= self.s or u >= self.h_integral(k + 0.5) - self.h(k):
+                return k
+
+    def h(self, x):
+        return math.exp(-self.skew * math.log(x))
+
+    def h_integral(self, x):
+        log_x = math.log(x)
+        return self.helper2((1 - self.skew) * log_x) * log_x
+
+    def h_integral_inverse(self, x):
+        t = max(x * (1 - self.skew), -1)
+        return math.exp(self.helper1(t) * x)
+
+    @staticmethod
+    def helper1(x):
+        # log1p(x) / x, accurate near zero
+        if abs(x) > 1e-8:
+            return math.log1p(x) / x
+        return 1 - x * (0.5 - x * (1 / 3 - 0.25 * x))
+
+    @staticmethod
+    def helper2(x):
+        # expm1(x) / x, accurate near zero
+        if abs(x) > 1e-8:
+            return math.expm1(x) / x
+        return 1 + x * 0.5 * (1 + x / 3 * (1 + 0.25 * x))
+
+
+class HotelDataGenerator:
+    def __init__(self, seed=42, apartments=20, items=6, bundles=4, guests=1000, orders=10000,
+                 skew=1.1, buildings=3, start_date=date(2024, 1, 1), days=730, max_items=4):
+        if apartments < 1 or guests < 1 or buildings < 1 or days < 1:
+            raise ValueError("apartments, guests, buildings and days must be at least 1.")
+        self.seed = seed
+        self.apartments = apartments
+        self.items = max(items, len(BASE_ITEMS))
+        self.bundles = bundles
+        self.guests = guests
+        self.orders = orders
+        self.skew = skew
+        self.buildings = buildings
+        self.start_date = start_date
+        self.days = days
+        self.max_items = max_items
+
+    # ---- catalog entities, all recomputed from their index ----
+
+    def apartment(self, index):
+        h = entity_hash(self.seed, 1, index)
+        building = building_name(index % self.buildings)
+        number = index // self.buildings + 10
+        price = 100 + (h % 20000) / 100  # $100.00 to $299.99 per night
+        capacity = 1 + (h >> 20) % 4
+        return f"U{number}{building}", f"Unit {number} {building.capitalize()} Building", round(price, 2), capacity
+
+    def item(self, index):
+        if index < len(BASE_ITEMS):
+            name, price = BASE_ITEMS[index]
+        else:
+            h = entity_hash(self.seed, 2, index)
+            name, price = f"Extra item {index + 1}", round(2 + (h % 6000) / 100, 2)
+        return f"SI{index + 1}", name, price
+
+    def bundle(self, index):
+        h = entity_hash(self.seed, 3, index)
+        apartment = self.apartment(h % self.apartments)
+        components = [apartment]
+        # At least three components in total, so the bundle row has the columns read_products expects
+        for n in range(2 + (h >> 16) % 5):
+            components.append(self.item(entity_hash(self.seed, 4, index * 8 + n) % self.items))
+        price = round(sum(component[2] for component in components) * 0.80, 2)
+        return f"B{index + 1}", f"Bundle {index + 1} for {apartment[0]}", [c[0] for c in components], price
+
+    # ---- file writers ----
+
+    def write_guests(self, filename):
+        with open(filename, 'w', buffering=1 << 20) as file:
+            buffer = []
+            for index in range(self.guests):
+                h = entity_hash(self.seed, 5, index)
+                buffer.append(f"{index + 1}, {guest_name(index)}, 100, {h % 500}, 1\n")
+                if len(buffer) >= BUFFER_ROWS:
+                    file.write(''.join(buffer))
+                    buffer.clear()
+            file.write(''.join(buffer))
+
+    def write_products(self, filename):
+        with open(filename, 'w', buffering=1 << 20) as file:
+            buffer = []
+            for index in range(self.apartments):
+                unit_id, name, price, capacity = self.apartment(index)
+                buffer.append(f"{unit_id}, {name}, {price:.2f}, {capacity}\n")
+                if len(buffer) >= BUFFER_ROWS:
+                    file.write(''.join(buffer))
+                    buffer.clear()
+            for index in range(self.items):
+                item_id, name, price = self.item(index)
+                buffer.append(f"{item_id}, {name}, {price:.2f}\n")
+            for index in range(self.bundles):
+                bundle_id, name, components, price = self.bundle(index)
+                buffer.append(f"{bundle_id}, {name}, {', '.join(components)}, {price:.2f}\n")
+            file.write(''.join(buffer))
+
+    def write_orders(self, filename):
+        rng = random.Random(self.seed)
+        guest_sampler = ZipfSampler(self.guests, self.skew, rng)
+        # Each day of the check-in period weighs as much as its month's demand
+        days = range(self.days)
+        cum_weights = list(itertools.accumulate(SEASON_WEIGHTS[(self.start_date + timedelta(days=offset)).month - 1]
+                                                for offset in days))
+        with open(filename, 'w', buffering=1 << 20) as file:
+            buffer = []
+            for _ in range(self.orders):
+                buffer.append(self.order_row(rng, guest_sampler, days, cum_weights))
+                if len(buffer) >= BUFFER_ROWS:
+                    file.write(''.join(buffer))
+                    buffer.clear()
+            file.write(''.join(buffer))
+
+    def order_row(self, rng, guest_sampler, days, cum_weights):
+        name = guest_name(guest_sampler.sample() - 1)
+        lines = []
+        total = 0.0
+
+        unit_id, _, unit_price, _ = self.apartment(rng.randrange(self.apartments))
+        nights = rng.randint(1, 14)
+        lines.append(f"{nights} x {unit_id}")
+        total += unit_price * nights
+
+        for _ in range(rng.randint(0, self.max_items)):
+            item_id, _, item_price = self.item(rng.randrange(self.items))
+            quantity = rng.randint(1, 4)
+            lines.append(f"{quantity} x {item_id}")
+            total += item_price * quantity
+
+        if self.bundles and rng.random() < 0.1:
+            bundle_id, _, _, bundle_price = self.bundle(rng.randrange(self.bundles))
+            lines.append(f"1 x {bundle_id}")
+            total += bundle_price
+
+        total = round(total, 2)
+        check_in = self.seasonal_date(rng, days, cum_weights)
+        return f"{name},{', '.join(lines)},{total},{int(total)},{check_in.strftime('%d-%m-%Y')}\n"
+
+    # A day from start_date to start_date + days - 1, drawn by the season weight of its month
+    def seasonal_date(self, rng, days, cum_weights):
+        return self.start_date + timedelta(days=rng.choices(days, cum_weights=cum_weights)[0])
+
+    def write_all(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        self.write_guests(os.path.join(out_dir, 'guests.csv'))
+        self.write_products(os.path.join(out_dir, 'products.csv'))
+        self.write_orders(os.path.join(out_dir, 'orders.csv'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic guests, products and orders files.")
+    parser.add_argument("--out-dir", default="generated", help="directory to write the csv files into")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--apartments", type=int, default=20, help="number of apartment units")
+    parser.add_argument("--items", type=int, default=6, help="number of supplementary items (at least 6)")
+    parser.add_argument("--bundles", type=int, default=4)
+    parser.add_argument("--buildings", type=int, default=3)
+    parser.add_argument("--guests", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of guest popularity (0 = uniform)")
+    parser.add_argument("--max-items", type=int, default=4, help="maximum supplementary lines per order")
+    parser.add_argument("--start-date", default="01-01-2024", help="first check-in day (dd-mm-yyyy)")
+    parser.add_argument("--days", type=int, default=730, help="length of the check-in period in days")
+    args = parser.parse_args(argv)
+
+    try:
+        start = datetime_from(args.start_date)
+        generator = HotelDataGenerator(args.seed, args.apartments, args.items, args.bundles, args.guests,
+                                       args.orders, args.skew, args.buildings, start, args.days, args.max_items)
+    except ValueError as e:
+        print(f"Invalid argument: {e}")
+        sys.exit(1)
+
+    generator.write_all(args.out_dir)
+    print(f"Generated {args.guests} guests, {generator.apartments + generator.items + generator.bundles} products "
+          f"and {args.orders} orders in '{args.out_dir}'.")
+
+
+def datetime_from(date_str):
+    day, month, year = (int(part) for part in date_str.split('-'))
+    return date(year, month, day)
+
+
+if __name__ == "__main__":
+    main()
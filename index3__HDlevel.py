@@ -7,9 +7,25 @@ I have used all the resources of canvas pdf file provided , websites like w3wsch
 of chatgpt as well as it got complex for debugging and some of the logics used in code.
 
 '''
+import argparse
 import sys
-from datetime import datetime
+from bisect import bisect_right, insort
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import gc
 import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+from instrumentation import metrics
+from inventory import HoldExpiredError, Holds, InsufficientStockError, Inventory, StockLedger
+from money import dollars, format_cents, percent_of, to_cents, total_cents
+from order_import import parse_order_line, read_open_stays
+from rendering import console, guest_row, order_row, product_row
+from validators import BuildingRegistry, apartment_building, valid_guest_name
 
 # Global dictionary to store guest bookings
 guest_booking = {}
@@ -30,6 +46,9 @@ class InvalidDateError(Exception):
 class InvalidInputError(Exception):
     pass
 
+class QuoteExpiredError(Exception):
+    pass
+
 class Guest:
     def __init__(self, guest_id, name, reward, reward_rate=100, redeem_rate=1):
         self.guest_id = guest_id
@@ -50,8 +69,9 @@ class Guest:
             raise InvalidInputError("Invalid redeem rate. Please enter a positive number.")
         self.redeem_rate = new_rate
 
-    def get_reward_points(self, total_cost):
-        return round(total_cost * (self.reward_rate / 100))
+    # Reward points earned on a total in cents: reward_rate points per 100 dollars spent
+    def get_reward_points(self, total_cents):
+        return round(total_cents * self.reward_rate / 10000)
 
     def get_id(self):
         return self.guest_id
@@ -74,6 +94,15 @@ class Product:
         self.name = name
         self.price = price
 
+    # Price in dollars. It is kept as whole cents, so totals and bundle prices add up exactly.
+    @property
+    def price(self):
+        return dollars(self.price_cents)
+
+    @price.setter
+    def price(self, price):
+        self.price_cents = to_cents(price)
+
     def get_id(self):
         return self.product_id
 
@@ -83,8 +112,11 @@ class Product:
     def get_price(self):
         return self.price
 
+    def get_price_cents(self):
+        return self.price_cents
+
     def display_info(self):
-        print(f"Product ID: {self.product_id}, Name: {self.name}, Price: ${self.price:.2f}")
+        print(f"Product ID: {self.product_id}, Name: {self.name}, Price: ${format_cents(self.price_cents)}")
 
 class ApartmentUnit(Product):
     def __init__(self, product_id, name, price, capacity):
@@ -92,24 +124,41 @@ class ApartmentUnit(Product):
         self.capacity = capacity
 
     def display_info(self):
-        print(f"Apartment ID: {self.product_id}, Name: {self.name}, Price: ${self.price:.2f}, Capacity: {self.capacity} beds")
+        print(f"Apartment ID: {self.product_id}, Name: {self.name}, Price: ${format_cents(self.price_cents)}, Capacity: {self.capacity} beds")
 
 class SupplementaryItem(Product):
-    pass
+    # stock is the number of units available per night, or None when the item is not limited
+    def __init__(self, product_id, name, price, stock=None):
+        super().__init__(product_id, name, price)
+        self.stock = stock
 
 class Bundle(Product):
     def __init__(self, product_id, name, components, price=0):
         super().__init__(product_id, name, price)
-        self.components = components
+        # Components as a multiset (component ID -> quantity, in first-seen order), with the
+        # flattened list kept alongside as a tuple so it is computed once
+        self.component_counts = {}
+        for comp in components:
+            self.component_counts[comp] = self.component_counts.get(comp, 0) + 1
+        self.components = tuple(components)
+
+    def component_summary(self):
+        return ', '.join([f"{comp} x{quantity}" for comp, quantity in self.component_counts.items()])
 
     def display_info(self):
-        components_details = ', '.join([f"{comp} x{self.components.count(comp)}" for comp in set(self.components)])
-        print(f"Bundle ID: {self.product_id}, Name: {self.name}, Components: {components_details}, Price: ${self.price:.2f}")
+        print(f"Bundle ID: {self.product_id}, Name: {self.name}, Components: {self.component_summary()}, Price: ${format_cents(self.price_cents)}")
 
+    # Accepts a flattened component list or a component ID -> quantity mapping
     @staticmethod
-    def calculate_bundle_price(components, product_catalog):
-        total_price = sum(product_catalog[comp].get_price() for comp in components)
-        return total_price * 0.80  # Apply 80% discount for bundles
+    @metrics.timed('calculate_bundle_price')
+    def calculate_bundle_price_cents(components, product_catalog):
+        if not isinstance(components, dict):
+            counts = {}
+            for comp in components:
+                counts[comp] = counts.get(comp, 0) + 1
+            components = counts
+        total_price = sum(product_catalog[comp].get_price_cents() * quantity for comp, quantity in components.items())
+        return percent_of(total_price, 80)  # Apply 80% discount for bundles
 
 class Order:
     def __init__(self, guest, product, quantity):
@@ -117,28 +166,331 @@ class Order:
         self.product = product
         self.quantity = quantity
 
-    def compute_cost(self):
-        return self.product.get_price() * self.quantity, 0, self.product.get_price() * self.quantity, self.guest.get_reward_points(self.product.get_price() * self.quantity)
-
-    def display_receipt(self):
-        original_cost, discount, final_cost, reward_points = self.compute_cost()
-        print("========================================================")
-        print(f"Guest Name: {self.guest.get_name()}")
-        print(f"Product: {self.product.get_name()} (ID: {self.product.get_id()})")
-        print(f"Unit Price: ${self.product.get_price():.2f}")
-        print(f"Quantity: {self.quantity}")
-        print(f"Original Cost: ${original_cost:.2f}")
-        print(f"Discount: ${discount:.2f}")
-        print(f"Final Total Cost: ${final_cost:.2f}")
-        print(f"Earned Reward Points: {reward_points}")
-        print("========================================================")
+    def cost_cents(self):
+        return self.product.get_price_cents() * self.quantity
+
+    # Original cost, discount, final cost (all in cents) and the reward points earned
+    def compute_cost_cents(self):
+        cost = self.cost_cents()
+        return cost, 0, cost, self.guest.get_reward_points(cost)
+
+    def display_receipt(self, renderer=console):
+        renderer.render_receipt(self)
+
+# Sort keys accepted by the paginated listings
+PRODUCT_SORT_KEYS = {
+    'id': lambda product: product.get_id(),
+    'name': lambda product: product.get_name(),
+    'price': lambda product: product.get_price_cents(),
+    'capacity': lambda product: product.capacity,
+}
+GUEST_SORT_KEYS = {
+    'id': lambda guest: (0, int(guest.get_id()), '') if guest.get_id().isdigit() else (1, 0, guest.get_id()),
+    'name': lambda guest: guest.get_name(),
+}
+
+# A priced booking whose apartments and limited items are held until it is committed or expires
+class Quote:
+    def __init__(self, quote_id, guest_name, number_of_guests, apartments, check_in, check_out, lines):
+        self.quote_id = quote_id
+        self.guest_name = guest_name
+        self.number_of_guests = number_of_guests
+        self.apartments = apartments  # one unit, or every unit of a group booking
+        self.check_in = check_in    # dd-mm-yyyy strings as entered
+        self.check_out = check_out
+        self.lines = lines          # [(product, quantity)], extra beds first, then the apartment and extras
+        self.nights = (Operations.parse_date(check_out) - Operations.parse_date(check_in)).days
+        self.total_cents = sum(product.get_price_cents() * quantity for product, quantity in lines)
+
+# Attributes filled from each file; with deferred loading, the first use of one reads its file
+GUEST_ATTRIBUTES = {'guests', 'unique_guests', '_sorted_guests'}
+PRODUCT_ATTRIBUTES = {'products', 'product_keys', 'apartments', 'buildings', 'supplementary_items',
+                      'bundles', '_sorted_products'}
 
 class Records:
-    def __init__(self):
+    # Given file names, each file is only read the first time its data is used
+    def __init__(self, guest_file=None, product_file=None):
+        # Files the records were loaded from, and the entities changed since then
+        self.guest_file = guest_file
+        self.product_file = product_file
+        self.dirty_guests = set()
+        self.dirty_products = set()
+        self.events = None  # events.EventLog that changes are reported to, see attach_event_log()
+        if guest_file is None:
+            self._init_guests()
+        if product_file is None:
+            self._init_products()
+
+    def _init_guests(self):
         self.guests = {}
+        self.unique_guests = {}  # guest ID -> Guest, without the name aliases kept in self.guests
+        # Sorted (sort value, ID) lists for paginated listings, built on first use and kept up to date on insert
+        self._sorted_guests = {}
+
+    def _init_products(self):
         self.products = {}
+        self.product_keys = {}  # casefolded product ID -> product ID as loaded, for any-case lookups
+        # Products partitioned by type, kept up to date by add_product
+        self.apartments = {}
+        self.buildings = BuildingRegistry()  # buildings of the loaded apartment units
+        self.supplementary_items = {}
+        self.bundles = {}
+        self._sorted_products = {}
+
+    # Only called for attributes that are not set yet, i.e. data whose file was deferred
+    def __getattr__(self, name):
+        if name in GUEST_ATTRIBUTES:
+            self.read_guests(self.guest_file)
+        elif name in PRODUCT_ATTRIBUTES:
+            self.read_products(self.product_file)
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    def product_partition(self, product_type):
+        partitions = {'apartment': self.apartments, 'supplementary': self.supplementary_items, 'bundle': self.bundles}
+        return partitions.get(product_type.lower())
+
+    def add_product(self, product, dirty=True):
+        # An ID that differs only in case updates the existing product and keeps its display ID
+        product_id = self.product_keys.get(product.get_id().casefold())
+        if product_id is None:
+            product_id = sys.intern(product.get_id())
+            self.product_keys[product_id.casefold()] = product_id
+        product.product_id = product_id
+        if dirty:
+            self.dirty_products.add(product_id)
+            self.emit('product', {'row': product_store_row(product)})
+        existing = self.products.get(product_id)
+        if existing is not None:
+            self._type_partition(existing).pop(product_id, None)
+            for (product_type, sort_by), index in self._sorted_products.items():
+                if self.product_partition(product_type) is self._type_partition(existing):
+                    self._remove_sorted(index, (PRODUCT_SORT_KEYS[sort_by](existing), product_id))
+        self.products[product_id] = product
+        if isinstance(product, ApartmentUnit):
+            self.buildings.register(product_id)
+        partition = self._type_partition(product)
+        partition[product_id] = product
+        for (product_type, sort_by), index in self._sorted_products.items():
+            if self.product_partition(product_type) is partition:
+                insort(index, (PRODUCT_SORT_KEYS[sort_by](product), product_id))
+
+    def add_guest(self, guest, *aliases, dirty=True):
+        guest_id = guest.get_id()
+        if dirty:
+            self.dirty_guests.add(guest_id)
+        existing = self.unique_guests.get(guest_id)
+        if existing is not None:
+            for sort_by, index in self._sorted_guests.items():
+                self._remove_sorted(index, (GUEST_SORT_KEYS[sort_by](existing), guest_id))
+        self.guests[guest_id] = guest
+        for alias in aliases:
+            self.guests[alias] = guest
+        self.unique_guests[guest_id] = guest
+        for sort_by, index in self._sorted_guests.items():
+            insort(index, (GUEST_SORT_KEYS[sort_by](guest), guest_id))
+        if dirty:
+            self.emit('guest', {'row': guest_store_row(guest), 'aliases': list(aliases)})
+
+    # Component-level demand of a list of (product ID, quantity) order lines: bundles are replaced
+    # by their components, and lines that are not bundles are counted as they are
+    def explode_orders(self, orders):
+        demand = {}
+        for product_id, quantity in orders:
+            product = self.products.get(product_id)
+            if isinstance(product, Bundle):
+                for comp, comp_quantity in product.component_counts.items():
+                    demand[comp] = demand.get(comp, 0) + comp_quantity * quantity
+            else:
+                demand[product_id] = demand.get(product_id, 0) + quantity
+        return demand
+
+    # Units of a product available per night: one for an apartment, the stock of a limited
+    # supplementary item, or None when the product is not limited
+    def stock_capacity(self, product_id):
+        product = self.products.get(product_id)
+        if isinstance(product, ApartmentUnit):
+            return 1
+        if isinstance(product, SupplementaryItem):
+            return product.stock
+        return None
+
+    def bundle_components(self):
+        return {bundle_id: bundle.component_counts for bundle_id, bundle in self.bundles.items()}
+
+    # Changes a guest's reward balance and marks the guest for saving. dirty=False applies points
+    # that are already on file, such as those of the order history being loaded.
+    def update_reward(self, guest, points, dirty=True):
+        guest.update_reward(points)
+        if dirty:
+            self.dirty_guests.add(guest.get_id())
+            self.emit('reward', {'guest_id': guest.get_id(), 'points': points, 'balance': guest.get_reward()})
+
+    def mark_guest_dirty(self, guest):
+        self.dirty_guests.add(guest.get_id())
+        self.emit('guest', {'row': guest_store_row(guest), 'aliases': []})
+
+    # Merges each group of duplicate guest IDs (see dedup.py) into the guest with the lowest ID,
+    # which keeps its name and rates and gets the reward points of the others. The others are
+    # removed, their names become aliases of the surviving guest, and the next save drops them
+    # from the guest file. Returns {old name: surviving name} for the names that changed.
+    def merge_guests(self, groups):
+        renamed = {}
+        survivors = {}  # merged guest ID or name -> surviving Guest
+        for group in groups:
+            guests = sorted((self.unique_guests[guest_id] for guest_id in group if guest_id in self.unique_guests),
+                            key=GUEST_SORT_KEYS['id'])
+            if len(guests) < 2:
+                continue
+            survivor = guests[0]
+            for guest in guests[1:]:
+                survivor.update_reward(guest.get_reward())
+                survivors[guest.get_id()] = survivors[guest.get_name()] = survivor
+                if guest.get_name() != survivor.get_name():
+                    renamed[guest.get_name()] = survivor.get_name()
+                del self.unique_guests[guest.get_id()]
+                del self.guests[guest.get_id()]
+                for sort_by, index in self._sorted_guests.items():
+                    self._remove_sorted(index, (GUEST_SORT_KEYS[sort_by](guest), guest.get_id()))
+                self.dirty_guests.add(guest.get_id())
+            self.dirty_guests.add(survivor.get_id())
+            self.emit('merge', {'guest_id': survivor.get_id(), 'merged': [guest.get_id() for guest in guests[1:]],
+                                'balance': survivor.get_reward()})
+        for key, guest in self.guests.items():
+            if guest.get_id() in survivors:
+                self.guests[key] = survivors[guest.get_id()]
+        for name in renamed:
+            self.guests[name] = survivors[name]
+        return renamed
+
+    # Reports a change to the event log, if one is attached. Events carry the new state (the whole
+    # row, the new balance) as well as the change, so applying one twice is harmless.
+    def emit(self, event_type, data):
+        if self.events is not None:
+            self.events.emit(event_type, data)
+
+    # Writes the changed guests and products back to their files. Rows of unchanged entities are
+    # copied through as they are, rows of changed entities that no longer exist (merged guests)
+    # are dropped, and each file is replaced atomically, so a failed save leaves the previous
+    # file in place.
+    def save_changes(self, guest_file=None, product_file=None):
+        guest_file = guest_file or self.guest_file or 'guests.csv'
+        product_file = product_file or self.product_file or 'products.csv'
+        if self.dirty_guests or guest_file != self.guest_file:
+            self._merge_file(guest_file, guest_file == self.guest_file, self.unique_guests,
+                             self.dirty_guests, guest_file_row)
+            self.dirty_guests.clear()
+            self.guest_file = guest_file
+        if self.dirty_products or product_file != self.product_file:
+            self._merge_file(product_file, product_file == self.product_file, self.products,
+                             self.dirty_products, product_file_row)
+            self.dirty_products.clear()
+            self.product_file = product_file
+
+    @staticmethod
+    def _merge_file(filename, is_source, entities, dirty, to_row):
+        def write_rows(out):
+            pending = set(dirty) if is_source else set(entities)
+            if is_source and os.path.exists(filename):
+                with open(filename, 'r') as source:
+                    for line in source:
+                        entity_id = line.split(',', 1)[0].strip()
+                        if entity_id in pending:
+                            if entity_id in entities:
+                                out.write(to_row(entities[entity_id]))
+                            pending.discard(entity_id)
+                        else:
+                            out.write(line if line.endswith('\n') else line + '\n')
+            # Entities missing from the file are appended in their in-memory order
+            for entity_id, entity in entities.items():
+                if entity_id in pending and entity.get_id() == entity_id:
+                    out.write(to_row(entity))
+        replace_file(filename, write_rows)
+
+    def _type_partition(self, product):
+        if isinstance(product, ApartmentUnit):
+            return self.apartments
+        if isinstance(product, Bundle):
+            return self.bundles
+        return self.supplementary_items
+
+    @staticmethod
+    def _remove_sorted(index, entry):
+        position = bisect_right(index, entry) - 1
+        if position >= 0 and index[position] == entry:
+            del index[position]
+
+    # Returns one page of products of a type in sort order, plus the cursor for the next page (None at the end).
+    # Pass either a zero-based page number or the cursor returned with the previous page.
+    def page_products(self, product_type, sort_by='id', page=0, page_size=20, after=None):
+        partition = self.product_partition(product_type)
+        if partition is None:
+            raise InvalidInputError("Invalid product type specified. Use 'apartment', 'supplementary', or 'bundle'.")
+        if sort_by not in PRODUCT_SORT_KEYS or (sort_by == 'capacity' and partition is not self.apartments):
+            raise InvalidInputError(f"Cannot sort {product_type} listings by '{sort_by}'.")
+        index = self._sorted_products.get((product_type.lower(), sort_by))
+        if index is None:
+            key = PRODUCT_SORT_KEYS[sort_by]
+            index = sorted((key(product), product_id) for product_id, product in partition.items())
+            self._sorted_products[(product_type.lower(), sort_by)] = index
+        return self._page(index, partition, page, page_size, after)
+
+    def page_guests(self, sort_by='id', page=0, page_size=20, after=None):
+        if sort_by not in GUEST_SORT_KEYS:
+            raise InvalidInputError(f"Cannot sort guest listings by '{sort_by}'.")
+        index = self._sorted_guests.get(sort_by)
+        if index is None:
+            key = GUEST_SORT_KEYS[sort_by]
+            index = sorted((key(guest), guest_id) for guest_id, guest in self.unique_guests.items())
+            self._sorted_guests[sort_by] = index
+        return self._page(index, self.unique_guests, page, page_size, after)
 
+    @staticmethod
+    def _page(index, entities, page, page_size, after):
+        start = bisect_right(index, after) if after is not None else page * page_size
+        entries = index[start:start + page_size]
+        next_cursor = entries[-1] if entries and start + page_size < len(index) else None
+        return [(entity_id, entities[entity_id]) for _, entity_id in entries], next_cursor
+
+    # Use another Records' guests, so several catalogs (e.g. shards) share one guest directory
+    def share_guests(self, directory):
+        for name in GUEST_ATTRIBUTES:
+            self.__dict__[name] = getattr(directory, name)
+        self.guest_file = directory.guest_file
+        self.dirty_guests = directory.dirty_guests
+
+    # Loads guests and products from a storage.SqliteStore instead of the files
+    def read_store(self, store):
+        if 'guests' not in self.__dict__:
+            self._init_guests()
+        if 'products' not in self.__dict__:
+            self._init_products()
+        for guest_id, name, reward_rate, reward, redeem_rate in store.guests():
+            self.add_guest(Guest(guest_id, name, reward, reward_rate, redeem_rate), dirty=False)
+        rows = store.products()
+        # Components before the bundles that use them, as in the product file
+        for row in sorted(rows, key=lambda row: row[1] == 'bundle'):
+            self.add_product(product_from_store_row(row), dirty=False)
+
+    # Queues the guests and products changed since loading for the store's writer; returns the futures
+    def save_changes_to_store(self, store):
+        futures = []
+        if self.dirty_guests:
+            futures.append(store.save_guests([guest_store_row(self.unique_guests[guest_id])
+                                              for guest_id in self.dirty_guests if guest_id in self.unique_guests]))
+            self.dirty_guests.clear()
+        if self.dirty_products:
+            futures.append(store.save_products([product_store_row(self.products[product_id])
+                                                for product_id in self.dirty_products if product_id in self.products]))
+            self.dirty_products.clear()
+        return futures
+
+    @metrics.timed('read_guests')
     def read_guests(self, filename):
+        self.guest_file = filename
+        if 'guests' not in self.__dict__:
+            self._init_guests()
         if not os.path.exists(filename):
             print(f"Error: {filename} does not exist.")
             return
@@ -148,12 +500,16 @@ class Records:
                 for line in file:
                     line = line.strip()
                     if line:
-                        guest_id, name, reward_rate, reward, redeem_rate = line.split(',')
-                        self.guests[guest_id] = Guest(guest_id, name, float(reward), int(reward_rate), int(redeem_rate))
+                        guest_id, name, reward_rate, reward, redeem_rate = [part.strip() for part in line.split(',')]
+                        self.add_guest(Guest(guest_id, name, float(reward), int(reward_rate), int(redeem_rate)), dirty=False)
         except Exception as e:
             print(f"An error occurred while reading {filename}: {e}")
 
+    @metrics.timed('read_products')
     def read_products(self, filename):
+        self.product_file = filename
+        if 'products' not in self.__dict__:
+            self._init_products()
         if not os.path.exists(filename):
             print(f"Error: {filename} does not exist.")
             sys.exit(1)
@@ -168,9 +524,10 @@ class Records:
                         print(f"Skipping invalid bundle entry: {line}")
                         continue
                     name = parts[1].strip()
-                    components = parts[2:-1]  # Assumes all but the last part are component IDs
+                    components = [comp.strip() for comp in parts[2:-1]]  # Assumes all but the last part are component IDs
+                    components = [self.canonical_product_id(comp) or sys.intern(comp) for comp in components]
                     price = float(parts[-1].strip())
-                    self.products[product_id] = Bundle(product_id, name, components, price)
+                    self.add_product(Bundle(product_id, name, components, price), dirty=False)
 
                 elif product_id.lower().startswith('u'):  # Handle apartment units
                     if len(parts) != 4:  # Ensure there are exactly four parts for an apartment unit
@@ -179,80 +536,168 @@ class Records:
                     name = parts[1].strip()
                     price = float(parts[2].strip())
                     capacity = int(parts[3].strip())
-                    self.products[product_id] = ApartmentUnit(product_id, name, price, capacity)
+                    self.add_product(ApartmentUnit(product_id, name, price, capacity), dirty=False)
 
                 elif product_id.lower().startswith('si'):  # Handle supplementary items
-                    if len(parts) != 3:  # Ensure there are exactly three parts for a supplementary item
+                    if len(parts) not in (3, 4):  # Three parts, plus an optional stock per night
                         print(f"Skipping invalid supplementary item entry: {line}")
                         continue
                     name = parts[1].strip()
                     price = float(parts[2].strip())
-                    self.products[product_id] = SupplementaryItem(product_id, name, price)
+                    stock = int(parts[3].strip()) if len(parts) == 4 else None
+                    self.add_product(SupplementaryItem(product_id, name, price, stock), dirty=False)
 
                 else:
                     print(f"Skipping unknown or improperly formatted product type: {line}")
 
+    @metrics.timed('find_guest')
     def find_guest(self, value):
         return self.guests.get(value, None)
 
+    @metrics.timed('find_product')
     def find_product(self, value):
-        return self.products.get(value, None)
-
-    def list_guests(self):
-        if not self.guests:
+        product = self.products.get(value)
+        if product is None:
+            product_id = self.product_keys.get(value.casefold())
+            if product_id is not None:
+                product = self.products[product_id]
+        return product
+
+    # The product ID as loaded for an ID in any case, or None
+    def canonical_product_id(self, value):
+        if value in self.products:
+            return value
+        return self.product_keys.get(value.casefold())
+
+    # Lists every guest, or one page of guests when a page number is given
+    def list_guests(self, renderer=console, sort_by='id', page=None, page_size=20):
+        if not self.unique_guests:
             print("No guests found.")
             return
-        print("Existing Guests:")
-        for guest_id, guest in self.guests.items():
-            print(f"ID: {guest_id}, Name: {guest.get_name()}, Reward Rate: {guest.reward_rate}%, Reward Points: {guest.reward}, Redeem Rate: {guest.redeem_rate}%")
-
-    def list_products(self, product_type):
-        if product_type.lower() == 'apartment':
-            print("Existing Apartment Units:")
-            for product_id, product in self.products.items():
-                if isinstance(product, ApartmentUnit):
-                    print(f"ID: {product_id}, Name: {product.get_name()}, Price: ${product.get_price():.2f}, Capacity: {product.capacity} beds")
-        elif product_type.lower() == 'supplementary':
-            print("Existing Supplementary Items:")
-            for product_id, product in self.products.items():
-                if isinstance(product, SupplementaryItem):
-                    print(f"ID: {product_id}, Name: {product.get_name()}, Price: ${product.get_price():.2f}")
-        elif product_type.lower() == 'bundle':
-            print("Existing Bundles:")
-            for product_id, product in self.products.items():
-                if isinstance(product, Bundle):
-                   components_summary = ', '.join([f"{comp} x{product.components.count(comp)}" for comp in set(product.components)])
-                   print(f"ID: {product_id}, Name: {product.get_name()}, Components: {components_summary}, Price: ${product.price:.2f}")
-                else:
-                    print("Invalid product type specified. Use 'apartment', 'supplementary', or 'bundle'.")
+        if page is None:
+            guests = self.unique_guests.items()
+        else:
+            guests = self.page_guests(sort_by, page, page_size)[0]
+        rows = (guest_row(guest_id, guest) for guest_id, guest in guests)
+        renderer.write_records('guest', rows, "Existing Guests:\n")
+
+    # Lists every product of a type, or one page of them when a page number is given
+    def list_products(self, product_type, renderer=console, sort_by='id', page=None, page_size=20):
+        titles = {'apartment': "Existing Apartment Units:\n", 'supplementary': "Existing Supplementary Items:\n",
+                  'bundle': "Existing Bundles:\n"}
+        partition = self.product_partition(product_type)
+        if partition is None:
+            print("Invalid product type specified. Use 'apartment', 'supplementary', or 'bundle'.")
+            return
+        kind = product_type.lower()
+        if page is None:
+            products = partition.items()
+        else:
+            try:
+                products = self.page_products(kind, sort_by, page, page_size)[0]
+            except InvalidInputError as e:
+                print(e)
+                return
+        rows = (product_row(kind, product_id, product) for product_id, product in products)
+        renderer.write_records(kind, rows, titles[kind])
+
+def guest_file_row(guest):
+    return f"{guest.get_id()},{guest.get_name()},{guest.reward_rate},{guest.reward},{guest.redeem_rate}\n"
+
+def product_file_row(product):
+    price = format_cents(product.get_price_cents())
+    if isinstance(product, ApartmentUnit):
+        return f"{product.get_id()},{product.get_name()},{price},{product.capacity}\n"
+    if isinstance(product, Bundle):
+        components = ', '.join(product.components)
+        return f"{product.get_id()},{product.get_name()},{components},{price}\n"
+    if product.stock is not None:
+        return f"{product.get_id()},{product.get_name()},{price},{product.stock}\n"
+    return f"{product.get_id()},{product.get_name()},{price}\n"
+
+# Rows of the storage.py guests and products tables
+def guest_store_row(guest):
+    return (guest.get_id(), guest.get_name(), guest.reward_rate, guest.reward, guest.redeem_rate)
+
+def product_store_row(product):
+    if isinstance(product, ApartmentUnit):
+        return (product.get_id(), 'apartment', product.get_name(), product.get_price(), product.capacity, None, None)
+    if isinstance(product, Bundle):
+        return (product.get_id(), 'bundle', product.get_name(), product.get_price(), None, None, ', '.join(product.components))
+    return (product.get_id(), 'supplementary', product.get_name(), product.get_price(), None, product.stock, None)
+
+def product_from_store_row(row):
+    product_id, kind, name, price, capacity, stock, components = row
+    if kind == 'apartment':
+        return ApartmentUnit(product_id, name, price, capacity)
+    if kind == 'bundle':
+        return Bundle(product_id, name, components.split(', '), price)
+    return SupplementaryItem(product_id, name, price, stock)
+
+# One orders.csv row; the stay dates are added when the booking has them (see parse_order_line)
+def order_file_row(guest_name, booking):
+    products_detail = ', '.join([f"{quantity} x {product}" for product, quantity in booking['orders']])
+    stay = ''
+    if booking.get('check_in_date') and booking.get('check_out_date'):
+        stay = f",{booking['check_in_date']},{booking['check_out_date']}"
+    total_cost = format_cents(booking['total_cents'])
+    return f"{guest_name},{products_detail},{total_cost},{booking['reward_points']},{booking['booking_date']}{stay}\n"
+
+def missing_final_newline(filename):
+    with open(filename, 'rb') as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b'\n'
+
+# Writes a file through a temporary file in the same directory and renames it over the
+# original, so readers only ever see the old or the complete new file
+def replace_file(filename, write_rows, mode='w'):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as out:
+            write_rows(out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_name, filename)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
 
 class Operations:
-    def __init__(self, records):
+    def __init__(self, records, inventory=None, quote_ttl=900):
         self.records = records
-
+        self.inventory = inventory or Inventory(records.stock_capacity)
+        self.holds = Holds(self.inventory, quote_ttl, on_expire=self.forget_quotes)
+        self.quotes = {}  # hold ID -> Quote
+        self.commit_lock = threading.Lock()
+        self.order_file = None
+        self.archive = None  # order archive read through by guest_history(); by default the one next to the order file
+        self.new_bookings = []  # (guest name, booking) made since the order file was loaded
+        self.recovery = None  # SessionRecovery taking snapshots of the menu session, if any
+
+    @metrics.timed('make_booking')
     def make_booking(self):
         today = datetime.today().date()
+        phase = metrics.phases('make_booking')  # times each step, including time spent at the prompts
+        self.expire_quotes()
 
         # Get and validate the guest name
         while True:
             try:
                 guest_name = self.non_empty("Enter the main guest name: ")
-                if not guest_name.replace(" ", "").isalpha():
-                    raise InvalidGuestNameError("Invalid input: Guest name must contain only letters and spaces.")
+                self.validate_guest_name(guest_name)
                 break
             except InvalidGuestNameError as e:
                 print(e)
 
-        # Retrieve or create a new guest record
+        # Look up the guest; a new guest is only created once the booking is committed
         guest = self.records.find_guest(guest_name)
-        if not guest:
-            guest_id = str(len(self.records.guests) + 1)
-            guest = Guest(guest_id, guest_name, 0)  # Starting with 0 reward points
-            self.records.guests[guest_id] = guest
-            self.records.guests[guest_name] = guest
-            print(f"New guest '{guest_name}' added with ID {guest_id}.")
-        else:
+        if guest:
             print(f"Welcome back, {guest.get_name()}! You have {guest.get_reward()} reward points.")
+        phase('guest')
 
         # Get and validate the number of guests
         while True:
@@ -269,33 +714,11 @@ class Operations:
         # Validate and retrieve the apartment ID
         while True:
             try:
-                apartment_id = self.non_empty("Enter the apartment ID (e.g., U12swan): ")
-                
-                # Ensure it starts with 'U' and is long enough to have a number and building name
-                if not apartment_id.startswith("U") or len(apartment_id) < 3:
-                    raise InvalidProductError("Invalid format: Apartment ID should start with 'U' followed by digits and end with a building name (e.g., U12swan).")
-                
-                # Find where the numeric part ends
-                i = 1  # Start after 'U'
-                while i < len(apartment_id) and apartment_id[i].isdigit():
-                    i += 1
-                
-                # Check if a number was found and is followed by a building name
-                number_part = apartment_id[1:i]
-                building_part = apartment_id[i:]
-                
-                if not number_part.isdigit() or building_part not in ["swan", "duck", "goose"]:
-                    raise InvalidProductError("Invalid format: Apartment ID should start with 'U' followed by digits and end with a building name (e.g., U12swan).")
-                
-                # Retrieve the apartment product
-                apartment = self.records.find_product(apartment_id)
-                if not apartment or not isinstance(apartment, ApartmentUnit):
-                    raise InvalidProductError("Invalid apartment ID: Apartment does not exist. Please try again.")
+                apartment = self.find_apartment(self.non_empty("Enter the apartment ID (e.g., U12swan): "))
                 break
-
             except InvalidProductError as e:
                 print(e)
-
+        phase('apartment')
 
         # Get and validate the check-in date
         while True:
@@ -325,43 +748,42 @@ class Operations:
             except InvalidDateError as e:
                 print(e)
 
+        phase('dates')
+
+        # Stop early if the apartment is already reserved on any of the nights
+        if self.inventory.remaining(apartment.get_id(), check_in_date, check_out_date) < 1:
+            print(f"Apartment {apartment.get_id()} is not available for the selected dates.")
+            return
+
         # Calculate length of stay based on validated dates
         length_of_stay = (check_out_date - check_in_date).days
         print(f"Length of stay: {length_of_stay} nights")
 
         # Check if extra beds are required based on the apartment's capacity
-        orders = []
-        if number_of_guests > apartment.capacity:
-            # Calculate the number of extra beds needed
-            extra_beds_needed = (number_of_guests - apartment.capacity + 1) // 2
-            if extra_beds_needed > 2:
-                print("Booking cannot proceed: too many guests for the apartment, and extra beds limit exceeded.")
-                return
-            
-            # Check for a standalone extra bed or a bundle with extra beds
-            extra_bed_product = None
-            for product in self.records.products.values():
-                # Identify by ID or keyword in name, e.g., 'extra bed'
-                if isinstance(product, SupplementaryItem) and ("extra bed" in product.name.lower() or product.get_id().startswith("SIExtraBed")):
-                    extra_bed_product = product
-                    break
-
-            # Offer extra bed product if available
-            if extra_bed_product:
-                confirm_extra_beds = input(f"Apartment capacity is {apartment.capacity}, {number_of_guests} guests are selected.\n"
-                                        f"Would you like to add {extra_beds_needed} extra bed(s) at ${extra_bed_product.get_price()} each? (y/n): ").strip().lower()
-                if confirm_extra_beds == 'y':
-                    orders.append(Order(guest, extra_bed_product, extra_beds_needed))
-                    print(f"Added {extra_beds_needed} extra bed(s).")
-                else:
-                    print("Booking cancelled: unable to accommodate selected number of guests without extra beds.")
+        lines = []
+        try:
+            extra_beds_needed, extra_bed_product = self.extra_beds_for(apartment, number_of_guests)
+        except (InvalidQuantityError, InvalidProductError) as e:
+            print(e)
+            return
+        if extra_beds_needed:
+            confirm_extra_beds = input(f"Apartment capacity is {apartment.capacity}, {number_of_guests} guests are selected.\n"
+                                    f"Would you like to add {extra_beds_needed} extra bed(s) at ${format_cents(extra_bed_product.get_price_cents())} each? (y/n): ").strip().lower()
+            if confirm_extra_beds == 'y':
+                try:
+                    self.inventory.check([(extra_bed_product.get_id(), extra_beds_needed)], check_in_date, check_out_date)
+                except InsufficientStockError as e:
+                    print(e)
+                    print("Booking cancelled: not enough extra beds for the selected dates.")
                     return
+                lines.append((extra_bed_product, extra_beds_needed))
+                print(f"Added {extra_beds_needed} extra bed(s).")
             else:
-                print("No extra bed product is available in the inventory to accommodate additional guests.")
+                print("Booking cancelled: unable to accommodate selected number of guests without extra beds.")
                 return
 
         # Add the apartment booking to orders
-        orders.append(Order(guest, apartment, length_of_stay))
+        lines.append((apartment, length_of_stay))
         print(f"Apartment booked for {length_of_stay} nights.")
 
         # Continue with supplementary items or bundles if needed
@@ -375,7 +797,7 @@ class Operations:
                 continue
 
             if isinstance(product, Bundle):
-                orders.append(Order(guest, product, 1))
+                lines.append((product, 1))
                 print(f"Added bundle: {product.get_name()}")
             else:
                 while True:
@@ -384,54 +806,451 @@ class Operations:
                         if quantity < 1:
                             print("Invalid quantity: Quantity must be at least 1.")
                             continue
-                        orders.append(Order(guest, product, quantity))
+                        self.inventory.check(self.stock_lines(lines + [(product, quantity)], apartment, length_of_stay),
+                                             check_in_date, check_out_date)
+                        lines.append((product, quantity))
                         print(f"Added {quantity} x {product.get_name()}")
                         break
                     except ValueError:
                         print("Invalid input: Please enter a numeric value for quantity.")
+                    except InsufficientStockError as e:
+                        print(e)
+                        break
+
+        # Quote the booking, holding the apartment and any limited items for the stay
+        try:
+            quote = self.quote_lines(guest_name, number_of_guests, apartment, check_in_str, check_out_str, lines)
+        except InsufficientStockError as e:
+            print(e)
+            print("Booking cancelled: please try again with other dates or items.")
+            return
+        phase('items')
 
         # Calculate initial cost before applying rewards
-        total_cost = sum(order.compute_cost()[2] for order in orders)
-        print(f"Total initial cost: ${total_cost:.2f}")
-
-        # Reward point deduction if guest has enough points
-        if guest.get_reward() >= 100:
-            use_rewards = input("Would you like to use your reward points? (y/n): ").strip().lower()
-            if use_rewards == 'y':
-                discount_points = min(guest.get_reward(), (total_cost // 10) * 100)  # Calculate max discount points
-                discount_amount = discount_points / 10
-                print(f"Applying a discount of ${discount_amount:.2f} from reward points.")
-                total_cost -= discount_amount
-                guest.update_reward(-discount_points)  # Deduct used points
-                print(f"New total cost after discount: ${total_cost:.2f}")
-                print(f"Remaining reward points: {guest.get_reward()}")
-
-        # Update guest's reward points after calculating total cost
-        reward_points_earned = int(total_cost)
-        guest.update_reward(reward_points_earned)
-        print(f"Reward points earned from this booking: {reward_points_earned} points")
-        print(f"Total reward points after booking: {guest.get_reward()}")
+        print(f"Total initial cost: ${format_cents(quote.total_cents)}")
 
-        new_booking = {
-            'orders': [(order.product.get_name(), order.quantity) for order in orders],  
-            'total_cost': total_cost,
-            'reward_points': reward_points_earned,
-            'booking_date': today.strftime('%d-%m-%Y')
-        }
+        # Ask about reward points if the guest has enough to redeem
+        use_rewards = False
+        if guest and guest.get_reward() >= 100:
+            use_rewards = input("Would you like to use your reward points? (y/n): ").strip().lower() == 'y'
 
-        if guest_name not in guest_booking:
-            guest_booking[guest_name] = []
+        try:
+            result = self.commit_booking(quote.quote_id, use_rewards)
+        except QuoteExpiredError as e:
+            print(e)
+            return
+        self.report_rewards(result)
+        phase('pricing')
 
-        guest_booking[guest_name].append(new_booking)
+        # Display receipt for all orders
+        console.render_booking(result['orders'], result['booking']['total_cents'])
+        phase('receipt')
+
+    # Prints the guest and reward point changes of a committed booking
+    def report_rewards(self, result):
+        guest = result['guest']
+        if result['new_guest']:
+            print(f"New guest '{guest.get_name()}' added with ID {guest.get_id()}.")
+        if result['discount_points']:
+            print(f"Applying a discount of ${format_cents(result['discount_cents'])} from reward points.")
+            print(f"New total cost after discount: ${format_cents(result['booking']['total_cents'])}")
+            print(f"Remaining reward points: {guest.get_reward() - result['booking']['reward_points']}")
+        print(f"Reward points earned from this booking: {result['booking']['reward_points']} points")
+        print(f"Total reward points after booking: {guest.get_reward()}")
 
+    def make_group_booking(self):
+        while True:
+            guest_name = self.non_empty("Enter the group's main guest name: ")
+            if valid_guest_name(guest_name):
+                break
+            print("Invalid input: Guest name must contain only letters and spaces.")
+        guest = self.records.find_guest(guest_name)
+        try:
+            party_size = int(self.non_empty("Enter the number of guests in the group: "))
+        except ValueError:
+            print("Invalid input: Please enter a valid number for guests.")
+            return
+        check_in = self.non_empty("Enter the check-in date (dd-mm-yyyy): ")
+        check_out = self.non_empty("Enter the check-out date (dd-mm-yyyy): ")
+        buildings = input("Enter the buildings to use separated by spaces, or press Enter for any: ").split()
 
-        # Display receipt for all orders
-        print("\nBooking Summary:")
-        for order in orders:
-            order.display_receipt()
-        print(f"Overall total cost: ${total_cost:.2f}")
-        print("Thank you for your booking!")
+        try:
+            quote = self.quote_group_booking(guest_name, party_size, check_in, check_out, buildings or None)
+        except (InvalidQuantityError, InvalidDateError, InsufficientStockError) as e:
+            print(e)
+            return
+        print(f"{len(quote.apartments)} apartment(s) for {party_size} guests, {quote.nights} nights:")
+        for apartment in quote.apartments:
+            print(f"  {apartment.get_id()}: {apartment.get_name()}, {apartment.capacity} beds, "
+                  f"${format_cents(apartment.get_price_cents())} a night")
+        print(f"Total initial cost: ${format_cents(quote.total_cents)}")
+        if input("Confirm the group booking? (y/n): ").strip().lower() != 'y':
+            self.cancel_quote(quote.quote_id)
+            print("Group booking cancelled.")
+            return
+
+        use_rewards = False
+        if guest and guest.get_reward() >= 100:
+            use_rewards = input("Would you like to use your reward points? (y/n): ").strip().lower() == 'y'
+        try:
+            result = self.commit_booking(quote.quote_id, use_rewards)
+        except QuoteExpiredError as e:
+            print(e)
+            return
+        self.report_rewards(result)
+        console.render_booking(result['orders'], result['booking']['total_cents'])
+
+    # Validates a booking without prompting and holds its apartment and limited items.
+    # items is a list of (product ID, quantity); extra beds are added when the party needs them.
+    # Raises the Invalid*Error exceptions or InsufficientStockError; nothing is changed on failure.
+    def quote_booking(self, guest_name, number_of_guests, apartment_id, check_in, check_out, items=()):
+        self.expire_quotes()
+        self.validate_guest_name(guest_name)
+        if not isinstance(number_of_guests, int) or number_of_guests <= 0:
+            raise InvalidQuantityError("Invalid input: The number of guests must be a positive integer.")
+        apartment = self.find_apartment(apartment_id)
+        check_in_date, check_out_date = self.parse_stay(check_in, check_out)
+
+        lines = []
+        extra_beds_needed, extra_bed_product = self.extra_beds_for(apartment, number_of_guests)
+        if extra_beds_needed:
+            lines.append((extra_bed_product, extra_beds_needed))
+        lines.append((apartment, (check_out_date - check_in_date).days))
+        for product_id, quantity in items:
+            product = self.records.find_product(product_id)
+            if not product:
+                raise InvalidProductError(f"Invalid product ID: {product_id} does not exist.")
+            if not isinstance(quantity, int) or quantity < 1:
+                raise InvalidQuantityError("Invalid quantity: Quantity must be at least 1.")
+            lines.append((product, quantity))
+        return self.quote_lines(guest_name, number_of_guests, apartment, check_in, check_out, lines)
+
+    # Picks apartments with enough beds for the whole party over the same dates and holds them all
+    # as one quote, which commit_booking books as a single booking. Units are taken cheapest per
+    # bed first, optionally only from the given buildings, then units the party does not need
+    # are dropped, most expensive first.
+    @metrics.timed('quote_group_booking')
+    def quote_group_booking(self, guest_name, party_size, check_in, check_out, buildings=None):
+        self.expire_quotes()
+        self.validate_guest_name(guest_name)
+        if not isinstance(party_size, int) or party_size <= 0:
+            raise InvalidQuantityError("Invalid input: The number of guests must be a positive integer.")
+        check_in_date, check_out_date = self.parse_stay(check_in, check_out)
+
+        # One pass over the catalog for the units free on every night of the stay
+        available = [unit for unit in self.records.apartments.values()
+                     if unit.capacity > 0
+                     and (buildings is None or apartment_building(unit.get_id()) in buildings)
+                     and self.inventory.remaining(unit.get_id(), check_in_date, check_out_date) >= 1]
+        available.sort(key=lambda unit: (unit.get_price_cents() / unit.capacity, unit.get_price_cents(), unit.get_id()))
+        units, beds = [], 0
+        for unit in available:
+            if beds >= party_size:
+                break
+            units.append(unit)
+            beds += unit.capacity
+        if beds < party_size:
+            raise InvalidQuantityError(f"Not enough apartments available: {party_size} guests, only {beds} beds free.")
+        for unit in sorted(units, key=lambda unit: -unit.get_price_cents()):
+            if beds - unit.capacity >= party_size:
+                units.remove(unit)
+                beds -= unit.capacity
+        units.sort(key=lambda unit: unit.get_id())
+
+        # Every unit is held or none is
+        hold_id = self.holds.hold([(unit.get_id(), 1) for unit in units], check_in_date, check_out_date)
+        nights = (check_out_date - check_in_date).days
+        quote = Quote(hold_id, guest_name, party_size, units, check_in, check_out, [(unit, nights) for unit in units])
+        self.quotes[hold_id] = quote
+        return quote
+
+    @metrics.timed('quote_booking')
+    def quote_lines(self, guest_name, number_of_guests, apartment, check_in, check_out, lines):
+        check_in_date, check_out_date = self.parse_date(check_in), self.parse_date(check_out)
+        nights = (check_out_date - check_in_date).days
+        hold_id = self.holds.hold(self.stock_lines(lines, apartment, nights), check_in_date, check_out_date)
+        quote = Quote(hold_id, guest_name, number_of_guests, [apartment], check_in, check_out, lines)
+        self.quotes[hold_id] = quote
+        return quote
+
+    # Confirms a quote: creates the guest if needed, applies rewards and records the booking.
+    # Raises QuoteExpiredError if the quote's hold has lapsed.
+    @metrics.timed('commit_booking')
+    def commit_booking(self, quote_id, use_rewards=False):
+        with self.commit_lock:
+            quote = self.quotes.pop(quote_id, None)
+            try:
+                if quote is None:
+                    raise HoldExpiredError
+                reservation = self.holds.confirm(quote_id)
+            except HoldExpiredError:
+                raise QuoteExpiredError("This quote has expired. Please make the booking again.")
+
+            # Retrieve or create a new guest record
+            guest = self.records.find_guest(quote.guest_name)
+            new_guest = guest is None
+            if new_guest:
+                guest_id = str(len(self.records.guests) + 1)
+                while guest_id in self.records.guests:  # merged guests leave gaps in the IDs
+                    guest_id = str(int(guest_id) + 1)
+                guest = Guest(guest_id, quote.guest_name, 0)  # Starting with 0 reward points
+                self.records.add_guest(guest, quote.guest_name)
+
+            # Reward point deduction if guest has enough points; 100 points are worth $10
+            total_cents = quote.total_cents
+            discount_points = 0
+            discount_cents = 0
+            if use_rewards and guest.get_reward() >= 100:
+                discount_points = min(guest.get_reward(), (total_cents // 1000) * 100)  # Calculate max discount points
+                discount_cents = int(discount_points * 10)
+                total_cents -= discount_cents
+                self.records.update_reward(guest, -discount_points)  # Deduct used points
+
+            # Update guest's reward points after calculating total cost
+            reward_points_earned = total_cents // 100
+            self.records.update_reward(guest, reward_points_earned)
+
+            orders = [Order(guest, product, quantity) for product, quantity in quote.lines]
+            new_booking = {
+                'orders': [(order.product.get_id(), order.quantity) for order in orders],  # IDs, as in orders.csv
+                'total_cents': total_cents,
+                'reward_points': reward_points_earned,
+                'booking_date': datetime.today().strftime('%d-%m-%Y'),
+                'check_in_date': quote.check_in,
+                'check_out_date': quote.check_out
+            }
+            if quote.guest_name not in guest_booking:
+                guest_booking[quote.guest_name] = []
+            guest_booking[quote.guest_name].append(new_booking)
+            self.new_bookings.append((quote.guest_name, new_booking))
+            self.records.emit('booking', {'guest_id': guest.get_id(), 'guest_name': quote.guest_name,
+                                          'booking': new_booking, 'stock': reservation.lines})
+        metrics.count('bookings')
+        return {'guest': guest, 'new_guest': new_guest, 'orders': orders, 'booking': new_booking,
+                'discount_points': discount_points, 'discount_cents': discount_cents}
+
+    # Drop quotes whose holds have lapsed, releasing what they held
+    def expire_quotes(self):
+        self.holds.expire()
+
+    # Called by the holds with the IDs of the holds that expired, however the expiry was triggered
+    def forget_quotes(self, quote_ids):
+        for quote_id in quote_ids:
+            self.quotes.pop(quote_id, None)
+
+    def cancel_quote(self, quote_id):
+        if self.quotes.pop(quote_id, None) is not None:
+            self.holds.cancel(quote_id)
+
+    def validate_guest_name(self, guest_name):
+        if not valid_guest_name(guest_name):
+            raise InvalidGuestNameError("Invalid input: Guest name must contain only letters and spaces.")
+
+    def find_apartment(self, apartment_id):
+        apartment_id = self.records.canonical_product_id(apartment_id) or apartment_id
+        # 'U' followed by digits and the name of a building with loaded apartments
+        if not self.records.buildings.valid_apartment_id(apartment_id):
+            raise InvalidProductError("Invalid format: Apartment ID should start with 'U' followed by digits and end with a building name (e.g., U12swan).")
+        
+        # Retrieve the apartment product
+        apartment = self.records.find_product(apartment_id)
+        if not apartment or not isinstance(apartment, ApartmentUnit):
+            raise InvalidProductError("Invalid apartment ID: Apartment does not exist. Please try again.")
+        return apartment
+
+    # Number of extra beds a party needs in an apartment and the product that provides them
+    def extra_beds_for(self, apartment, number_of_guests):
+        if number_of_guests <= apartment.capacity:
+            return 0, None
+        # Calculate the number of extra beds needed
+        extra_beds_needed = (number_of_guests - apartment.capacity + 1) // 2
+        if extra_beds_needed > 2:
+            raise InvalidQuantityError("Booking cannot proceed: too many guests for the apartment, and extra beds limit exceeded.")
+        for product in self.records.supplementary_items.values():
+            if self.is_extra_bed(product):
+                return extra_beds_needed, product
+        raise InvalidProductError("No extra bed product is available in the inventory to accommodate additional guests.")
+
+    # Identify by ID or keyword in name, e.g., 'extra bed'
+    @staticmethod
+    def is_extra_bed(product):
+        return "extra bed" in product.name.lower() or product.get_id().startswith("SIExtraBed")
+
+    # Stock needed per night by a booking's (product, quantity) lines: one unit of the apartment,
+    # plus the supplementary items ordered, with bundles counted as their components
+    def stock_lines(self, lines, apartment, nights):
+        lines = [(product.get_id(), quantity) for product, quantity in lines if product is not apartment]
+        return self.nightly_stock(lines, [apartment.get_id()], nights)
+
+    # stock_lines() of a saved booking, whose lines are (product ID, quantity)
+    def booked_stock_lines(self, orders, nights):
+        lines, apartments = [], []
+        for product_id, quantity in orders:
+            product = self.records.find_product(product_id)
+            if isinstance(product, ApartmentUnit):
+                apartments.append(product.get_id())
+            elif product is not None:
+                lines.append((product.get_id(), quantity))
+        return self.nightly_stock(lines, apartments, nights)
+
+    # Item quantities are totals for the stay, charged once (4 x SI2 on a 4-night stay is four
+    # breakfasts), so each is spread over the nights, rounded up. Extra beds stand in the
+    # apartment every night and apartments take one unit a night, even when bundles cover some
+    # of the nights.
+    def nightly_stock(self, lines, apartment_ids, nights):
+        demand = {}
+        for product_id, quantity in self.records.explode_orders(lines).items():
+            product = self.records.products.get(product_id)
+            if product is not None and self.is_extra_bed(product):
+                demand[product_id] = quantity
+            else:
+                demand[product_id] = -(-quantity // nights)
+        for apartment_id in apartment_ids:
+            demand[apartment_id] = 1
+        return list(demand.items())
+
+    # Reserves again the stock of saved bookings whose stay has not ended, so that after a restart,
+    # or in a one-shot command, a unit cannot be booked twice for the same night. Bookings saved
+    # before stay dates were recorded cannot be placed and are left out. Returns how many were.
+    def reserve_stays(self, bookings):
+        today = datetime.today()
+        reserved = 0
+        for booking in bookings:
+            if not booking.get('check_out_date'):
+                continue
+            check_in, check_out = self.parse_date(booking['check_in_date']), self.parse_date(booking['check_out_date'])
+            if check_in is None or check_out is None or check_out <= max(check_in, today):
+                continue
+            self.inventory.restore(self.booked_stock_lines(booking['orders'], (check_out - check_in).days),
+                                   check_in, check_out)
+            reserved += 1
+        return reserved
+
+    # Cheapest ways to book a stay for the party with the extras wanted ([(product ID, quantity)]),
+    # over every available apartment, its extra beds, supplementary items and bundles.
+    # Returns up to `limit` options as {'apartment', 'lines': [(product, quantity)], 'total_cents'}.
+    @metrics.timed('recommend_bookings')
+    def recommend_bookings(self, number_of_guests, check_in, check_out, extras=(), limit=3):
+        from recommendations import cheapest_covers
+
+        check_in_date, check_out_date = self.parse_stay(check_in, check_out)
+        wanted = {}
+        for product_id, quantity in extras:
+            product = self.records.find_product(product_id)
+            if not isinstance(product, SupplementaryItem):
+                raise InvalidProductError(f"Invalid product ID: {product_id} is not a supplementary item.")
+            wanted[product.get_id()] = wanted.get(product.get_id(), 0) + quantity
+        nights = (check_out_date - check_in_date).days
+
+        # Prices are in cents from here on. Bundles at their current price. Bundles that include an apartment can only be used
+        # with that apartment; the rest are shared by every apartment.
+        shared, by_apartment = [], {}
+        for bundle in self.records.bundles.values():
+            try:
+                price = Bundle.calculate_bundle_price_cents(bundle.component_counts, self.records.products)
+            except KeyError:
+                continue  # a component is no longer in the catalog
+            apartments = {comp for comp in bundle.component_counts if comp in self.records.apartments}
+            if len(apartments) > 1:
+                continue
+            entry = (bundle.get_id(), price, bundle.component_counts)
+            if apartments:
+                by_apartment.setdefault(apartments.pop(), []).append(entry)
+            else:
+                shared.append(entry)
 
+        # Whether the items of a cover are in stock; the apartment itself is checked separately
+        def feasible(cover, apartment_id=None):
+            demand = dict(self.nightly_stock(cover.lines(), [], nights))
+            demand.pop(apartment_id, None)
+            try:
+                self.inventory.check(list(demand.items()), check_in_date, check_out_date)
+                return True
+            except InsufficientStockError:
+                return False
+
+        # Without a bundle of its own, an apartment's cheapest options are its nights plus the
+        # cheapest covers of the extras, which only depend on the number of extra beds
+        extras_covers = {}
+        def covers_for_extras(extra_bed_product, extra_beds):
+            if extra_beds not in extras_covers:
+                needs = dict(wanted)
+                if extra_beds:
+                    needs[extra_bed_product.get_id()] = needs.get(extra_bed_product.get_id(), 0) + extra_beds
+                unit_prices = {product_id: self.records.products[product_id].get_price_cents() for product_id in needs}
+                extras_covers[extra_beds] = cheapest_covers(needs, unit_prices, shared, limit, feasible=feasible)
+            return extras_covers[extra_beds]
+
+        cheapest_extras = covers_for_extras(None, 0)
+        floor = cheapest_extras[0].cost if cheapest_extras else float('inf')
+        options = []
+        for apartment in sorted(self.records.apartments.values(), key=lambda unit: unit.get_price_cents()):
+            own_bundles = by_apartment.get(apartment.get_id())
+            ceiling = options[-1]['total_cents'] if len(options) >= limit else float('inf')
+            if not own_bundles and apartment.get_price_cents() * nights + floor >= ceiling:
+                continue  # cannot beat the options already found
+            try:
+                extra_beds, extra_bed_product = self.extra_beds_for(apartment, number_of_guests)
+            except (InvalidQuantityError, InvalidProductError):
+                continue
+            if self.inventory.remaining(apartment.get_id(), check_in_date, check_out_date) < 1:
+                continue
+            stay = [(apartment, nights)]
+            if own_bundles:
+                needs = {apartment.get_id(): nights}
+                if extra_beds:
+                    needs[extra_bed_product.get_id()] = extra_beds
+                for product_id, quantity in wanted.items():
+                    needs[product_id] = needs.get(product_id, 0) + quantity
+                unit_prices = {product_id: self.records.products[product_id].get_price_cents() for product_id in needs}
+                covers = cheapest_covers(needs, unit_prices, shared + own_bundles, limit, ceiling,
+                                         lambda cover: feasible(cover, apartment.get_id()))
+                found = [(self.cover_lines(cover), cover.cost) for cover in covers]
+            else:
+                found = [(stay + self.cover_lines(cover), apartment.get_price_cents() * nights + cover.cost)
+                         for cover in covers_for_extras(extra_bed_product, extra_beds)]
+            for lines, total_cents in found:
+                options.append({'apartment': apartment, 'lines': lines, 'total_cents': total_cents})
+            options.sort(key=lambda option: option['total_cents'])
+            del options[limit:]
+        return options
+
+    def cover_lines(self, cover):
+        return [(self.records.products[product_id], quantity) for product_id, quantity in cover.lines()]
+
+    def recommend_booking(self):
+        try:
+            number_of_guests = int(self.non_empty("Enter the number of guests: "))
+            if number_of_guests <= 0:
+                raise ValueError
+        except ValueError:
+            print("Invalid input: The number of guests must be a positive integer.")
+            return
+        check_in = self.non_empty("Enter the check-in date (dd-mm-yyyy): ")
+        check_out = self.non_empty("Enter the check-out date (dd-mm-yyyy): ")
+        extras = []
+        while True:
+            entry = self.non_empty("Enter an extra item and quantity (e.g., SI2 4), or type 'done' to finish: ")
+            if entry.lower() == 'done':
+                break
+            parts = entry.split()
+            if len(parts) != 2 or not parts[1].isdigit() or int(parts[1]) < 1:
+                print("Invalid format. Please use the format: <product ID> <quantity>")
+                continue
+            extras.append((parts[0], int(parts[1])))
+        try:
+            options = self.recommend_bookings(number_of_guests, check_in, check_out, extras)
+        except (InvalidDateError, InvalidProductError) as e:
+            print(e)
+            return
+        if not options:
+            print("No apartment is available for this party and these dates.")
+            return
+        for number, option in enumerate(options, 1):
+            print(f"\nOption {number}: {option['apartment'].get_name()} (ID: {option['apartment'].get_id()}), "
+                  f"Total Cost: ${format_cents(option['total_cents'])}")
+            for product, quantity in option['lines']:
+                print(f"  {quantity} x {product.get_name()} (ID: {product.get_id()})")
 
     def menu(self):
         print("Entering the menu...")
@@ -443,6 +1262,11 @@ class Operations:
             print("4. Generate key statistics")
             print("5. Display a guest order history")
             print("6. Exit")
+            print("7. Add/update information of an apartment unit")
+            print("8. Add/update information of supplementary items")
+            print("9. Add/update information of bundles")
+            print("10. Recommend the cheapest booking")
+            print("11. Make a group booking")
             choice = self.non_empty("Choose an option: ")
 
             if choice == '1':
@@ -460,44 +1284,146 @@ class Operations:
                 print("Exiting the program.")
                 self.update_files_on_exit()  
                 break
+            elif choice == '7':
+                self.add_or_update_apartment_unit()
+            elif choice == '8':
+                self.add_or_update_supplementary_item()
+            elif choice == '9':
+                self.add_or_update_bundle()
+            elif choice == '10':
+                self.recommend_booking()
+            elif choice == '11':
+                self.make_group_booking()
             else:
                 print("Invalid choice. Please choose again.")
+            if self.recovery is not None:
+                self.recovery.maybe_snapshot()
 
 
-    def display_all_orders(self):
-        print("Displaying all orders:")
-        for guest_name, bookings in guest_booking.items():  # bookings is a list
-            for order in bookings:  # order is a dictionary for each booking
-                try:
-                    products = ', '.join([f"{item[1]} x {item[0]}" for item in order['orders']])
-                    print(f"Guest: {guest_name}, Products: {products}, Total Cost: ${order['total_cost']:.2f}, Earned Rewards: {order['reward_points']}, Date: {order['booking_date']}")
-                except KeyError:
-                    print(f"Error: The order format for guest '{guest_name}' is not correct.")
+    def display_all_orders(self, renderer=console):
+        renderer.render_orders(guest_booking)
+
+    def add_or_update_apartment_unit(self):
+        unit_info = self.non_empty("Enter apartment unit info (id rate capacity): ")
+        parts = unit_info.split()
+        if len(parts) != 3 or apartment_building(parts[0]) is None:
+            print("Invalid format. Please use the format: U<number><building> <rate> <capacity>")
+            return
+        unit_id, rate, capacity = parts
+        try:
+            rate = float(rate)
+            capacity = int(capacity)
+            self.records.add_product(ApartmentUnit(unit_id, unit_id, rate, capacity))
+            print(f"Apartment unit {unit_id} updated with rate ${rate} and capacity {capacity}.")
+        except ValueError:
+            print("Invalid rate or capacity. Please ensure they are numbers.")
+
+    def add_or_update_supplementary_item(self):
+        item_id = self.non_empty("Enter supplementary item ID (e.g., SIExtraBed, SICarPark): ")
+
+        # If item exists, confirm update, else add new item
+        existing_item = self.records.find_product(item_id)
+        if existing_item:
+            print(f"Item with ID '{item_id}' already exists as '{existing_item.get_name()}' with price ${format_cents(existing_item.get_price_cents())}.")
+            update_choice = input("Would you like to update this item? (y/n): ").strip().lower()
+            if update_choice != 'y':
+                print("Update cancelled.")
+                return
+        else:
+            print(f"Adding a new supplementary item with ID '{item_id}'.")
+
+        item_name = self.non_empty("Enter supplementary item name (e.g., Extra Bed, Car Park): ")
+        while True:
+            try:
+                item_price = float(self.non_empty("Enter supplementary item price: $"))
+                if item_price <= 0:
+                    print("Price must be a positive number.")
+                    continue
+                break
+            except ValueError:
+                print("Invalid input: Please enter a numeric value for price.")
 
+        self.records.add_product(SupplementaryItem(item_id, item_name, item_price))
+        print(f"Supplementary item '{item_name}' (ID: {item_id}) has been {'updated' if existing_item else 'added'} with a price of ${item_price:.2f}.")
 
-         
+    def add_or_update_bundle(self):
+        bundle_id = self.non_empty("Enter bundle ID (e.g., B1, B2): ")
+
+        # If bundle exists, confirm update, else add new bundle
+        existing_bundle = self.records.find_product(bundle_id)
+        if existing_bundle:
+            print(f"Bundle with ID '{bundle_id}' already exists as '{existing_bundle.get_name()}' with price ${format_cents(existing_bundle.get_price_cents())}.")
+            update_choice = input("Would you like to update this bundle? (y/n): ").strip().lower()
+            if update_choice != 'y':
+                print("Update cancelled.")
+                return
+        else:
+            print(f"Adding a new bundle with ID '{bundle_id}'.")
+
+        bundle_name = self.non_empty("Enter bundle name (e.g., Family Pack, Deluxe Bundle): ")
+
+        # Prompt for components (product IDs) in the bundle
+        components = []
+        while True:
+            component_id = self.non_empty("Enter component product ID (or type 'done' to finish): ")
+            if component_id.lower() == 'done':
+                if not components:
+                    print("A bundle must have at least one component.")
+                    continue
+                break
+            component = self.records.find_product(component_id)
+            if not component or isinstance(component, Bundle):
+                print(f"Component with ID '{component_id}' not found. Please add it first or use an existing item.")
+                continue
+            components.append(component.get_id())
+            print(f"Added component: {component.get_name()} (ID: {component.get_id()})")
+
+        bundle = Bundle(bundle_id, bundle_name, components)
+        bundle.price_cents = Bundle.calculate_bundle_price_cents(components, self.records.products)
+        self.records.add_product(bundle)
+        print(f"Bundle '{bundle_name}' (ID: {bundle_id}) has been {'updated' if existing_bundle else 'added'} with a price of ${format_cents(bundle.price_cents)}.")
 
     def save_orders_to_csv(self, filename="orders.csv"):
         with open(filename, 'w') as file:
             file.write("Guest Name/ID,Products,Total Cost,Earned Rewards,Order Date Time\n")
             for guest_name, orders in guest_booking.items():
                 for order in orders:
-                    products_detail = ', '.join([f"{quantity} x {product}" for product, quantity in order['orders']]) 
-                    file.write(f"{guest_name},{products_detail},{order['total_cost']},{order['reward_points']},{order['booking_date']}\n")
+                    file.write(order_file_row(guest_name, order))
         print("Orders saved to CSV successfully.")
 
 
-    def generate_key_statistics(self):
-        guest_totals = {}
-        product_counts = {}
+    # Writes the top guests and products to stats.txt. Given a list of order files, the statistics
+    # are computed over those files instead of the loaded history, by worker processes that each
+    # aggregate part of a file; the merged report is also written to stats.json. With sketch=True
+    # the aggregation uses fixed-size sketches and the counts are approximate.
+    # explode_bundles=True counts the components of bundles instead of the bundles themselves.
+    # With order files, they are aggregated without loading them, together with the segments of
+    # the archive directory that overlap since..until (days, either may be None).
+    @metrics.timed('generate_key_statistics')
+    def generate_key_statistics(self, order_files=None, workers=None, top_n=3, sketch=False, explode_bundles=False,
+                                since=None, until=None, archive=None):
+        if order_files:
+            from order_stats import SketchStatsAggregate, StatsAggregate, aggregate_order_files, write_stats_report
+
+            factory = SketchStatsAggregate if sketch else StatsAggregate
+            bundles = self.records.bundle_components() if explode_bundles else None
+            aggregate = aggregate_order_files(order_files, workers, factory, bundles, since, until, archive)
+            write_stats_report(aggregate, top_n)
+            print(f"Key statistics for {aggregate.bookings} bookings saved to 'stats.txt' and 'stats.json'.")
+            return
 
-        # Aggregate total cost per guest and product count
+        # Start from the bookings moved to the order archive, then add the loaded history
+        archived = self.archived_statistics(explode_bundles=explode_bundles)
+        guest_totals = dict(archived.guest_totals)
+        product_counts = dict(archived.product_counts)
+
+        # Aggregate total cost per guest (exactly, in cents) and product count
         for guest_name, bookings in guest_booking.items(): 
+            guest_totals[guest_name] = guest_totals.get(guest_name, 0) + \
+                total_cents([booking['total_cents'] for booking in bookings], in_cents=True)
             for booking in bookings:
-                total_cost = booking.get('total_cost', 0)
-                guest_totals[guest_name] = guest_totals.get(guest_name, 0) + total_cost  # Sum total cost per guest
-                
-                for product, quantity in booking['orders']:
+                lines = self.records.explode_orders(booking['orders']).items() if explode_bundles else booking['orders']
+                for product, quantity in lines:
                     product_counts[product] = product_counts.get(product, 0) + quantity
 
         # Sorting and selecting the top 3
@@ -508,7 +1434,7 @@ class Operations:
         with open('stats.txt', 'w') as file:
             file.write("Top 3 Paying Guests:\n")
             for guest, total in top_guests:
-                file.write(f"{guest}: ${total:.2f}\n")
+                file.write(f"{guest}: ${format_cents(total)}\n")
             
             file.write("\nTop 3 Most Popular Products:\n")
             for product, count in top_products:
@@ -548,6 +1474,7 @@ class Operations:
 
         for guest in self.records.guests.values():
             guest.adjust_redeem_rate(new_rate)
+            self.records.mark_guest_dirty(guest)
         print(f"Redeem rate has been adjusted to {new_rate}% for all guests.")
 
     
@@ -559,34 +1486,85 @@ class Operations:
             else:
                 print("Input cannot be empty. Please try again.") 
     def validate_date(self, date_str):
+        date = self.parse_date(date_str)
+        if date is None:
+            print("Invalid date format. Please enter in dd-mm-yyyy format.")
+        return date
+
+    # Check-in and check-out datetimes of a stay; raises InvalidDateError
+    def parse_stay(self, check_in, check_out):
+        check_in_date, check_out_date = self.parse_date(check_in), self.parse_date(check_out)
+        if not check_in_date or not check_out_date:
+            raise InvalidDateError("Invalid date format: Please enter the date in dd-mm-yyyy format.")
+        if check_in_date.date() < datetime.today().date():
+            raise InvalidDateError("Invalid check-in date: The check-in date cannot be in the past.")
+        if check_out_date <= check_in_date:
+            raise InvalidDateError("Invalid check-out date: Check-out date must be after the check-in date.")
+        return check_in_date, check_out_date
+
+    @staticmethod
+    def parse_date(date_str):
         try:
             return datetime.strptime(date_str, "%d-%m-%Y")
         except ValueError:
-            print("Invalid date format. Please enter in dd-mm-yyyy format.")
             return None
 
-    def load_orders(self, filename):
+    # Loads the order history; with workers > 1 the file is parsed by a pool of worker processes
+    # and the results are merged here in file order, giving the same state as a serial load
+    @metrics.timed('load_orders')
+    def load_orders(self, filename, workers=None):
+        self.order_file = filename
+        stays = []  # bookings with stay dates, whose stock is reserved again once they are loaded
         try:
-            with open(filename, 'r') as file:
-                for line in file:
-                    guest_name, products_details, total_cost, reward_points, order_date = line.strip().split(',')
-                    products = products_details.split(', ')
-                    orders = [{'product': p.split(' x ')[1], 'quantity': int(p.split(' x ')[0])} for p in products]
-                    if guest_name not in guest_booking:
-                        guest_booking[guest_name] = []
-                    guest_booking[guest_name].append({
-                        'orders': orders,
-                        'total_cost': float(total_cost),
-                        'reward_points': int(reward_points),
-                        'booking_date': order_date
-                    })
-                    # Update guest rewards
-                    if guest_name in self.records.guests:
-                        self.records.guests[guest_name].update_reward(int(reward_points))
+            if workers and workers > 1:
+                stays = self._load_orders_parallel(filename, workers)
+            else:
+                with open(filename, 'r') as file:
+                    for line in file:
+                        try:
+                            parsed = parse_order_line(line)
+                        except ValueError:
+                            print(f"Skipping invalid order entry: {line.strip()}")
+                            continue
+                        if parsed is None:
+                            continue
+                        guest_name, booking = parsed
+                        if guest_name not in guest_booking:
+                            guest_booking[guest_name] = []
+                        guest_booking[guest_name].append(booking)
+                        if 'check_out_date' in booking:
+                            stays.append(booking)
+                        # Update guest rewards
+                        if guest_name in self.records.guests:
+                            self.records.update_reward(self.records.guests[guest_name], booking['reward_points'],
+                                                       dirty=False)
+            self.reserve_stays(stays)
             print("Orders loaded successfully.")
         except FileNotFoundError:
             print("Cannot load the order file.")
 
+    def _load_orders_parallel(self, filename, workers):
+        from order_import import parse_orders_parallel
+
+        rewards = {}
+        stays = []
+        for bookings, chunk_rewards, invalid in parse_orders_parallel(filename, workers):
+            for line in invalid:
+                print(f"Skipping invalid order entry: {line}")
+            for guest_name, booking in bookings:
+                if guest_name not in guest_booking:
+                    guest_booking[guest_name] = []
+                guest_booking[guest_name].append(booking)
+                if 'check_out_date' in booking:
+                    stays.append(booking)
+            for guest_name, points in chunk_rewards.items():
+                rewards[guest_name] = rewards.get(guest_name, 0) + points
+        # Update guest rewards with the merged per-guest totals
+        for guest_name, points in rewards.items():
+            if guest_name in self.records.guests:
+                self.records.update_reward(self.records.guests[guest_name], points, dirty=False)
+        return stays
+
     @staticmethod
     def handle_command_line_arguments():
         if len(sys.argv) < 3 or len(sys.argv) > 4:
@@ -594,45 +1572,746 @@ class Operations:
             sys.exit(1)
         return sys.argv[1:4]
 
-    def display_guest_order_history(self, guest_name):
-        if guest_name in guest_booking:
-            print(f"This is the booking and order history for {guest_name}.")
-            print("Order ID\tProducts Ordered\t\t\tTotal Cost\tEarned Rewards")
-            for index, order in enumerate(guest_booking[guest_name], 1):
-                products_ordered = ', '.join([f"{quantity} x {product}" for product, quantity in order['orders']]) 
-                print(f"{index}\t{products_ordered}\t${order['total_cost']:.2f}\t{order['reward_points']}")
+    # The order archive of the loaded order file (see archive.py), or None when there is none
+    def archive_directory(self):
+        archive = self.archive or (default_archive(self.order_file) if self.order_file else None)
+        return archive if archive and os.path.isdir(archive) else None
+
+    # Statistics over the bookings moved to the order archive, aggregated segment by segment
+    # as the stats subcommand does; empty when there is no archive
+    def archived_statistics(self, factory=None, explode_bundles=False):
+        from order_stats import StatsAggregate, aggregate_order_files
+
+        factory = factory or StatsAggregate
+        archive = self.archive_directory()
+        if archive is None:
+            return factory()
+        bundles = self.records.bundle_components() if explode_bundles else None
+        return aggregate_order_files([], 1, factory, bundles, archive=archive)
+
+    # A guest's bookings: those moved to the order archive (see archive.py), oldest segment first,
+    # then the ones loaded from the live order file or made in this session
+    def guest_history(self, guest_name):
+        archive = self.archive_directory()
+        bookings = []
+        if archive:
+            from archive import read_bookings
+
+            bookings = [booking for _, booking in read_bookings(archive, guest_name=guest_name)]
+        return bookings + guest_booking.get(guest_name, [])
+
+    # Shows the given bookings, or the guest's whole history including the archive
+    def display_guest_order_history(self, guest_name, renderer=console, bookings=None):
+        bookings = self.guest_history(guest_name) if bookings is None else bookings
+        if bookings:
+            title = (f"This is the booking and order history for {guest_name}.\n"
+                     "Order ID\tProducts Ordered\t\t\tTotal Cost\tEarned Rewards\n")
+            rows = (dict(order_row(guest_name, order), index=index)
+                    for index, order in enumerate(bookings, 1))
+            renderer.write_records('history', rows, title)
         else:
             print(f"No order history found for {guest_name}.")
 
 
+    def append_new_bookings(self, filename, bookings=None):
+        bookings = self.new_bookings if bookings is None else bookings
+        if bookings:
+            with open(filename, 'a') as f:
+                f.write('\n' * (os.path.exists(filename) and missing_final_newline(filename)) + ''.join([order_file_row(guest_name, booking) for guest_name, booking in bookings]))
+                f.flush()
+                os.fsync(f.fileno())
+
+    @metrics.timed('update_files_on_exit')
     def update_files_on_exit(self):
-        # Update guest file
-        with open('guests.csv', 'w') as f:
-            for guest in self.records.guests.values():
-                f.write(f"{guest.get_id()},{guest.get_name()},{guest.reward_rate},{guest.reward},{guest.redeem_rate}\n")
-        
-        # Update product file
-        with open('products.csv', 'w') as f:
-            for product in self.records.products.values():
-                if isinstance(product, ApartmentUnit):
-                    f.write(f"{product.get_id()},{product.get_name()},{product.get_price()},{product.capacity}\n")
-                elif isinstance(product, SupplementaryItem):
-                    f.write(f"{product.get_id()},{product.get_name()},{product.get_price()}\n")
-                elif isinstance(product, Bundle):
-                    components = ', '.join(product.components)
-                    f.write(f"{product.get_id()},{product.get_name()},{components},{product.get_price()}\n")
-
-        # Update order file
-        with open('orders.csv', 'w') as f:
-            for guest_name, orders in guest_booking.items():
-                for order in orders:
-                    products_detail = ', '.join([f"{quantity} x {product}" for product, quantity in order['orders']])  # Handle tuples correctly
-                    row = f"{guest_name},{products_detail},{order['total_cost']},{order['reward_points']},{order['booking_date']}\n"
-                    f.write(row)
+        # Update guest and product files with the entities changed in this session
+        self.records.save_changes()
+
+        # Update order file: new bookings are appended to the file the history was loaded from;
+        # without one, the whole history is written to orders.csv
+        order_file = self.order_file or 'orders.csv'
+        if os.path.exists(order_file) and self.order_file is not None:
+            self.append_new_bookings(order_file)
+        else:
+            replace_file(order_file, lambda f: f.writelines(order_file_row(guest_name, order)
+                                                              for guest_name, orders in guest_booking.items()
+                                                              for order in orders))
+        self.new_bookings.clear()
+        self.order_file = order_file
+        if os.environ.get('POS_ARCHIVE_DAYS'):
+            archive_old_orders(order_file, self.archive or default_archive(order_file), int(os.environ['POS_ARCHIVE_DAYS']))
+        if self.recovery is not None:
+            self.recovery.discard()  # everything is in the files now
         print("All files have been updated on exit.")
 
+    # Finds duplicate guests (see dedup.py) and merges each group into its lowest guest ID, moving
+    # the bookings of the merged guests to the surviving name. Returns (groups, {old name: new name}).
+    def merge_duplicate_guests(self, threshold=0.9, dry_run=False):
+        from dedup import find_duplicate_groups
+
+        records = self.records
+        groups = find_duplicate_groups(((guest_id, guest.get_name()) for guest_id, guest in records.unique_guests.items()),
+                                       threshold)
+        if dry_run:
+            return groups, {}
+        renamed = records.merge_guests(groups)
+        self.rename_guest_bookings(renamed)
+        return groups, renamed
+
+    # Re-keys the order history and the unsaved bookings from old to new guest names
+    def rename_guest_bookings(self, renamed):
+        for name, new_name in renamed.items():
+            bookings = guest_booking.pop(name, None)
+            if bookings:
+                guest_booking.setdefault(new_name, []).extend(bookings)
+        self.new_bookings = [(renamed.get(guest_name, guest_name), booking) for guest_name, booking in self.new_bookings]
+
+    # Everything the session holds in memory, as plain data: guests, products, the order history,
+    # what has not been saved yet and the stock reserved by this session's bookings
+    def snapshot_state(self):
+        records = self.records
+        return {
+            'guests': [guest_store_row(guest) for guest in records.unique_guests.values()],
+            'aliases': [(alias, guest.get_id()) for alias, guest in records.guests.items() if alias != guest.get_id()],
+            'products': [product_store_row(product) for product in records.products.values()],
+            'dirty_guests': set(records.dirty_guests),
+            'dirty_products': set(records.dirty_products),
+            'guest_booking': {guest_name: list(bookings) for guest_name, bookings in guest_booking.items()},
+            'new_bookings': list(self.new_bookings),
+            'guest_file': records.guest_file,
+            'product_file': records.product_file,
+            'order_file': self.order_file,
+            'ledgers': {product_id: (dict(ledger.maximum), dict(ledger.added))
+                        for product_id, ledger in self.inventory.ledgers.items()},
+        }
+
+    def restore_state(self, state):
+        records = self.records
+        records._init_guests()
+        records._init_products()
+        # The files are saved back to where the session loaded them from, as in a normal session
+        records.guest_file = state['guest_file']
+        records.product_file = state['product_file']
+        aliases = {}
+        for alias, guest_id in state['aliases']:
+            aliases.setdefault(guest_id, []).append(alias)
+        for guest_id, name, reward_rate, reward, redeem_rate in state['guests']:
+            records.add_guest(Guest(guest_id, name, reward, reward_rate, redeem_rate), *aliases.get(guest_id, ()), dirty=False)
+        # Components before the bundles that use them
+        for row in sorted(state['products'], key=lambda row: row[1] == 'bundle'):
+            records.add_product(product_from_store_row(row), dirty=False)
+        records.dirty_guests.update(state['dirty_guests'])
+        records.dirty_products.update(state['dirty_products'])
+        guest_booking.clear()
+        guest_booking.update(state['guest_booking'])
+        self.new_bookings = list(state['new_bookings'])
+        self.order_file = state['order_file']
+        self.inventory.ledgers = {}
+        for product_id, (maximum, added) in state['ledgers'].items():
+            ledger = StockLedger()
+            ledger.maximum, ledger.added = maximum, added
+            self.inventory.ledgers[product_id] = ledger
+
+    # Re-applies one event from the event log (see Records.emit) to the restored state
+    def apply_event(self, event_type, data):
+        records = self.records
+        if event_type == 'guest':
+            guest_id, name, reward_rate, reward, redeem_rate = data['row']
+            guest = records.unique_guests.get(guest_id)
+            if guest is None:
+                records.add_guest(Guest(guest_id, name, reward, reward_rate, redeem_rate), *data['aliases'])
+            else:
+                guest.name, guest.reward_rate, guest.reward, guest.redeem_rate = name, reward_rate, reward, redeem_rate
+                records.add_guest(guest, *data['aliases'])
+        elif event_type == 'reward':
+            guest = records.unique_guests.get(data['guest_id'])
+            if guest is not None:
+                guest.reward = data['balance']
+                records.mark_guest_dirty(guest)
+        elif event_type == 'merge':
+            survivor = records.unique_guests.get(data['guest_id'])
+            self.rename_guest_bookings(records.merge_guests([[data['guest_id']] + data['merged']]))
+            if survivor is not None:
+                survivor.reward = data['balance']
+        elif event_type == 'product':
+            records.add_product(product_from_store_row(data['row']))
+        elif event_type == 'booking':
+            booking = dict(data['booking'], orders=[tuple(order) for order in data['booking']['orders']])
+            guest_booking.setdefault(data['guest_name'], []).append(booking)
+            self.new_bookings.append((data['guest_name'], booking))
+            self.inventory.reserve_all([tuple(line) for line in data['stock']],
+                                       self.parse_date(booking['check_in_date']),
+                                       self.parse_date(booking['check_out_date']))
+
+# Commands answered by the daemon (see daemon.py) from the records and history kept in memory
+class RemoteCommands:
+    # Bookings are saved to the order file, or to a storage.SqliteStore when one is given
+    def __init__(self, operations, order_file, store=None):
+        self.operations = operations
+        self.order_file = order_file
+        self.store = store
+        self.save_lock = threading.Lock()
+
+    def dispatch(self, command, args):
+        handler = getattr(self, f"do_{command}", None)
+        if handler is None:
+            raise InvalidInputError(f"Unknown command '{command}'.")
+        return handler(**args)
+
+    def do_ping(self):
+        return 'pong'
+
+    def do_quote(self, guest_name, number_of_guests, apartment_id, check_in, check_out, items=()):
+        quote = self.operations.quote_booking(guest_name, number_of_guests, apartment_id, check_in, check_out,
+                                              [tuple(item) for item in items])
+        holds = self.operations.holds
+        return {
+            'quote_id': quote.quote_id,
+            'lines': [[product.get_id(), product.get_name(), quantity] for product, quantity in quote.lines],
+            'nights': quote.nights,
+            'total_cost': format_cents(quote.total_cents),
+            'expires_in': round(holds.expires_at(quote.quote_id) - holds.clock()),
+        }
+
+    # Commits a quote and writes the booking and reward changes to the files straight away
+    def do_book(self, quote_id, use_rewards=False):
+        result = self.operations.commit_booking(quote_id, use_rewards)
+        with self.save_lock:
+            with self.operations.commit_lock:
+                pending, self.operations.new_bookings = self.operations.new_bookings, []
+            if self.store is not None:
+                futures = self.operations.records.save_changes_to_store(self.store)
+                futures.append(self.store.add_bookings(pending))
+                for future in futures:
+                    future.result()
+            else:
+                self.operations.records.save_changes()
+                self.operations.append_new_bookings(self.order_file, pending)
+        guest, booking = result['guest'], result['booking']
+        return {
+            'guest_id': guest.get_id(),
+            'guest_name': guest.get_name(),
+            'new_guest': result['new_guest'],
+            'orders': booking['orders'],
+            'discount': format_cents(result['discount_cents']),
+            'total_cost': format_cents(booking['total_cents']),
+            'reward_points': booking['reward_points'],
+            'reward_balance': guest.get_reward(),
+        }
+
+    def do_cancel(self, quote_id):
+        self.operations.cancel_quote(quote_id)
+
+    def do_history(self, guest_name):
+        return self.operations.guest_history(guest_name)
+
+    def do_stats(self, top_n=3):
+        aggregate = self.operations.archived_statistics()
+        for guest_name, bookings in list(guest_booking.items()):
+            for booking in list(bookings):
+                aggregate.add(guest_name, booking)
+        return aggregate.report(top_n)
+
+# Catalog and order history split by building. A shard directory holds guests.csv, shared by
+# every shard, and one sub-directory per building with its own products.csv and orders.csv;
+# split_into_shards() creates it. Each shard is a Records/Operations pair that reads its files
+# the first time it is used and is saved on its own. Bookings commit under one lock because
+# guests and their rewards are shared.
+class ShardRouter:
+    def __init__(self, directory):
+        self.directory = directory
+        self.guests = Records(os.path.join(directory, 'guests.csv'), None)
+        self.commit_lock = threading.Lock()
+        self.shards = {}  # casefolded building -> Operations
+        for building in sorted(os.listdir(directory)):
+            if os.path.exists(os.path.join(directory, building, 'products.csv')):
+                self.shards[building.casefold()] = None  # opened on first use
+
+    def shard(self, building):
+        key = building.casefold()
+        if key not in self.shards:
+            raise InvalidProductError(f"Unknown building: {building}.")
+        if self.shards[key] is None:
+            records = Records(product_file=self.shard_file(key, 'products.csv'))
+            records.share_guests(self.guests)
+            operations = Operations(records)
+            operations.commit_lock = self.commit_lock
+            if os.path.exists(self.shard_file(key, 'orders.csv')):
+                operations.reserve_stays(read_open_stays(self.shard_file(key, 'orders.csv'), date.today()))
+            self.shards[key] = operations
+        return self.shards[key]
+
+    def shard_file(self, building, name):
+        return os.path.join(self.directory, building, name)
+
+    # Shard of an apartment ID such as U12swan
+    def shard_for(self, apartment_id):
+        building = apartment_building(apartment_id[:1].upper() + apartment_id[1:])  # IDs are looked up in any case
+        if building is None:
+            raise InvalidProductError("Invalid format: Apartment ID should start with 'U' followed by digits and end with a building name (e.g., U12swan).")
+        return self.shard(building)
+
+    # Apartments are found in their building's shard; other products in the given building's
+    def find_product(self, product_id, building=None):
+        if building is None:
+            return self.shard_for(product_id).records.find_product(product_id)
+        return self.shard(building).records.find_product(product_id)
+
+    def remaining(self, apartment_id, check_in, check_out):
+        operations = self.shard_for(apartment_id)
+        return operations.inventory.remaining(operations.find_apartment(apartment_id).get_id(), check_in, check_out)
+
+    def quote_booking(self, guest_name, number_of_guests, apartment_id, check_in, check_out, items=()):
+        return self.shard_for(apartment_id).quote_booking(guest_name, number_of_guests, apartment_id,
+                                                          check_in, check_out, items)
+
+    def commit_booking(self, quote, use_rewards=False):
+        return self.shard_for(quote.apartments[0].get_id()).commit_booking(quote.quote_id, use_rewards)
+
+    # Writes the guests and each opened shard's catalog changes and new bookings
+    def save(self, buildings=None):
+        self.guests.save_changes()
+        for building in buildings or self.shards:
+            operations = self.shards.get(building.casefold())
+            if operations is not None:
+                operations.records.save_changes()
+                operations.append_new_bookings(self.shard_file(building.casefold(), 'orders.csv'))
+                operations.new_bookings.clear()
+
+    def order_files(self):
+        files = [self.shard_file(building, 'orders.csv') for building in self.shards]
+        files.append(os.path.join(self.directory, 'orders.csv'))  # bookings with no known building
+        return [filename for filename in files if os.path.exists(filename)]
+
+    # Scatter-gather: each shard's orders are aggregated separately and the results merged
+    def statistics(self, workers=None, sketch=False):
+        from order_stats import SketchStatsAggregate, StatsAggregate, aggregate_order_files
+
+        factory = SketchStatsAggregate if sketch else StatsAggregate
+        result = factory()
+        for filename in self.order_files():
+            result.merge(aggregate_order_files([filename], workers, factory))
+        return result
+
+    def history(self, guest_name):
+        from order_import import read_guest_orders
+
+        return [booking for filename in self.order_files() for booking in read_guest_orders(filename, guest_name)]
+
+# Writes the files of a ShardRouter directory. Apartments go to their building's shard, bundles
+# that include an apartment go with it, and other products are copied to every shard so each
+# property can price and stock them on its own. A bundle with apartments in several buildings is
+# copied to each of those buildings and reported. Orders follow the building of their first
+# apartment or bundle; orders without one stay in the directory's own orders.csv.
+def split_into_shards(guest_file, product_file, order_file, directory):
+    apartments = {}  # apartment ID or name -> building
+    shared, by_building = [], {}
+    with open(product_file, 'r') as file:
+        for line in file:
+            parts = [part.strip() for part in line.strip().split(',')]
+            if not parts[0]:
+                continue
+            building = apartment_building(parts[0])
+            if building is not None:
+                apartments[parts[0]] = apartments[parts[1]] = building
+                by_building.setdefault(building, []).append(line)
+            elif parts[0].lower().startswith('b'):
+                buildings = list(dict.fromkeys(apartments[comp] for comp in parts[2:-1] if comp in apartments))
+                if not buildings:
+                    shared.append(line)
+                    continue
+                if len(buildings) > 1:
+                    print(f"Bundle {parts[0]} has apartments in {', '.join(buildings)}; copied to each of them.")
+                for building in buildings:
+                    by_building.setdefault(building, []).append(line)
+                apartments[parts[0]] = buildings[0]  # its orders go to the first building
+            else:
+                shared.append(line)
+
+    os.makedirs(directory, exist_ok=True)
+    shutil.copy(guest_file, os.path.join(directory, 'guests.csv'))
+    for building, lines in by_building.items():
+        os.makedirs(os.path.join(directory, building), exist_ok=True)
+        with open(os.path.join(directory, building, 'products.csv'), 'w') as file:
+            file.writelines(line if line.endswith('\n') else line + '\n' for line in lines + shared)
+
+    counts = {}
+    outputs = {}
+    try:
+        if order_file and os.path.exists(order_file):
+            with open(order_file, 'r') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    building = None
+                    try:
+                        parsed = parse_order_line(line)
+                    except ValueError:
+                        parsed = None
+                    for product, _ in parsed[1]['orders'] if parsed else ():
+                        building = apartments.get(product)
+                        if building:
+                            break
+                    target = os.path.join(directory, building, 'orders.csv') if building else os.path.join(directory, 'orders.csv')
+                    if target not in outputs:
+                        outputs[target] = open(target, 'w')
+                    outputs[target].write(line if line.endswith('\n') else line + '\n')
+                    counts[building] = counts.get(building, 0) + 1
+    finally:
+        for output in outputs.values():
+            output.close()
+    return counts
+
+COMMANDS = ('book', 'history', 'stats', 'list', 'import', 'serve', 'shard', 'export', 'archive', 'dedup')
+
+# Runs one subcommand, reading only the files it needs:
+#   book     guest and product files; the new booking is appended to the order file
+#   history  the order file only, scanned for the one guest
+#   stats    the order file, plus the product file with --explode-bundles
+#   list     the guest or the product file
+#   import   the guest file and the imported file; bookings are appended to the order file
+#   serve    everything, kept in memory to answer daemon.py clients
+#   shard    splits the files into one directory per building (see ShardRouter)
+#   export   the order file, streamed into column files for analytics (see columnar.py)
+#   archive  the order file, with old bookings moved to a compressed segment (see archive.py)
+#   dedup    the guest file, with duplicate guests merged; the order file and archive are streamed
+#            through to rename the merged guests' bookings
+# With --shards, history and stats read every shard of a shard directory instead. Otherwise they
+# also read the archived segments that overlap --since/--until.
+def run_command(argv):
+    parser = argparse.ArgumentParser(prog="index3__HDlevel.py",
+                                     description="Run one booking system command. Without a command, "
+                                                 "<guest_file> <product_file> [<order_file>] starts the menu.")
+    parser.add_argument("--guests", default="guests.csv")
+    parser.add_argument("--products", default="products.csv")
+    parser.add_argument("--orders", default="orders.csv")
+    parser.add_argument("--shards", help="shard directory written by the shard command")
+    parser.add_argument("--archive", help="archive of old orders (default: orders_archive next to the order file)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("book", help="make one booking")
+    history = commands.add_parser("history", help="show a guest's order history")
+    history.add_argument("guest_name")
+    history.add_argument("--since", type=command_day, help="first booking day (dd-mm-yyyy)")
+    history.add_argument("--until", type=command_day, help="last booking day (dd-mm-yyyy)")
+    stats = commands.add_parser("stats", help="write key statistics to stats.txt and stats.json")
+    stats.add_argument("--workers", type=int)
+    stats.add_argument("--top", type=int, default=3)
+    stats.add_argument("--sketch", action="store_true")
+    stats.add_argument("--explode-bundles", action="store_true")
+    stats.add_argument("--since", type=command_day, help="first booking day (dd-mm-yyyy)")
+    stats.add_argument("--until", type=command_day, help="last booking day (dd-mm-yyyy)")
+    listing = commands.add_parser("list", help="list guests or products")
+    listing.add_argument("kind", choices=["guests", "apartment", "supplementary", "bundle"])
+    listing.add_argument("--sort", default="id")
+    listing.add_argument("--page", type=int)
+    listing.add_argument("--page-size", type=int, default=20)
+    listing.add_argument("--format", choices=["text", "csv", "json"], default="text")
+    importing = commands.add_parser("import", help="append the bookings of another order file")
+    importing.add_argument("file")
+    importing.add_argument("--workers", type=int)
+    server = commands.add_parser("serve", help="keep everything in memory and answer commands on a Unix socket")
+    server.add_argument("--socket", default="pos.sock")
+    server.add_argument("--db", help="keep the data in this SQLite database, filled from the files on first use")
+    server.add_argument("--readers", type=int, default=4, help="database connections shared by the readers")
+    splitting = commands.add_parser("shard", help="split the files into one directory per building")
+    splitting.add_argument("directory")
+    exporting = commands.add_parser("export", help="write the order history as columnar tables for analytics")
+    exporting.add_argument("directory")
+    exporting.add_argument("--batch-rows", type=int, default=65536)
+    archiving = commands.add_parser("archive", help="move old bookings into a compressed archive segment")
+    archiving.add_argument("--older-than", type=int, default=int(os.environ.get('POS_ARCHIVE_DAYS', 365)),
+                           help="archive bookings made more than this many days ago")
+    archiving.add_argument("--codec", default="gzip", help="gzip, bz2, lzma or zstd")
+    deduplicating = commands.add_parser("dedup", help="merge duplicate guests and their reward points")
+    deduplicating.add_argument("--threshold", type=float, default=0.9,
+                               help="name similarity (0 to 1) at which guests with similar-sounding names are merged")
+    deduplicating.add_argument("--dry-run", action="store_true", help="only list the duplicates")
+    deduplicating.add_argument("--show", type=int, default=20, help="duplicate groups to list")
+    args = parser.parse_args(argv)
+    archive = args.archive or default_archive(args.orders)
+
+    operations = Operations(Records(args.guests, args.products))
+    if args.shards and args.command in ('history', 'stats'):
+        router = ShardRouter(args.shards)
+        if args.command == 'history':
+            operations.display_guest_order_history(args.guest_name, bookings=router.history(args.guest_name))
+        else:
+            from order_stats import write_stats_report
+
+            aggregate = router.statistics(args.workers, args.sketch)
+            write_stats_report(aggregate, args.top)
+            print(f"Key statistics for {aggregate.bookings} bookings in {len(router.shards)} shards saved to 'stats.txt' and 'stats.json'.")
+    elif args.command == 'shard':
+        counts = split_into_shards(args.guests, args.products, args.orders, args.directory)
+        for building, count in sorted(counts.items(), key=lambda item: str(item[0])):
+            print(f"{building or 'no building'}: {count} orders")
+    elif args.command == 'export':
+        from columnar import export_orders
+
+        if not os.path.exists(args.orders):
+            print("Cannot load the order file.")
+            return
+        bookings, lines, invalid = export_orders(args.orders, args.directory, args.batch_rows)
+        for line in invalid:
+            print(f"Skipping invalid order entry: {line}")
+        print(f"Exported {bookings} bookings and {lines} order lines to {args.directory}.")
+    elif args.command == 'book':
+        if os.path.exists(args.orders):
+            operations.reserve_stays(read_open_stays(args.orders, date.today()))
+        attach_event_log(operations.records)
+        operations.make_booking()
+        operations.records.save_changes()
+        operations.append_new_bookings(args.orders)
+    elif args.command == 'history':
+        from archive import booking_day, in_range, read_bookings
+        from order_import import read_guest_orders
+
+        if not os.path.exists(args.orders):
+            print("Cannot load the order file.")
+            return
+        bookings = [booking for _, booking in read_bookings(archive, args.since, args.until, args.guest_name)]
+        bookings.extend(booking for booking in read_guest_orders(args.orders, args.guest_name)
+                        if in_range(booking_day(booking['booking_date']), args.since, args.until))
+        operations.display_guest_order_history(args.guest_name, bookings=bookings)
+    elif args.command == 'stats':
+        operations.generate_key_statistics(order_files=[args.orders], workers=args.workers, top_n=args.top,
+                                           sketch=args.sketch, explode_bundles=args.explode_bundles,
+                                           since=args.since, until=args.until, archive=archive)
+    elif args.command == 'archive':
+        archive_old_orders(args.orders, archive, args.older_than, args.codec)
+    elif args.command == 'dedup':
+        merge_duplicates(operations, args.orders, archive, args.threshold, args.dry_run, args.show)
+    elif args.command == 'list':
+        from rendering import ReportRenderer
+
+        renderer = ReportRenderer(fmt=args.format)
+        if args.kind == 'guests':
+            operations.records.list_guests(renderer, args.sort, args.page, args.page_size)
+        else:
+            operations.records.list_products(args.kind, renderer, args.sort, args.page, args.page_size)
+    elif args.command == 'import':
+        if os.path.exists(args.orders) and os.path.samefile(args.file, args.orders):
+            print("Cannot import an order file into itself.")
+            return
+        operations.load_orders(args.file, args.workers)
+        operations.new_bookings = [(guest_name, booking) for guest_name, bookings in guest_booking.items()
+                                   for booking in bookings]
+        operations.records.save_changes()
+        operations.append_new_bookings(args.orders)
+        print(f"Imported {len(operations.new_bookings)} bookings into {args.orders}.")
+    elif args.command == 'serve':
+        from daemon import serve
+
+        operations.archive = archive
+        store = None
+        if args.db:
+            store = open_store(operations, args.db, args.readers, args.guests, args.products, args.orders)
+        else:
+            operations.records.read_guests(args.guests)
+            operations.records.read_products(args.products)
+            if os.path.exists(args.orders):
+                operations.load_orders(args.orders)
+        attach_event_log(operations.records)
+        try:
+            serve(args.socket, RemoteCommands(operations, args.orders, store).dispatch)
+        finally:
+            if store is not None:
+                store.close()
+
+# Booking day given on the command line (dd-mm-yyyy)
+def command_day(text):
+    parsed = Operations.parse_date(text)
+    if parsed is None:
+        raise ValueError(text)
+    return parsed.date()
+
+def default_archive(order_file):
+    return os.path.join(os.path.dirname(order_file), 'orders_archive')
+
+# Moves the bookings made more than `days` days ago from the order file into a new compressed
+# segment of the archive directory
+def archive_old_orders(order_file, directory, days, codec='gzip'):
+    from archive import archive_orders
+
+    if not os.path.exists(order_file):
+        print("Cannot load the order file.")
+        return
+    try:
+        entry = archive_orders(order_file, directory, date.today() - timedelta(days=days), codec)
+    except ValueError as e:
+        print(e)
+        return
+    if entry is None:
+        print(f"No bookings older than {days} days to archive.")
+    else:
+        print(f"Archived {entry['rows']} bookings from {entry['first']} to {entry['last']} into "
+              f"{os.path.join(directory, entry['file'])}.")
+
+# Merges the duplicate guests of the guest file, saves it and renames the merged guests in the
+# order file and the archive
+def merge_duplicates(operations, order_file, archive, threshold=0.9, dry_run=False, show=20):
+    from archive import rename_guests
+    from order_import import rename_order_guests
+
+    records = operations.records
+    guest_count = len(records.unique_guests)
+    start = time.perf_counter()
+    groups, _ = operations.merge_duplicate_guests(threshold, dry_run=True)
+    elapsed = time.perf_counter() - start
+    for group in groups[:show]:
+        print(', '.join([f"{guest_id} ({records.unique_guests[guest_id].get_name()})" for guest_id in group]))
+    if len(groups) > show:
+        print(f"... and {len(groups) - show} more groups.")
+    duplicates = sum(len(group) - 1 for group in groups)
+    print(f"Found {duplicates} duplicates of {len(groups)} guests among {guest_count} guests in {elapsed:.2f} s.")
+    if dry_run or not groups:
+        return
+    renamed = records.merge_guests(groups)
+    operations.rename_guest_bookings(renamed)
+    records.save_changes()
+    renamed_bookings = 0
+    if renamed and os.path.exists(order_file):
+        def write_rows(out):
+            nonlocal renamed_bookings
+            with open(order_file, 'r') as source:
+                renamed_bookings = rename_order_guests(source, out, renamed)
+        replace_file(order_file, write_rows)
+    if renamed and os.path.isdir(archive):
+        renamed_bookings += rename_guests(archive, renamed)
+    print(f"Merged them into the lowest guest ID of each group: {len(records.unique_guests)} guests left, "
+          f"{renamed_bookings} bookings renamed.")
+
+# Reports later changes to the records to the event log in the POS_EVENTS directory, if set.
+# Called once the data is loaded, so loading itself is not reported.
+def attach_event_log(records):
+    if os.environ.get('POS_EVENTS'):
+        from events import open_from_env
+
+        records.events = open_from_env()
+
+# Crash recovery for the menu session. Every `interval` seconds (checked between menu choices,
+# when nothing is half done) the whole state is written to a snapshot file, together with the
+# sequence number of the last event in the event log. After a crash the next start loads the
+# snapshot and replays the events logged since, instead of reading the files, so the work to
+# recover is bounded by the interval rather than by the size of the history. A clean exit saves
+# the files and removes the snapshot. The cyclic garbage collector is paused while a snapshot is
+# built or loaded: it would otherwise scan the growing heap over and over, which takes several
+# times longer than the work itself.
+class SessionRecovery:
+    def __init__(self, operations, path, files, interval=60):
+        self.operations = operations
+        self.path = path
+        self.files = files  # (guest file, product file, order file) the session was started with
+        self.interval = interval
+        self.taken_at = None
+        self.taken_seq = None
+
+    @classmethod
+    def from_env(cls, operations, files, environ=os.environ):
+        path = environ.get('POS_SNAPSHOT')
+        if not path:
+            return None
+        return cls(operations, path, files, float(environ.get('POS_SNAPSHOT_INTERVAL', 60)))
+
+    def maybe_snapshot(self):
+        if self.taken_at is None or time.monotonic() - self.taken_at >= self.interval:
+            self.snapshot()
+
+    def snapshot(self):
+        events = self.operations.records.events
+        seq = None
+        if events is not None:
+            events.flush()  # the events up to seq must be on disk, or their numbers would be reused
+            seq = events.next_seq - 1
+            if seq == self.taken_seq:
+                self.taken_at = time.monotonic()
+                return  # nothing has changed since the last snapshot
+        with gc_paused():
+            state = self.operations.snapshot_state()
+            state.update(version=SNAPSHOT_VERSION, files=self.files, seq=seq)
+            replace_file(self.path, lambda file: pickle.dump(state, file, pickle.HIGHEST_PROTOCOL), 'wb')
+        self.taken_at, self.taken_seq = time.monotonic(), seq
+
+    # Restores the session from the snapshot and the events after it; False when there is
+    # nothing to recover from
+    def recover(self):
+        if not os.path.exists(self.path):
+            return False
+        start = time.perf_counter()
+        with gc_paused():
+            with open(self.path, 'rb') as file:
+                state = pickle.load(file)
+            if state.get('version') != SNAPSHOT_VERSION or tuple(state['files']) != tuple(self.files):
+                print(f"Ignoring {self.path}: it was taken for other files.")
+                return False
+            self.operations.restore_state(state)
+        self.taken_at, self.taken_seq = time.monotonic(), state['seq']
+        replayed = 0
+        directory = os.environ.get('POS_EVENTS')
+        if directory and state['seq'] is not None:
+            from events import read_events
+
+            for seq, event in read_events(directory, state['seq'] + 1):
+                if replayed == 0 and seq != state['seq'] + 1:
+                    print(f"Events {state['seq'] + 1} to {seq - 1} are no longer in the event log.")
+                self.operations.apply_event(event['type'], event['data'])
+                replayed += 1
+        print(f"Recovered the previous session from {self.path} and {replayed} events "
+              f"in {time.perf_counter() - start:.2f} s.")
+        return True
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.taken_at = self.taken_seq = None
+
+SNAPSHOT_VERSION = 3
+
+@contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# Opens the SQLite store, filling it from the files if it is empty, and loads the records and the
+# order history from it. Stored reward points are the guests' balances, so the history is not
+# added to them again.
+def open_store(operations, path, readers, guest_file, product_file, order_file):
+    from storage import SqliteStore
+
+    store = SqliteStore(path, readers)
+    if not store.products():
+        records = Records(guest_file, product_file)
+        records.dirty_guests.update(records.unique_guests)
+        records.dirty_products.update(records.products)
+        futures = records.save_changes_to_store(store)
+        if os.path.exists(order_file):
+            from order_import import parse_chunk
+
+            bookings, _, invalid = parse_chunk(order_file, 0, os.path.getsize(order_file))
+            for line in invalid:
+                print(f"Skipping invalid order entry: {line}")
+            futures.append(store.add_bookings(bookings))
+        for future in futures:
+            future.result()
+        print(f"Copied {len(records.unique_guests)} guests and {len(records.products)} products into {path}.")
+    operations.records.read_store(store)
+    for guest_name, booking in store.orders():
+        guest_booking.setdefault(guest_name, []).append(booking)
+    operations.reserve_stays(booking for bookings in guest_booking.values() for booking in bookings)
+    return store
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and (sys.argv[1] in COMMANDS or sys.argv[1].startswith('-')):
+        metrics.configure_from_env()
+        run_command(sys.argv[1:])
+        sys.exit()
+
     print("Starting the program...") 
+    metrics.configure_from_env()
     if len(sys.argv) not in [3, 4]:
         print("Usage: python script.py <guest_file> <product_file> [<order_file>]")
         sys.exit()
@@ -642,12 +2321,17 @@ if __name__ == "__main__":
     order_file = sys.argv[3] if len(sys.argv) == 4 else None
 
     records = Records() 
-    records.read_guests(guest_file)
-    records.read_products(product_file)
-
     operations = Operations(records)
+    operations.recovery = SessionRecovery.from_env(operations, (guest_file, product_file, order_file))
+
+    if operations.recovery is None or not operations.recovery.recover():
+        records.read_guests(guest_file)
+        records.read_products(product_file)
 
-    if order_file:
-        operations.load_orders(order_file) 
+        if order_file:
+            operations.load_orders(order_file) 
+    attach_event_log(records)
+    if operations.recovery is not None:
+        operations.recovery.snapshot()
 
     operations.menu()
\ No newline at end of file
@@ -0,0 +1,213 @@
+'''
+Lightweight timers and counters for the booking system's hot paths.
+
+Instrumentation is off by default and every hook checks a single flag first,
+so the disabled cost is one attribute lookup per call. Switch it on at runtime
+with metrics.enable(), or before start-up with environment variables:
+
+    POS_METRICS=1                      record timings and counters
+    POS_METRICS_FILE=metrics.prom      export on exit (.json for JSON, anything else Prometheus text)
+    POS_PROFILE=make_booking,...       capture cProfile stats for these operations
+    POS_TRACEMALLOC=update_files_on_exit,...   record peak memory for these operations
+'''
+import atexit
+import cProfile
+import functools
+import json
+import os
+import time
+import tracemalloc
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}   # operation -> [calls, total seconds, max seconds]
+        self.counters = {}  # counter name -> value
+        self.profile_ops = set()
+        self.memory_ops = set()
+        self.profiles = {}  # operation -> cProfile.Profile accumulated over all calls
+        self.memory_peaks = {}  # operation -> largest peak traced allocation in bytes
+        self._profiling = False
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.timings.clear()
+        self.counters.clear()
+        self.profiles.clear()
+        self.memory_peaks.clear()
+
+    # Capture cProfile statistics for the named operations (requires enable())
+    def profile(self, *operations):
+        self.profile_ops.update(operations)
+
+    # Record the tracemalloc peak for the named operations (requires enable())
+    def trace_memory(self, *operations):
+        self.memory_ops.update(operations)
+
+    def record(self, operation, seconds):
+        timing = self.timings.get(operation)
+        if timing is None:
+            self.timings[operation] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # Decorator timing every call of a function under the given operation name
+    def timed(self, operation):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                return self._call(operation, func, args, kwargs)
+            return wrapper
+        return decorator
+
+    def _call(self, operation, func, args, kwargs):
+        if operation in self.profile_ops or operation in self.memory_ops:
+            return self._call_profiled(operation, func, args, kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(operation, time.perf_counter() - start)
+
+    def _call_profiled(self, operation, func, args, kwargs):
+        profiler = None
+        tracing = False
+        # cProfile cannot be nested, so an operation called inside another profiled one is only timed
+        if operation in self.profile_ops and not self._profiling:
+            profiler = self.profiles.setdefault(operation, cProfile.Profile())
+            self._profiling = True
+        if operation in self.memory_ops:
+            tracing = not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            return func(*args, **kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+                self._profiling = False
+            self.record(operation, time.perf_counter() - start)
+            if operation in self.memory_ops:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.memory_peaks[operation] = max(peak, self.memory_peaks.get(operation, 0))
+                if tracing:
+                    tracemalloc.stop()
+
+    # Context manager timing a block of code
+    def timer(self, operation):
+        return _Timer(self, operation)
+
+    # Returns a function that records the time since the previous call as "<operation>.<phase>"
+    def phases(self, operation):
+        if not self.enabled:
+            return _noop
+        last = [time.perf_counter()]
+
+        def mark(phase):
+            now = time.perf_counter()
+            self.record(f"{operation}.{phase}", now - last[0])
+            last[0] = now
+        return mark
+
+    def snapshot(self):
+        return {
+            'timings': {name: {'calls': calls, 'total_seconds': total, 'max_seconds': longest}
+                        for name, (calls, total, longest) in sorted(self.timings.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'memory_peak_bytes': dict(sorted(self.memory_peaks.items())),
+        }
+
+    def to_prometheus(self):
+        lines = ["# HELP pos_operation_seconds Time spent in instrumented operations.",
+                 "# TYPE pos_operation_seconds summary"]
+        for name, (calls, total, _) in sorted(self.timings.items()):
+            lines.append(f'pos_operation_seconds_count{{operation="{name}"}} {calls}')
+            lines.append(f'pos_operation_seconds_sum{{operation="{name}"}} {total:.9f}')
+        lines.append("# HELP pos_operation_max_seconds Slowest single call of each operation.")
+        lines.append("# TYPE pos_operation_max_seconds gauge")
+        for name, (_, _, longest) in sorted(self.timings.items()):
+            lines.append(f'pos_operation_max_seconds{{operation="{name}"}} {longest:.9f}')
+        lines.append("# HELP pos_events_total Event counters.")
+        lines.append("# TYPE pos_events_total counter")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'pos_events_total{{event="{name}"}} {value}')
+        if self.memory_peaks:
+            lines.append("# HELP pos_operation_memory_peak_bytes Peak traced allocation of an operation.")
+            lines.append("# TYPE pos_operation_memory_peak_bytes gauge")
+            for name, peak in sorted(self.memory_peaks.items()):
+                lines.append(f'pos_operation_memory_peak_bytes{{operation="{name}"}} {peak}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, filename):
+        with open(filename, 'w') as file:
+            if filename.endswith('.json'):
+                json.dump(self.snapshot(), file, indent=2)
+            else:
+                file.write(self.to_prometheus())
+
+    def export_profile(self, operation, filename):
+        profiler = self.profiles.get(operation)
+        if profiler is None:
+            print(f"No profile captured for '{operation}'.")
+            return
+        profiler.dump_stats(filename)
+
+    def configure_from_env(self, environ=os.environ):
+        if environ.get('POS_METRICS', '').lower() not in ('1', 'true', 'yes', 'on'):
+            return
+        self.enable()
+        self.profile(*[op for op in environ.get('POS_PROFILE', '').split(',') if op])
+        self.trace_memory(*[op for op in environ.get('POS_TRACEMALLOC', '').split(',') if op])
+        filename = environ.get('POS_METRICS_FILE')
+        if filename:
+            atexit.register(self._export_at_exit, filename)
+
+    def _export_at_exit(self, filename):
+        self.export(filename)
+        for operation in self.profiles:
+            self.export_profile(operation, f"{os.path.splitext(filename)[0]}.{operation}.pstats")
+
+
+class _Timer:
+    def __init__(self, metrics, operation):
+        self.metrics = metrics
+        self.operation = operation
+        self.start = None
+
+    def __enter__(self):
+        if self.metrics.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is not None:
+            self.metrics.record(self.operation, time.perf_counter() - self.start)
+        return False
+
+
+# Shared instance used by the booking system
+metrics = Metrics()
@@ -0,0 +1,216 @@
+'''
+Per-night stock reservations for apartments and limited supplementary items.
+
+Each stocked product has a ledger of how many units are reserved on every
+night, stored as a sparse segment tree with range-add and range-max. That makes
+reserving, releasing and asking for the remaining stock over a date range
+O(log n) in the number of nights. Capacities are looked up when checked, so
+changing an item's stock takes effect immediately.
+
+Holds are short-lived reservations made while a booking is quoted. They sit in
+a heap ordered by expiry time, and expired holds are released whenever the
+holds are touched (or by expire()), so an abandoned quote frees its units.
+'''
+import heapq
+import itertools
+import threading
+import time
+from datetime import date, datetime
+
+BASE_DATE = date(2000, 1, 1)
+DEPTH = 16  # 2 ** 16 nights (about 179 years) from BASE_DATE
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_id, requested, available):
+        super().__init__(f"Not enough stock for {product_id}: requested {requested}, only {available} available.")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+class HoldExpiredError(Exception):
+    pass
+
+
+def night_index(day):
+    if isinstance(day, datetime):
+        day = day.date()
+    index = (day - BASE_DATE).days
+    if not 0 <= index < (1 << DEPTH):
+        raise ValueError(f"Date {day} is outside the reservable range.")
+    return index
+
+
+class StockLedger:
+    # Reserved units per night; nodes are created only for ranges that have reservations
+    def __init__(self):
+        self.maximum = {}  # node -> largest reserved count in the node's range
+        self.added = {}    # node -> amount added to the whole range of the node
+
+    def add(self, first, last, amount):
+        self._add(1, 0, (1 << DEPTH) - 1, first, last, amount)
+
+    def max_reserved(self, first, last):
+        return self._max(1, 0, (1 << DEPTH) - 1, first, last)
+
+    def _add(self, node, low, high, first, last, amount):
+        if last < low or high < first:
+            return
+        if first <= low and high <= last:
+            self.added[node] = self.added.get(node, 0) + amount
+            self.maximum[node] = self.maximum.get(node, 0) + amount
+            return
+        middle = (low + high) // 2
+        self._add(2 * node, low, middle, first, last, amount)
+        self._add(2 * node + 1, middle + 1, high, first, last, amount)
+        self.maximum[node] = self.added.get(node, 0) + max(self.maximum.get(2 * node, 0),
+                                                           self.maximum.get(2 * node + 1, 0))
+
+    def _max(self, node, low, high, first, last):
+        if first <= low and high <= last:
+            return self.maximum.get(node, 0)
+        if node not in self.maximum:
+            return 0  # nothing was ever reserved in this range
+        middle = (low + high) // 2
+        best = 0
+        if first <= middle:
+            best = self._max(2 * node, low, middle, first, last)
+        if last > middle:
+            best = max(best, self._max(2 * node + 1, middle + 1, high, first, last))
+        return self.added.get(node, 0) + best
+
+
+class Reservation:
+    def __init__(self, lines, check_in, check_out):
+        self.lines = lines  # [(product ID, quantity per night)]
+        self.check_in = check_in
+        self.check_out = check_out
+
+
+class Inventory:
+    # capacity_of(product_id) returns the units available per night, or None for unlimited stock
+    def __init__(self, capacity_of):
+        self.capacity_of = capacity_of
+        self.ledgers = {}
+        self.lock = threading.Lock()
+
+    def remaining(self, product_id, check_in, check_out):
+        capacity = self.capacity_of(product_id)
+        if capacity is None:
+            return None
+        ledger = self.ledgers.get(product_id)
+        if ledger is None:
+            return capacity
+        return capacity - ledger.max_reserved(night_index(check_in), night_index(check_out) - 1)
+
+    # Raises InsufficientStockError if the lines could not all be reserved right now
+    def check(self, lines, check_in, check_out):
+        with self.lock:
+            self._check(self._requested(lines), check_in, check_out)
+
+    # Reserve every line for each night from check-in up to (not including) check-out, or
+    # nothing at all: all lines are checked before any is applied
+    def reserve_all(self, lines, check_in, check_out):
+        if night_index(check_out) <= night_index(check_in):
+            raise ValueError("Check-out must be after check-in.")
+        requested = self._requested(lines)
+        with self.lock:
+            self._check(requested, check_in, check_out)
+            self._apply(requested, check_in, check_out, 1)
+        return Reservation(list(requested.items()), check_in, check_out)
+
+    # Records a reservation that was already made, such as a saved booking being loaded again.
+    # Nothing is checked: the booking stands even if the stock has been lowered since.
+    def restore(self, lines, check_in, check_out):
+        requested = self._requested(lines)
+        with self.lock:
+            self._apply(requested, check_in, check_out, 1)
+        return Reservation(list(requested.items()), check_in, check_out)
+
+    # Quantities per stocked product; unlimited products are left out
+    def _requested(self, lines):
+        requested = {}
+        for product_id, quantity in lines:
+            if self.capacity_of(product_id) is not None:
+                requested[product_id] = requested.get(product_id, 0) + quantity
+        return requested
+
+    def _check(self, requested, check_in, check_out):
+        for product_id, quantity in requested.items():
+            available = self.remaining(product_id, check_in, check_out)
+            if quantity > available:
+                raise InsufficientStockError(product_id, quantity, available)
+
+    def release(self, reservation):
+        with self.lock:
+            self._apply(dict(reservation.lines), reservation.check_in, reservation.check_out, -1)
+
+    def _apply(self, requested, check_in, check_out, sign):
+        first, last = night_index(check_in), night_index(check_out) - 1
+        for product_id, quantity in requested.items():
+            if product_id not in self.ledgers:
+                self.ledgers[product_id] = StockLedger()
+            self.ledgers[product_id].add(first, last, sign * quantity)
+
+
+class Holds:
+    # on_expire, if given, is called with the IDs of the holds released by every expiry, including
+    # the ones hold() and confirm() run first
+    def __init__(self, inventory, ttl=900, clock=time.monotonic, on_expire=None):
+        self.inventory = inventory
+        self.ttl = ttl  # seconds a hold lasts unless confirmed
+        self.clock = clock
+        self.on_expire = on_expire
+        self.active = {}  # hold ID -> (expiry time, reservation)
+        self.heap = []    # (expiry time, hold ID)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    # Reserve the lines for the stay until the hold expires; raises InsufficientStockError
+    def hold(self, lines, check_in, check_out, ttl=None):
+        self.expire()
+        reservation = self.inventory.reserve_all(lines, check_in, check_out)
+        with self.lock:
+            hold_id = next(self.ids)
+            expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+            self.active[hold_id] = (expires_at, reservation)
+            heapq.heappush(self.heap, (expires_at, hold_id))
+        return hold_id
+
+    # Turn a hold into a permanent reservation; raises HoldExpiredError if it is gone
+    def confirm(self, hold_id):
+        self.expire()
+        with self.lock:
+            entry = self.active.pop(hold_id, None)
+        if entry is None:
+            raise HoldExpiredError(f"Hold {hold_id} has expired or does not exist.")
+        return entry[1]
+
+    def cancel(self, hold_id):
+        with self.lock:
+            entry = self.active.pop(hold_id, None)
+        if entry is not None:
+            self.inventory.release(entry[1])
+
+    def expires_at(self, hold_id):
+        entry = self.active.get(hold_id)
+        return entry[0] if entry else None
+
+    # Release every hold past its expiry time; returns the IDs of the released holds
+    def expire(self):
+        now = self.clock()
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, hold_id = heapq.heappop(self.heap)
+                entry = self.active.get(hold_id)
+                if entry is not None and entry[0] == expires_at:
+                    del self.active[hold_id]
+                    expired.append((hold_id, entry[1]))
+        for _, reservation in expired:
+            self.inventory.release(reservation)
+        hold_ids = [hold_id for hold_id, _ in expired]
+        if hold_ids and self.on_expire is not None:
+            self.on_expire(hold_ids)
+        return hold_ids
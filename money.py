@@ -0,0 +1,82 @@
+'''
+Money as whole cents.
+
+Prices and totals are kept as int cents inside the booking system, so adding up
+any number of bookings is exact: 0.1 + 0.2 drifts as floats, 10 + 20 does not.
+The files, the screens and the JSON reports still show dollars, converted at
+the edges:
+
+    to_cents("551.2") -> 55120        to_cents(420.6) -> 42060
+    dollars(55120) -> 551.2            format_cents(55120) -> "551.20"
+
+The batch helpers work on int64 arrays (array('q')) and hand them to NumPy
+when it is installed and the batch is large enough to pay for it:
+
+    cents_array([551.2, 420.6])    -> array('q', [55120, 42060])
+    total_cents([551.2, 420.6])    -> 97180, exactly
+'''
+from array import array
+from decimal import ROUND_HALF_UP, Decimal
+
+NUMPY_MIN_BATCH = 4096  # smaller batches are summed faster in pure Python than converted
+
+_numpy = None
+
+
+# NumPy if it is installed, imported on first use so plain runs do not pay for it; False otherwise
+def numpy_module():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
+# Whole cents of a dollar amount given as a string, int, float or Decimal, rounded half up.
+# Floats are expected to hold amounts with two decimals (as the files do), which value * 100
+# puts within a tiny fraction of the whole number of cents.
+def to_cents(value):
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        return round(value * 100)
+    if isinstance(value, str):
+        value = Decimal(value.strip())
+    return int((value * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def dollars(cents):
+    return cents / 100
+
+
+def format_cents(cents):
+    sign = '-' if cents < 0 else ''
+    whole, part = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{part:02d}"
+
+
+# percent % of an amount of cents, rounded half up to a whole cent
+def percent_of(cents, percent):
+    return (cents * percent + 50) // 100
+
+
+# ---- batch paths ----
+
+def cents_array(amounts):
+    numpy = numpy_module()
+    if numpy and len(amounts) >= NUMPY_MIN_BATCH:
+        return array('q', numpy.rint(numpy.asarray(amounts, dtype=numpy.float64) * 100).astype(numpy.int64).tobytes())
+    # Floats, by far the most common, are converted inline: half the cost of calling to_cents()
+    return array('q', [round(amount * 100) if type(amount) is float else to_cents(amount) for amount in amounts])
+
+
+# Exact total of dollar amounts (or of cents, with in_cents=True), in cents
+def total_cents(amounts, in_cents=False):
+    values = amounts if in_cents else cents_array(amounts)
+    numpy = numpy_module()
+    if numpy and len(values) >= NUMPY_MIN_BATCH:
+        return int(numpy.asarray(values, dtype=numpy.int64).sum())
+    return sum(values)
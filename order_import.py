@@ -0,0 +1,167 @@
+'''
+Parsing of orders.csv rows, serially or split across worker processes.
+
+The parallel import cuts the file into byte ranges that start and end on line
+boundaries and parses each range in a ProcessPoolExecutor. Each worker returns
+its bookings in file order together with the reward points it saw per guest,
+so the parent can merge the chunks in order and get exactly the result of a
+serial load.
+'''
+import mmap
+import os
+import re
+from datetime import date
+
+from money import to_cents
+
+# Files smaller than this are parsed in the calling process
+PARALLEL_MIN_BYTES = 1 << 20
+
+STAY_DATE = re.compile(r'\s*\d{1,2}-\d{1,2}-\d{4}\s*$')  # check-in and check-out, dd-mm-yyyy
+# The end of a row with stay dates, capturing the check-out day, month and year
+STAY_ROW = re.compile(rb',[ \t]*\d{1,2}-\d{1,2}-\d{4}[ \t]*,[ \t]*(\d{1,2})-(\d{1,2})-(\d{4})[ \t]*\r?$', re.M)
+
+
+# Parse one orders.csv row into (guest name, booking dict). Returns None for blank and header
+# rows and raises ValueError for malformed ones, including rows without a guest. The guest field
+# holds a name or an ID, so it is not held to the booking menu's name rules. The products field itself contains ", "
+# separated "<quantity> x <product>" entries, so the guest name is the first field and cost,
+# rewards and date are always the last three. Rows written since stay dates are recorded end
+# with two more fields, the check-in and check-out dates; the reward points field never looks
+# like a date, so both kinds of row can share a file.
+def parse_order_line(line):
+    parts = line.strip().split(',')
+    if len(parts) < 5 or parts[0] == "Guest Name/ID":
+        if line.strip() and parts[0] != "Guest Name/ID":
+            raise ValueError(line.strip())
+        return None
+    if not parts[0].strip():
+        raise ValueError(line.strip())
+    stay = None
+    if len(parts) >= 7 and STAY_DATE.match(parts[-2]):
+        stay = parts[-2].strip(), parts[-1].strip()
+        parts = parts[:-2]
+    orders = []
+    for detail in parts[1:-3]:
+        quantity, product = detail.split('x', 1)
+        orders.append((product.strip(), int(quantity)))
+    booking = {
+        'orders': orders,
+        'total_cents': to_cents(float(parts[-3])),
+        'reward_points': int(parts[-2]),
+        'booking_date': parts[-1].strip()
+    }
+    if stay is not None:
+        booking['check_in_date'], booking['check_out_date'] = stay
+    return parts[0].strip(), booking
+
+
+# Bookings of an order file whose stay ends after the day `after`. The file is searched with one
+# regular expression for rows ending in two dates, and only those rows are parsed, which is
+# several times faster than loading it; rows saved without stay dates are skipped.
+def read_open_stays(filename, after):
+    if os.path.getsize(filename) == 0:
+        return
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for match in STAY_ROW.finditer(data):
+            day, month, year = match.groups()
+            try:
+                if date(int(year), int(month), int(day)) <= after:
+                    continue
+                start = data.rfind(b'\n', 0, match.start()) + 1
+                parsed = parse_order_line(data[start:match.end()].decode('utf-8'))
+            except ValueError:
+                continue
+            if parsed is not None and 'check_out_date' in parsed[1]:
+                yield parsed[1]
+
+
+# Bookings of one guest, read straight from an order file without loading the rest of it
+def read_guest_orders(filename, guest_name):
+    bookings = []
+    with open(filename, 'r') as file:
+        for line in file:
+            if guest_name not in line:
+                continue  # cheap substring test before parsing
+            try:
+                parsed = parse_order_line(line)
+            except ValueError:
+                continue
+            if parsed is not None and parsed[0] == guest_name:
+                bookings.append(parsed[1])
+    return bookings
+
+
+# Copies order file lines to out with the guest names in `renamed` (old name -> new name) replaced
+# and every other line left as it is; returns the number of lines renamed
+def rename_order_guests(lines, out, renamed):
+    count = 0
+    for line in lines:
+        name, separator, rest = line.partition(',')
+        new_name = renamed.get(name.strip()) if separator else None
+        if new_name is not None:
+            line = new_name + separator + rest
+            count += 1
+        out.write(line)
+    return count
+
+
+# Split a file into about `count` byte ranges, each starting at the beginning of a line
+def find_chunks(filename, count):
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    boundaries = [0]
+    with open(filename, 'rb') as file:
+        for n in range(1, count):
+            file.seek(max(size * n // count, boundaries[-1]))
+            if file.tell() > 0:
+                file.seek(file.tell() - 1)
+                file.readline()  # finish the line the cut landed in
+            if file.tell() >= size:
+                break
+            if file.tell() > boundaries[-1]:
+                boundaries.append(file.tell())
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+# Parse the rows of one byte range. Returns the bookings in order, the reward points per guest
+# and the rows that could not be parsed.
+def parse_chunk(filename, start, end):
+    bookings = []
+    rewards = {}
+    invalid = []
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            raw = file.readline()
+            if not raw:
+                break
+            position += len(raw)
+            line = raw.decode('utf-8')
+            try:
+                parsed = parse_order_line(line)
+            except ValueError:
+                invalid.append(line.strip())
+                continue
+            if parsed is None:
+                continue
+            bookings.append(parsed)
+            guest_name, booking = parsed
+            rewards[guest_name] = rewards.get(guest_name, 0) + booking['reward_points']
+    return bookings, rewards, invalid
+
+
+# Parse a whole order file with a pool of worker processes; chunk results come back in file order
+def parse_orders_parallel(filename, workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(filename) < PARALLEL_MIN_BYTES:
+        return [parse_chunk(filename, 0, os.path.getsize(filename))]
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = find_chunks(filename, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_chunk, filename, start, end) for start, end in chunks]
+        return [future.result() for future in futures]
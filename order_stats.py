@@ -0,0 +1,311 @@
+'''
+Map-reduce key statistics over order files that are not loaded into memory.
+
+Every order file (a shard of the history) is cut into line-aligned byte ranges.
+Worker processes turn each range into a partial StatsAggregate: booking count,
+revenue, spend per guest, units per product and units per product for each
+building and quarter. The parent merges the partials and writes the report to
+stats.txt and stats.json.
+
+SketchStatsAggregate is a drop-in replacement with bounded memory. It uses
+Count-Min plus Space-Saving for the top products and top paying guests, and
+HyperLogLog for distinct guests per quarter (see sketches.py for the error
+bounds).
+
+Bookings can be limited to a range of booking days, and compressed segments of
+an order archive (see archive.py) are read when they overlap that range; each
+segment is one task.
+
+Revenue and spend are added up as int cents (see money.py), so the totals of
+millions of bookings are exact; the reports show them in dollars.
+'''
+import json
+import os
+import re
+
+from archive import ArchiveIndex, booking_day, in_range, open_segment
+from money import dollars
+from order_import import find_chunks, parse_order_line
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+from validators import apartment_building
+
+
+# Building of a booking, taken from its apartment line (e.g. "U12swan" -> "swan")
+def booking_building(booking):
+    for product, _ in booking['orders']:
+        building = apartment_building(product)
+        if building:
+            return building.lower()
+    return 'unknown'
+
+
+# Quarter of a booking date such as "12-09-2024" or "12/9/2024 19:55" -> "2024-Q3"
+def booking_quarter(booking_date):
+    try:
+        day, month, year = re.split(r'[-/]', booking_date.split()[0])
+        return f"{int(year)}-Q{(int(month) - 1) // 3 + 1}"
+    except (ValueError, IndexError):
+        return 'unknown'
+
+
+class StatsAggregate:
+    def __init__(self):
+        self.bookings = 0
+        self.revenue = 0  # cents
+        self.guest_totals = {}  # guest -> cents
+        self.product_counts = {}
+        self.building_quarter_products = {}  # "building|quarter" -> {product: units}
+
+    def add(self, guest_name, booking):
+        total_cents = booking['total_cents']
+        self.bookings += 1
+        self.revenue += total_cents
+        self.guest_totals[guest_name] = self.guest_totals.get(guest_name, 0) + total_cents
+        period = f"{booking_building(booking)}|{booking_quarter(booking['booking_date'])}"
+        period_counts = self.building_quarter_products.setdefault(period, {})
+        for product, quantity in booking['orders']:
+            self.product_counts[product] = self.product_counts.get(product, 0) + quantity
+            period_counts[product] = period_counts.get(product, 0) + quantity
+
+    def merge(self, other):
+        self.bookings += other.bookings
+        self.revenue += other.revenue
+        merge_counts(self.guest_totals, other.guest_totals)
+        merge_counts(self.product_counts, other.product_counts)
+        for period, counts in other.building_quarter_products.items():
+            merge_counts(self.building_quarter_products.setdefault(period, {}), counts)
+        return self
+
+    def top_guests(self, n):
+        return top_items(self.guest_totals, n)
+
+    def top_products(self, n):
+        return top_items(self.product_counts, n)
+
+    def top_products_by_period(self, n):
+        periods = {}
+        for period in sorted(self.building_quarter_products):
+            building, quarter = period.split('|')
+            periods.setdefault(building, {})[quarter] = top_items(self.building_quarter_products[period], n)
+        return periods
+
+    def report(self, top_n):
+        return {
+            'bookings': self.bookings,
+            'revenue': dollars(self.revenue),
+            'top_guests': [{'guest': guest, 'total_cost': dollars(total)} for guest, total in self.top_guests(top_n)],
+            'top_products': [{'product': product, 'units': units} for product, units in self.top_products(top_n)],
+            'top_products_by_building_quarter': {
+                building: {quarter: [{'product': product, 'units': units} for product, units in top]
+                           for quarter, top in quarters.items()}
+                for building, quarters in self.top_products_by_period(top_n).items()
+            },
+        }
+
+
+class SketchStatsAggregate:
+    TOP_K = 200          # Space-Saving counters for products and guests
+    PERIOD_TOP_K = 32    # Space-Saving counters per building and quarter
+    EPSILON = 0.0005     # Count-Min overestimate of at most 0.05% of the total ...
+    DELTA = 0.01         # ... with 99% probability
+    HLL_PRECISION = 12   # about 1.6% standard error on distinct counts
+
+    def __init__(self):
+        self.bookings = 0
+        self.revenue = 0  # cents
+        self.guest_spend = SpaceSaving(self.TOP_K)  # guest -> cents
+        self.guest_spend_cms = CountMinSketch(self.EPSILON, self.DELTA)
+        self.product_units = SpaceSaving(self.TOP_K)
+        self.product_units_cms = CountMinSketch(self.EPSILON, self.DELTA)
+        self.building_quarter_products = {}  # "building|quarter" -> SpaceSaving
+        self.distinct_guests = HyperLogLog(self.HLL_PRECISION)
+        self.quarter_guests = {}  # quarter -> HyperLogLog
+
+    def add(self, guest_name, booking):
+        total_cents = booking['total_cents']
+        quarter = booking_quarter(booking['booking_date'])
+        self.bookings += 1
+        self.revenue += total_cents
+        self.guest_spend.add(guest_name, total_cents)
+        self.guest_spend_cms.add(guest_name, total_cents)
+        self.distinct_guests.add(guest_name)
+        if quarter not in self.quarter_guests:
+            self.quarter_guests[quarter] = HyperLogLog(self.HLL_PRECISION)
+        self.quarter_guests[quarter].add(guest_name)
+        period = f"{booking_building(booking)}|{quarter}"
+        if period not in self.building_quarter_products:
+            self.building_quarter_products[period] = SpaceSaving(self.PERIOD_TOP_K)
+        for product, quantity in booking['orders']:
+            self.product_units.add(product, quantity)
+            self.product_units_cms.add(product, quantity)
+            self.building_quarter_products[period].add(product, quantity)
+
+    def merge(self, other):
+        self.bookings += other.bookings
+        self.revenue += other.revenue
+        self.guest_spend.merge(other.guest_spend)
+        self.guest_spend_cms.merge(other.guest_spend_cms)
+        self.product_units.merge(other.product_units)
+        self.product_units_cms.merge(other.product_units_cms)
+        self.distinct_guests.merge(other.distinct_guests)
+        for quarter, sketch in other.quarter_guests.items():
+            if quarter in self.quarter_guests:
+                self.quarter_guests[quarter].merge(sketch)
+            else:
+                self.quarter_guests[quarter] = sketch
+        for period, summary in other.building_quarter_products.items():
+            if period in self.building_quarter_products:
+                self.building_quarter_products[period].merge(summary)
+            else:
+                self.building_quarter_products[period] = summary
+        return self
+
+    # Space-Saving picks the candidates; each count is the tighter of its two overestimates
+    @staticmethod
+    def _top(summary, cms, n):
+        ranked = [(key, int(min(count, cms.estimate(key)))) for key, count, _ in summary.top(summary.k)]
+        return sorted(ranked, key=lambda item: (-item[1], item[0]))[:n]
+
+    def top_guests(self, n):
+        return self._top(self.guest_spend, self.guest_spend_cms, n)
+
+    def top_products(self, n):
+        return self._top(self.product_units, self.product_units_cms, n)
+
+    def top_products_by_period(self, n):
+        periods = {}
+        for period in sorted(self.building_quarter_products):
+            building, quarter = period.split('|')
+            top = self.building_quarter_products[period].top(n)
+            periods.setdefault(building, {})[quarter] = [(key, count) for key, count, _ in top]
+        return periods
+
+    def report(self, top_n):
+        report = StatsAggregate.report(self, top_n)
+        report['distinct_guests'] = self.distinct_guests.count()
+        report['distinct_guests_by_quarter'] = {quarter: self.quarter_guests[quarter].count()
+                                                for quarter in sorted(self.quarter_guests)}
+        report['error_bounds'] = {
+            'guest_total_cost_over_estimate': round(dollars(min(self.guest_spend.error_bound(),
+                                                                self.guest_spend_cms.error_bound())), 2),
+            'product_units_over_estimate': round(min(self.product_units.error_bound(),
+                                                     self.product_units_cms.error_bound()), 2),
+            'count_min_confidence': 1 - self.DELTA,
+            'distinct_guests_relative_error': round(self.distinct_guests.relative_error(), 4),
+        }
+        return report
+
+
+def merge_counts(target, source):
+    for key, value in source.items():
+        target[key] = target.get(key, 0) + value
+
+
+# Highest values first, ties broken by key so the report does not depend on merge order
+def top_items(counts, n):
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+# Replace bundle lines with their component lines, given bundle ID -> {component ID: quantity}
+def explode_bundles(orders, bundles):
+    lines = []
+    for product, quantity in orders:
+        components = bundles.get(product)
+        if components is None:
+            lines.append((product, quantity))
+        else:
+            lines.extend((comp, comp_quantity * quantity) for comp, comp_quantity in components.items())
+    return lines
+
+
+def _aggregate_line(aggregate, line, bundles, since, until):
+    try:
+        parsed = parse_order_line(line)
+    except ValueError:
+        return
+    if parsed is not None:
+        guest_name, booking = parsed
+        if (since is not None or until is not None) and \
+                not in_range(booking_day(booking['booking_date']), since, until):
+            return
+        if bundles:
+            booking['orders'] = explode_bundles(booking['orders'], bundles)
+        aggregate.add(guest_name, booking)
+
+
+# Map step: aggregate one byte range of an order file
+def aggregate_chunk(filename, start, end, factory=StatsAggregate, bundles=None, since=None, until=None):
+    aggregate = factory()
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            raw = file.readline()
+            if not raw:
+                break
+            position += len(raw)
+            _aggregate_line(aggregate, raw.decode('utf-8'), bundles, since, until)
+    return aggregate
+
+
+# Map step: aggregate a whole compressed archive segment
+def aggregate_segment(path, codec, factory=StatsAggregate, bundles=None, since=None, until=None):
+    aggregate = factory()
+    with open_segment(path, codec) as file:
+        for line in file:
+            _aggregate_line(aggregate, line, bundles, since, until)
+    return aggregate
+
+
+# Scan the order files, and the archive segments that overlap since..until, in worker processes
+# and merge the partial aggregates in order (archived bookings first)
+def aggregate_order_files(order_files, workers=None, factory=StatsAggregate, bundles=None, since=None, until=None,
+                          archive=None):
+    workers = workers or os.cpu_count() or 1
+    tasks = []
+    if archive is not None:
+        index = ArchiveIndex(archive)
+        tasks.extend((aggregate_segment, index.path(segment), segment['codec'])
+                     for segment in index.segments_for(since, until))
+    for filename in order_files:
+        tasks.extend((aggregate_chunk, filename, start, end) for start, end in find_chunks(filename, workers * 4))
+    options = {'factory': factory, 'bundles': bundles, 'since': since, 'until': until}
+    result = factory()
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            result.merge(task[0](*task[1:], **options))
+        return result
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(task[0], *task[1:], **options) for task in tasks]
+        for future in futures:
+            result.merge(future.result())
+    return result
+
+
+def write_stats_report(aggregate, top_n=3, text_file='stats.txt', json_file='stats.json'):
+    report = aggregate.report(top_n)
+    with open(text_file, 'w') as file:
+        file.write(f"Top {top_n} Paying Guests:\n")
+        for entry in report['top_guests']:
+            file.write(f"{entry['guest']}: ${entry['total_cost']:.2f}\n")
+        file.write(f"\nTop {top_n} Most Popular Products:\n")
+        for entry in report['top_products']:
+            file.write(f"{entry['product']}: {entry['units']} units sold\n")
+        file.write(f"\nTop {top_n} Products per Building per Quarter:\n")
+        for building, quarters in report['top_products_by_building_quarter'].items():
+            for quarter, top in quarters.items():
+                products = ', '.join([f"{entry['product']} ({entry['units']})" for entry in top])
+                file.write(f"{building} {quarter}: {products}\n")
+        if 'distinct_guests' in report:
+            bounds = report['error_bounds']
+            file.write(f"\nDistinct Guests (approximate, +/-{bounds['distinct_guests_relative_error']:.1%}): "
+                       f"{report['distinct_guests']}\n")
+            for quarter, count in report['distinct_guests_by_quarter'].items():
+                file.write(f"{quarter}: {count}\n")
+            file.write(f"\nSketch counts may overstate guest totals by up to ${bounds['guest_total_cost_over_estimate']:.2f} "
+                       f"and product units by up to {bounds['product_units_over_estimate']:.0f}.\n")
+    with open(json_file, 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
@@ -0,0 +1,91 @@
+'''
+Cheapest ways to cover a booking's needs with single products and bundles.
+
+A booking needs some units of each of a few products: the apartment for every
+night, extra beds and the extras the guest asked for. Bundles cover several of
+those at once. cheapest_covers() searches how many of each bundle to buy, with
+the remaining units bought singly, by depth-first branch and bound:
+
+- bundles that cost at least as much as buying their useful components singly
+  are dropped, since they can never make a cover cheaper;
+- bundles are tried most useful first (lowest price per needed unit covered),
+  from the largest useful count down to zero, so good covers are found early;
+- a branch is cut when its cost so far plus a lower bound on the rest (every
+  remaining unit at the cheapest rate any remaining bundle or single offers)
+  cannot beat the worst of the best covers found so far.
+'''
+import heapq
+import math
+
+INFINITY = float('inf')
+
+
+class Cover:
+    def __init__(self, cost, bundles, singles):
+        self.cost = cost
+        self.bundles = bundles  # bundle ID -> number bought
+        self.singles = singles  # product ID -> units bought singly
+
+    def lines(self):
+        return list(self.bundles.items()) + list(self.singles.items())
+
+
+# needs:       {product ID: units needed}
+# unit_prices: {product ID: price of one unit bought singly}, for every needed product
+# bundles:     [(bundle ID, price, {component ID: quantity})]
+# Returns up to `limit` covers cheaper than `ceiling`, cheapest first. feasible(cover), when
+# given, rejects covers that cannot be booked (e.g. not enough stock).
+def cheapest_covers(needs, unit_prices, bundles, limit=3, ceiling=INFINITY, feasible=None):
+    needs = {product_id: quantity for product_id, quantity in needs.items() if quantity > 0}
+    candidates = []
+    for bundle_id, price, components in bundles:
+        useful = {comp: quantity for comp, quantity in components.items() if comp in needs}
+        if not useful:
+            continue
+        singles_price = sum(unit_prices[comp] * quantity for comp, quantity in useful.items())
+        if price >= singles_price:
+            continue  # dominated by buying the same units singly
+        candidates.append((price / sum(useful.values()), bundle_id, price, useful))
+    candidates.sort()
+
+    # Cheapest rate per unit of each product using bundles from index i onwards, or singles
+    rates = [dict(unit_prices)]
+    for rate, _, _, useful in reversed(candidates):
+        suffix = dict(rates[-1])
+        for comp in useful:
+            suffix[comp] = min(suffix[comp], rate)
+        rates.append(suffix)
+    rates.reverse()
+
+    best = []  # max-heap of (-cost, order, cover) holding the cheapest covers found
+    order = [0]
+
+    def cutoff():
+        return -best[0][0] if len(best) >= limit else ceiling
+
+    def search(index, remaining, cost, chosen):
+        bound = cost + sum(quantity * rates[index][comp] for comp, quantity in remaining.items())
+        if bound >= cutoff():
+            return
+        if index == len(candidates):
+            cover = Cover(cost + sum(unit_prices[comp] * quantity for comp, quantity in remaining.items()),
+                          dict(chosen), {comp: quantity for comp, quantity in remaining.items() if quantity})
+            if cover.cost < cutoff() and (feasible is None or feasible(cover)):
+                order[0] += 1
+                heapq.heappush(best, (-cover.cost, order[0], cover))
+                if len(best) > limit:
+                    heapq.heappop(best)
+            return
+        _, bundle_id, price, useful = candidates[index]
+        most = max(math.ceil(remaining[comp] / quantity) for comp, quantity in useful.items())
+        for count in range(most, -1, -1):
+            left = dict(remaining)
+            for comp, quantity in useful.items():
+                left[comp] = max(0, left[comp] - quantity * count)
+            if count:
+                chosen[bundle_id] = count
+            search(index + 1, left, cost + price * count, chosen)
+            chosen.pop(bundle_id, None)
+
+    search(0, needs, 0, {})
+    return [cover for _, _, cover in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
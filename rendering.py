@@ -0,0 +1,192 @@
+'''
+Buffered rendering of receipts, order listings and catalog listings.
+
+Each receipt, or each page of a listing, is built from prebuilt templates into a
+single string and written to the output stream with one write() call, instead
+of one print() per line. Output can be plain text (the same text the menu
+prints), CSV or JSON lines. Amounts are kept in cents until they reach a row,
+where they become "551.20" strings, so every format shows exactly two decimals.
+'''
+import csv
+import io
+import json
+import sys
+
+from money import format_cents
+
+FORMATS = ('text', 'csv', 'json')
+
+LINE = "========================================================"
+
+# Plain text templates, bound to str.format once at import
+TEXT_TEMPLATES = {
+    'receipt': (LINE + "\n"
+                "Guest Name: {guest}\n"
+                "Product: {product} (ID: {product_id})\n"
+                "Unit Price: ${unit_price}\n"
+                "Quantity: {quantity}\n"
+                "Original Cost: ${original_cost}\n"
+                "Discount: ${discount}\n"
+                "Final Total Cost: ${final_cost}\n"
+                "Earned Reward Points: {reward_points}\n" + LINE + "\n").format,
+    'order': ("Guest: {guest}, Products: {products}, Total Cost: ${total_cost}, "
+              "Earned Rewards: {reward_points}, Date: {booking_date}\n").format,
+    'history': "{index}\t{products}\t${total_cost}\t{reward_points}\n".format,
+    'guest': ("ID: {guest_id}, Name: {name}, Reward Rate: {reward_rate}%, Reward Points: {reward}, "
+              "Redeem Rate: {redeem_rate}%\n").format,
+    'apartment': "ID: {product_id}, Name: {name}, Price: ${price}, Capacity: {capacity} beds\n".format,
+    'supplementary': "ID: {product_id}, Name: {name}, Price: ${price}\n".format,
+    'bundle': "ID: {product_id}, Name: {name}, Components: {components}, Price: ${price}\n".format,
+}
+
+# Column order of each record kind for CSV output
+FIELDS = {
+    'receipt': ['guest', 'product', 'product_id', 'unit_price', 'quantity', 'original_cost', 'discount',
+                'final_cost', 'reward_points'],
+    'order': ['guest', 'products', 'total_cost', 'reward_points', 'booking_date'],
+    'history': ['index', 'products', 'total_cost', 'reward_points'],
+    'guest': ['guest_id', 'name', 'reward_rate', 'reward', 'redeem_rate'],
+    'apartment': ['product_id', 'name', 'price', 'capacity'],
+    'supplementary': ['product_id', 'name', 'price'],
+    'bundle': ['product_id', 'name', 'components', 'price'],
+}
+
+
+# ---- record builders, turning booking system objects into template fields ----
+
+def receipt_row(order):
+    original_cost, discount, final_cost, reward_points = order.compute_cost_cents()
+    return {
+        'guest': order.guest.get_name(),
+        'product': order.product.get_name(),
+        'product_id': order.product.get_id(),
+        'unit_price': format_cents(order.product.get_price_cents()),
+        'quantity': order.quantity,
+        'original_cost': format_cents(original_cost),
+        'discount': format_cents(discount),
+        'final_cost': format_cents(final_cost),
+        'reward_points': reward_points,
+    }
+
+
+def products_detail(booking_orders):
+    return ', '.join([f"{quantity} x {product}" for product, quantity in booking_orders])
+
+
+def order_row(guest_name, booking):
+    return {
+        'guest': guest_name,
+        'products': products_detail(booking['orders']),
+        'total_cost': format_cents(booking['total_cents']),
+        'reward_points': booking['reward_points'],
+        'booking_date': booking['booking_date'],
+    }
+
+
+def guest_row(guest_id, guest):
+    return {
+        'guest_id': guest_id,
+        'name': guest.get_name(),
+        'reward_rate': guest.reward_rate,
+        'reward': guest.reward,
+        'redeem_rate': guest.redeem_rate,
+    }
+
+
+def product_row(kind, product_id, product):
+    row = {'product_id': product_id, 'name': product.get_name(), 'price': format_cents(product.get_price_cents())}
+    if kind == 'apartment':
+        row['capacity'] = product.capacity
+    elif kind == 'bundle':
+        row['components'] = product.component_summary()
+    return row
+
+
+class ReportRenderer:
+    def __init__(self, out=None, fmt='text', page_size=500):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format '{fmt}'. Use one of: {', '.join(FORMATS)}.")
+        self.out = out  # None writes to whatever sys.stdout is at the time
+        self.fmt = fmt
+        self.page_size = page_size
+        self._csv_headers = set()
+
+    def write(self, text):
+        if text:
+            (self.out if self.out is not None else sys.stdout).write(text)
+
+    def format_rows(self, kind, rows):
+        if self.fmt == 'text':
+            template = TEXT_TEMPLATES[kind]
+            return ''.join([template(**row) for row in rows])
+        if self.fmt == 'json':
+            return ''.join([json.dumps(dict(row, record=kind)) + '\n' for row in rows])
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=FIELDS[kind], extrasaction='ignore', lineterminator='\n')
+        if kind not in self._csv_headers:
+            writer.writeheader()
+            self._csv_headers.add(kind)
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+    # Writes the rows a page at a time; the text title goes out with the first page
+    def write_records(self, kind, rows, title=None):
+        pager = Pager(self, kind, title)
+        for row in rows:
+            pager.add(row)
+        pager.close()
+
+    def render_booking(self, orders, total_cents):
+        rows = [receipt_row(order) for order in orders]
+        if self.fmt == 'text':
+            self.write("\nBooking Summary:\n" + self.format_rows('receipt', rows)
+                       + f"Overall total cost: ${format_cents(total_cents)}\nThank you for your booking!\n")
+        else:
+            self.write(self.format_rows('receipt', rows))
+
+    def render_receipt(self, order):
+        self.write(self.format_rows('receipt', [receipt_row(order)]))
+
+    def render_orders(self, bookings_by_guest):
+        pager = Pager(self, 'order', "Displaying all orders:\n")
+        for guest_name, bookings in bookings_by_guest.items():
+            for booking in bookings:
+                try:
+                    pager.add(order_row(guest_name, booking))
+                except KeyError:
+                    pager.note(f"Error: The order format for guest '{guest_name}' is not correct.\n")
+        pager.close()
+
+
+class Pager:
+    # Collects rows of one record kind and writes them a page at a time
+    def __init__(self, renderer, kind, title=None):
+        self.renderer = renderer
+        self.kind = kind
+        self.prefix = title if renderer.fmt == 'text' and title else ''
+        self.page = []
+
+    def add(self, row):
+        self.page.append(row)
+        if len(self.page) >= self.renderer.page_size:
+            self.flush()
+
+    # Text-only message (such as an error line), kept in order with the rows around it
+    def note(self, text):
+        if self.renderer.fmt == 'text':
+            self.prefix = self.prefix + self.renderer.format_rows(self.kind, self.page) + text
+            self.page.clear()
+            if len(self.prefix) > 65536:
+                self.flush()
+
+    def flush(self):
+        self.renderer.write(self.prefix + self.renderer.format_rows(self.kind, self.page))
+        self.prefix = ''
+        self.page.clear()
+
+    def close(self):
+        self.flush()
+
+
+# Shared plain text renderer used by the interactive menu
+console = ReportRenderer()
@@ -0,0 +1,64 @@
+'''
+Cold-start benchmark for index3__HDlevel.py.
+
+Times complete runs of the program, each in a fresh interpreter, on a copy of
+the data files: the menu started and exited straight away (which loads every
+file), and the subcommands that only read what they need.
+
+    python generate_data.py --out-dir data --guests 100000 --orders 1000000
+    python startup_benchmark.py --data-dir data --runs 5
+'''
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index3__HDlevel.py")
+
+
+def first_guest_name(guest_file):
+    with open(guest_file, 'r') as file:
+        for line in file:
+            parts = line.split(',')
+            if len(parts) > 1:
+                return parts[1].strip()
+    return "Alyssa"
+
+
+def cases(guest_name):
+    return [
+        ("menu (load everything, exit)", ["guests.csv", "products.csv", "orders.csv"], "6\n"),
+        ("history", ["history", guest_name], ""),
+        ("list guests, first page", ["list", "guests", "--page", "0"], ""),
+        ("list apartments, first page", ["list", "apartment", "--page", "0"], ""),
+        ("stats", ["stats", "--workers", "1"], ""),
+    ]
+
+
+def run(arguments, stdin, directory):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, SCRIPT] + arguments, input=stdin, text=True, cwd=directory,
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def benchmark(data_dir, runs):
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("guests.csv", "products.csv", "orders.csv"):
+            shutil.copy(os.path.join(data_dir, name), directory)
+        guest_name = first_guest_name(os.path.join(directory, "guests.csv"))
+        for label, arguments, stdin in cases(guest_name):
+            times = [run(arguments, stdin, directory) for _ in range(runs)]
+            print(f"{label:32} median {statistics.median(times) * 1000:9.1f} ms   best {min(times) * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold-start time of the booking system commands.")
+    parser.add_argument("--data-dir", default=".")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.data_dir, args.runs)
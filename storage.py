@@ -0,0 +1,281 @@
+'''
+SQLite storage for guests, products and orders, shared by many worker threads.
+
+- Readers borrow connections from a bounded pool, so at most `readers`
+  connections are open however many workers there are. The time spent waiting
+  for a connection is recorded as the `storage_pool_wait` operation in
+  instrumentation.metrics (when enabled) and in SqliteStore.pool.stats().
+- All writes go through one queue to a single writer thread with its own
+  connection. The writer commits whatever is queued together in one
+  transaction, each write in its own savepoint, so one failing write does not
+  undo the others.
+- The database runs in WAL mode, so readers are not blocked by the writer.
+- Every connection keeps a cache of compiled statements; the SQL text of each
+  query is a module constant, so repeated calls reuse the compiled statement.
+
+read()/write() block the calling thread; read_async()/write_async() are the
+same calls for asyncio code.
+'''
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from instrumentation import metrics
+from money import dollars, to_cents
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS guests (
+        guest_id TEXT PRIMARY KEY, name TEXT NOT NULL, reward_rate INTEGER, reward REAL, redeem_rate INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS products (
+        product_id TEXT PRIMARY KEY, kind TEXT NOT NULL, name TEXT NOT NULL, price REAL NOT NULL,
+        capacity INTEGER, stock INTEGER, components TEXT)""",
+    """CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER PRIMARY KEY AUTOINCREMENT, guest_name TEXT NOT NULL, products TEXT NOT NULL,
+        total_cost REAL NOT NULL, reward_points INTEGER NOT NULL, booking_date TEXT NOT NULL,
+        check_in_date TEXT, check_out_date TEXT)""",
+    "CREATE INDEX IF NOT EXISTS orders_guest ON orders (guest_name)",
+]
+
+UPSERT_GUEST = ("INSERT INTO guests (guest_id, name, reward_rate, reward, redeem_rate) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (guest_id) DO UPDATE SET name = excluded.name, reward_rate = excluded.reward_rate, "
+                "reward = excluded.reward, redeem_rate = excluded.redeem_rate")
+UPSERT_PRODUCT = ("INSERT INTO products (product_id, kind, name, price, capacity, stock, components) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                  "ON CONFLICT (product_id) DO UPDATE SET kind = excluded.kind, name = excluded.name, "
+                  "price = excluded.price, capacity = excluded.capacity, stock = excluded.stock, "
+                  "components = excluded.components")
+INSERT_ORDER = ("INSERT INTO orders (guest_name, products, total_cost, reward_points, booking_date, "
+                "check_in_date, check_out_date) VALUES (?, ?, ?, ?, ?, ?, ?)")
+SELECT_GUESTS = "SELECT guest_id, name, reward_rate, reward, redeem_rate FROM guests"
+SELECT_PRODUCTS = "SELECT product_id, kind, name, price, capacity, stock, components FROM products"
+SELECT_GUEST_ORDERS = ("SELECT products, total_cost, reward_points, booking_date, check_in_date, check_out_date "
+                       "FROM orders WHERE guest_name = ? ORDER BY order_id")
+SELECT_ORDERS = ("SELECT guest_name, products, total_cost, reward_points, booking_date, check_in_date, "
+                 "check_out_date FROM orders ORDER BY order_id")
+
+STATEMENT_CACHE = 128  # compiled statements kept per connection
+WRITE_BATCH = 256      # most writes committed in one transaction
+
+
+# "2 x U12swan, 1 x SI1" <-> [("U12swan", 2), ("SI1", 1)], the layout orders.csv uses
+def encode_orders(orders):
+    return ', '.join([f"{quantity} x {product}" for product, quantity in orders])
+
+
+def decode_orders(text):
+    orders = []
+    for detail in text.split(', ') if text else []:
+        quantity, product = detail.split(' x ', 1)
+        orders.append((product, int(quantity)))
+    return orders
+
+
+def booking_from_row(row):
+    booking = {'orders': decode_orders(row[0]), 'total_cents': to_cents(row[1]), 'reward_points': row[2],
+               'booking_date': row[3]}
+    if row[4] is not None:
+        booking['check_in_date'] = row[4]
+        booking['check_out_date'] = row[5]
+    return booking
+
+
+class ConnectionPool:
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.size = size
+        self.idle = queue.LifoQueue()  # most recently used first, so its statement cache is warm
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.waits = 0          # acquisitions that had to wait for a connection
+        self.wait_total = 0.0   # seconds
+        self.wait_max = 0.0
+        self.acquired = 0
+
+    def acquire(self, timeout=None):
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = None
+            with self.lock:
+                if self.opened < self.size:
+                    self.opened += 1
+                    opening = True
+                else:
+                    opening = False
+            if opening:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            else:
+                start = time.perf_counter()
+                try:
+                    connection = self.idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No database connection became free within {timeout} seconds.")
+                waited = time.perf_counter() - start
+                with self.lock:
+                    self.waits += 1
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                if metrics.enabled:
+                    metrics.record('storage_pool_wait', waited)
+        with self.lock:
+            self.acquired += 1
+        return connection
+
+    def release(self, connection):
+        self.idle.put(connection)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size, 'open': self.opened, 'idle': self.idle.qsize(), 'acquired': self.acquired,
+                    'waits': self.waits, 'wait_seconds_total': self.wait_total, 'wait_seconds_max': self.wait_max}
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SqliteStore:
+    def __init__(self, path, readers=4, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.writes = queue.Queue()
+        self.pool = ConnectionPool(self._connect, readers)
+        writer = self._connect()
+        for statement in SCHEMA:
+            writer.execute(statement)
+        self.writer = threading.Thread(target=self._write_loop, args=(writer,), name="storage-writer", daemon=True)
+        self.writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                     check_same_thread=False, cached_statements=STATEMENT_CACHE)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # ---- generic access ----
+
+    # Runs fn(connection) on a pooled reader connection
+    def read(self, fn, *args):
+        with self.pool.connection(self.timeout) as connection:
+            return fn(connection, *args)
+
+    # Queues fn(connection) for the writer thread; the future holds its result
+    def submit(self, fn, *args):
+        future = Future()
+        self.writes.put((fn, args, future, time.perf_counter()))
+        return future
+
+    def write(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    async def read_async(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, self.read, fn, *args)
+
+    async def write_async(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _write_loop(self, connection):
+        while True:
+            task = self.writes.get()
+            if task is None:
+                break
+            batch = [task]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    task = self.writes.get_nowait()
+                except queue.Empty:
+                    break
+                if task is None:
+                    self.writes.put(None)  # stop after this batch
+                    break
+                batch.append(task)
+            self._commit(connection, batch)
+        connection.close()
+
+    def _commit(self, connection, batch):
+        start = time.perf_counter()
+        results = []
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for fn, args, future, queued in batch:
+                if metrics.enabled:
+                    metrics.record('storage_write_queue_wait', start - queued)
+                connection.execute("SAVEPOINT write")
+                try:
+                    results.append((future, fn(connection, *args), None))
+                    connection.execute("RELEASE write")
+                except Exception as e:
+                    connection.execute("ROLLBACK TO write")
+                    connection.execute("RELEASE write")
+                    results.append((future, None, e))
+            connection.execute("COMMIT")
+        except Exception as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            for fn, args, future, queued in batch:
+                future.set_exception(e)
+            return
+        if metrics.enabled:
+            metrics.record('storage_commit', time.perf_counter() - start)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def close(self):
+        self.writes.put(None)
+        self.writer.join()
+        self.pool.close()
+
+    # ---- records and orders ----
+
+    # rows: (guest ID, name, reward rate, reward, redeem rate)
+    def save_guests(self, rows):
+        return self.submit(lambda connection: connection.executemany(UPSERT_GUEST, rows).rowcount)
+
+    # rows: (product ID, kind, name, price, capacity, stock, components as "SI1, SI2")
+    def save_products(self, rows):
+        return self.submit(lambda connection: connection.executemany(UPSERT_PRODUCT, rows).rowcount)
+
+    def add_bookings(self, bookings):
+        rows = [(guest_name, encode_orders(booking['orders']), dollars(booking['total_cents']), booking['reward_points'],
+                 booking['booking_date'], booking.get('check_in_date'), booking.get('check_out_date'))
+                for guest_name, booking in bookings]
+        return self.submit(lambda connection: connection.executemany(INSERT_ORDER, rows).rowcount)
+
+    def guests(self):
+        return self.read(lambda connection: connection.execute(SELECT_GUESTS).fetchall())
+
+    def products(self):
+        return self.read(lambda connection: connection.execute(SELECT_PRODUCTS).fetchall())
+
+    def guest_orders(self, guest_name):
+        return self.read(lambda connection: [booking_from_row(row) for row in
+                                             connection.execute(SELECT_GUEST_ORDERS, (guest_name,))])
+
+    # Every booking as (guest name, booking), in the order they were added
+    def orders(self):
+        return self.read(lambda connection: [(row[0], booking_from_row(row[1:])) for row in
+                                             connection.execute(SELECT_ORDERS)])
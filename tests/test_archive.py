@@ -0,0 +1,106 @@
+import os
+from datetime import date
+
+import pytest
+
+import archive
+from archive import ArchiveIndex, archive_orders, read_bookings
+
+ORDERS = (
+    "Luigi, 1 x U20goose, 165.0, 165, 1/8/2024 9:00\n"
+    "Alyssa, 2 x U12swan, 4 x SI2, 551.2, 551, 12/9/2024 19:55\n"
+    "Mario, 1 x U12swan, 200.0, 200, 20/9/2024 10:00, 01-10-2024, 03-10-2024\n"
+    "Luigi, 2 x U22goose, 420.6, 420, 15/10/2024 16:00\n"
+)
+BEFORE, TODAY = date(2024, 10, 1), date(2024, 10, 2)
+
+
+@pytest.fixture
+def order_file(tmp_path):
+    path = tmp_path / 'orders.csv'
+    path.write_text(ORDERS)
+    return str(path)
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'archive')
+
+
+def guests(bookings):
+    return [guest for guest, _ in bookings]
+
+
+def test_old_bookings_move_to_a_segment(order_file, directory):
+    entry = archive_orders(order_file, directory, BEFORE, today=TODAY)
+    assert entry['rows'] == 2 and (entry['first'], entry['last']) == ('2024-08-01', '2024-09-12')
+    assert 'pending' not in entry
+    # Mario's stay checks out after today, so it stays in the live file with the recent booking
+    with open(order_file) as file:
+        assert [line.split(',')[0] for line in file] == ['Mario', 'Luigi']
+    assert guests(read_bookings(directory)) == ['Luigi', 'Alyssa']
+    assert guests(read_bookings(directory, since=date(2024, 9, 1))) == ['Alyssa']
+    assert guests(read_bookings(directory, guest_name='Luigi')) == ['Luigi']
+    assert archive_orders(order_file, directory, BEFORE, today=TODAY) is None
+
+
+def test_finished_stays_are_archived_later(order_file, directory):
+    archive_orders(order_file, directory, BEFORE, today=TODAY)
+    entry = archive_orders(order_file, directory, BEFORE, today=date(2024, 10, 4))
+    assert entry['rows'] == 1
+    assert guests(read_bookings(directory)) == ['Luigi', 'Alyssa', 'Mario']
+
+
+def test_crash_before_the_live_file_is_replaced(order_file, directory, monkeypatch):
+    replace = os.replace
+
+    def crash(source, target):
+        if target == order_file:
+            raise OSError("crash")
+        replace(source, target)
+
+    monkeypatch.setattr(archive.os, 'replace', crash)
+    with pytest.raises(OSError):
+        archive_orders(order_file, directory, BEFORE, today=TODAY)
+    monkeypatch.setattr(archive.os, 'replace', replace)
+
+    with open(order_file) as file:
+        assert file.read() == ORDERS
+    index = ArchiveIndex(directory)
+    assert len(index.segments) == 1 and 'pending' in index.segments[0]
+    assert index.segments_for() == []
+    assert list(read_bookings(directory)) == []
+    assert not os.path.exists(order_file + '.live.tmp')
+
+    # The next run starts by dropping the stale segment, then archives the rows again
+    stale = index.path(index.segments[0])
+    index.finish_pending()
+    assert ArchiveIndex(directory).segments == [] and not os.path.exists(stale)
+    assert archive_orders(order_file, directory, BEFORE, today=TODAY)['rows'] == 2
+    assert guests(read_bookings(directory)) == ['Luigi', 'Alyssa']
+
+
+def test_crash_before_the_pending_mark_is_cleared(order_file, directory, monkeypatch):
+    save, calls = ArchiveIndex.save, []
+
+    def crash(index):
+        calls.append(index)
+        if len(calls) == 2:
+            raise OSError("crash")
+        save(index)
+
+    monkeypatch.setattr(ArchiveIndex, 'save', crash)
+    with pytest.raises(OSError):
+        archive_orders(order_file, directory, BEFORE, today=TODAY)
+    monkeypatch.setattr(ArchiveIndex, 'save', save)
+
+    # The live file was replaced, so the pending segment already counts, exactly once
+    assert 'pending' in ArchiveIndex(directory).segments[0]
+    assert guests(read_bookings(directory)) == ['Luigi', 'Alyssa']
+    with open(order_file) as file:
+        assert [line.split(',')[0] for line in file] == ['Mario', 'Luigi']
+
+    index = ArchiveIndex(directory)
+    index.finish_pending()
+    assert 'pending' not in ArchiveIndex(directory).segments[0]
+    assert guests(read_bookings(directory)) == ['Luigi', 'Alyssa']
@@ -0,0 +1,92 @@
+from datetime import date
+
+import pytest
+
+import index3__HDlevel as pos
+from inventory import HoldExpiredError, Holds, InsufficientStockError, Inventory
+
+CHECK_IN, CHECK_OUT = date(2031, 1, 1), date(2031, 1, 3)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_holds(clock, expired=None):
+    inventory = Inventory({'U12swan': 1, 'SI1': 2}.get)
+    on_expire = expired.extend if expired is not None else None
+    return Holds(inventory, ttl=60, clock=clock, on_expire=on_expire)
+
+
+def test_an_expired_hold_releases_its_stock(clock):
+    expired = []
+    holds = make_holds(clock, expired)
+    hold_id = holds.hold([('U12swan', 1)], CHECK_IN, CHECK_OUT)
+    assert holds.inventory.remaining('U12swan', CHECK_IN, CHECK_OUT) == 0
+    clock.now += 59
+    assert holds.expire() == []
+    clock.now += 1
+    assert holds.expire() == [hold_id]
+    assert expired == [hold_id]
+    assert holds.inventory.remaining('U12swan', CHECK_IN, CHECK_OUT) == 1
+    assert holds.expires_at(hold_id) is None
+
+
+def test_hold_expires_older_holds_before_reserving(clock):
+    expired = []
+    holds = make_holds(clock, expired)
+    first = holds.hold([('U12swan', 1)], CHECK_IN, CHECK_OUT)
+    with pytest.raises(InsufficientStockError):
+        holds.hold([('U12swan', 1)], CHECK_IN, CHECK_OUT)
+    clock.now += 61
+    second = holds.hold([('U12swan', 1)], CHECK_IN, CHECK_OUT)
+    assert expired == [first]
+    assert holds.expires_at(second) == clock.now + 60
+
+
+def test_confirm_after_expiry_raises(clock):
+    expired = []
+    holds = make_holds(clock, expired)
+    hold_id = holds.hold([('SI1', 2)], CHECK_IN, CHECK_OUT)
+    clock.now += 60
+    with pytest.raises(HoldExpiredError):
+        holds.confirm(hold_id)
+    assert expired == [hold_id]
+    assert holds.inventory.remaining('SI1', CHECK_IN, CHECK_OUT) == 2
+
+
+def test_confirmed_and_cancelled_holds_never_expire(clock):
+    expired = []
+    holds = make_holds(clock, expired)
+    kept = holds.hold([('U12swan', 1)], CHECK_IN, CHECK_OUT)
+    cancelled = holds.hold([('SI1', 1)], CHECK_IN, CHECK_OUT)
+    holds.confirm(kept)
+    holds.cancel(cancelled)
+    clock.now += 3600
+    assert holds.expire() == []
+    assert expired == []
+    assert holds.inventory.remaining('U12swan', CHECK_IN, CHECK_OUT) == 0
+    assert holds.inventory.remaining('SI1', CHECK_IN, CHECK_OUT) == 2
+
+
+def test_quotes_that_expire_inside_hold_are_forgotten(tmp_path, clock):
+    (tmp_path / 'guests.csv').write_text("1, Alyssa, 100, 0, 1\n")
+    (tmp_path / 'products.csv').write_text("U12swan, Unit 12 Swan Building, 200.00, 3\n")
+    operations = pos.Operations(pos.Records(str(tmp_path / 'guests.csv'), str(tmp_path / 'products.csv')), quote_ttl=60)
+    operations.holds.clock = clock
+    quote = operations.quote_booking('Alyssa', 1, 'U12swan', '01-01-2031', '03-01-2031')
+    clock.now += 61
+    # A hold made straight through the holds, not through quote_booking(), runs the expiry
+    operations.holds.hold([('U12swan', 1)], date(2032, 1, 1), date(2032, 1, 2))
+    assert quote.quote_id not in operations.quotes
+    with pytest.raises(pos.QuoteExpiredError):
+        operations.commit_booking(quote.quote_id)
@@ -0,0 +1,100 @@
+import random
+from datetime import date
+
+import pytest
+
+import index3__HDlevel as pos
+from inventory import InsufficientStockError, Inventory, StockLedger, night_index
+
+
+def test_stock_ledger_matches_a_plain_list_of_nights():
+    rng = random.Random(7)
+    ledger = StockLedger()
+    nights = [0] * 400
+    reserved = []
+    for _ in range(300):
+        if reserved and rng.random() < 0.3:
+            first, last, amount = reserved.pop(rng.randrange(len(reserved)))
+            amount = -amount  # a release undoes an earlier reservation
+        else:
+            first = rng.randrange(400)
+            last = rng.randrange(first, min(first + 30, 400))
+            amount = rng.randint(1, 3)
+            reserved.append((first, last, amount))
+        ledger.add(first, last, amount)
+        for night in range(first, last + 1):
+            nights[night] += amount
+        first = rng.randrange(400)
+        last = rng.randrange(first, 400)
+        assert ledger.max_reserved(first, last) == max(nights[first:last + 1])
+
+
+def test_stock_ledger_sees_nothing_outside_reserved_ranges():
+    ledger = StockLedger()
+    ledger.add(100, 104, 2)
+    assert ledger.max_reserved(0, 99) == 0
+    assert ledger.max_reserved(105, 60000) == 0
+    assert ledger.max_reserved(104, 104) == 2
+
+
+def test_reserve_all_is_all_or_nothing():
+    capacities = {'U12swan': 1, 'SI1': 2, 'SI2': None}
+    inventory = Inventory(capacities.get)
+    check_in, check_out = date(2031, 1, 1), date(2031, 1, 4)
+    inventory.reserve_all([('U12swan', 1), ('SI1', 1), ('SI2', 50)], check_in, check_out)
+    with pytest.raises(InsufficientStockError):
+        inventory.reserve_all([('SI1', 1), ('U12swan', 1)], date(2031, 1, 3), date(2031, 1, 5))
+    # The failed request left SI1 as it was
+    assert inventory.remaining('SI1', check_in, check_out) == 1
+    assert inventory.remaining('SI2', check_in, check_out) is None
+    # Check-out day is free for the next stay
+    inventory.reserve_all([('U12swan', 1)], check_out, date(2031, 1, 6))
+
+
+def test_release_frees_the_nights():
+    inventory = Inventory({'U12swan': 1}.get)
+    reservation = inventory.reserve_all([('U12swan', 1)], date(2031, 1, 1), date(2031, 1, 3))
+    assert inventory.remaining('U12swan', date(2031, 1, 2), date(2031, 1, 3)) == 0
+    inventory.release(reservation)
+    assert inventory.remaining('U12swan', date(2031, 1, 1), date(2031, 1, 3)) == 1
+
+
+def test_night_index_rejects_dates_outside_the_ledger():
+    with pytest.raises(ValueError):
+        night_index(date(1999, 12, 31))
+
+
+@pytest.fixture
+def operations(tmp_path):
+    (tmp_path / 'guests.csv').write_text("1, Alyssa, 100, 0, 1\n")
+    (tmp_path / 'products.csv').write_text("U12swan, Unit 12 Swan Building, 200.00, 3\n"
+                                           "U13swan, Unit 13 Swan Building, 190.70, 2\n"
+                                           "SI2, Breakfast, 25.30, 4\n"
+                                           "SI6, Double extra bed (2 people), 50, 1\n"
+                                           "B1, Bed and breakfast for two, U12swan, SI2, SI2, 220.48\n")
+    return pos.Operations(pos.Records(str(tmp_path / 'guests.csv'), str(tmp_path / 'products.csv')))
+
+
+def test_item_quantities_are_spread_over_the_nights(operations):
+    # Four breakfasts over four nights reserve one a night; extra beds stand every night
+    lines = operations.booked_stock_lines([('U12swan', 4), ('SI2', 4), ('SI6', 1)], 4)
+    assert dict(lines) == {'U12swan': 1, 'SI2': 1, 'SI6': 1}
+    # Bundles count as their components, rounded up per night
+    assert dict(operations.booked_stock_lines([('U12swan', 3), ('B1', 1), ('SI2', 1)], 3)) == {'U12swan': 1, 'SI2': 1}
+
+
+def test_quotes_use_the_nightly_quantities(operations):
+    operations.quote_booking('Alyssa', 1, 'U12swan', '01-01-2031', '05-01-2031', [('SI2', 8)])
+    operations.quote_booking('Alyssa', 1, 'U13swan', '01-01-2031', '05-01-2031', [('SI2', 8)])
+    assert operations.inventory.remaining('SI2', date(2031, 1, 1), date(2031, 1, 5)) == 0
+
+
+def test_reserve_stays_rebuilds_open_stays_only(operations):
+    bookings = [
+        {'orders': [('U12swan', 2)], 'check_in_date': '01-01-2031', 'check_out_date': '03-01-2031'},
+        {'orders': [('U13swan', 2)], 'check_in_date': '01-01-2020', 'check_out_date': '03-01-2020'},
+        {'orders': [('U13swan', 2)]},  # saved before stay dates were recorded
+    ]
+    assert operations.reserve_stays(bookings) == 1
+    assert operations.inventory.remaining('U12swan', date(2031, 1, 2), date(2031, 1, 3)) == 0
+    assert operations.inventory.remaining('U13swan', date(2031, 1, 1), date(2031, 1, 3)) == 1
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+
+
+# A Zipf-like stream: key i appears about 1 / (i + 1) as often as key 0
+def stream(seed, length, keys=2000):
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(keys)]
+    return [f"guest{i}" for i in rng.choices(range(keys), weights=weights, k=length)]
+
+
+def exact_counts(*streams):
+    counts = {}
+    for keys in streams:
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def test_count_min_merge_matches_one_sketch_over_both_streams():
+    a, b = stream(1, 20000), stream(2, 20000)
+    left, right, whole = CountMinSketch(0.01, 0.01), CountMinSketch(0.01, 0.01), CountMinSketch(0.01, 0.01)
+    for key in a:
+        left.add(key)
+        whole.add(key)
+    for key in b:
+        right.add(key)
+        whole.add(key)
+    left.merge(right)
+    assert left.rows == whole.rows
+    assert left.total == whole.total == 40000
+
+
+def test_count_min_estimates_stay_within_the_error_bound():
+    a, b = stream(3, 20000), stream(4, 20000)
+    left, right = CountMinSketch(0.01, 0.01), CountMinSketch(0.01, 0.01)
+    for key in a:
+        left.add(key)
+    for key in b:
+        right.add(key)
+    merged = left.merge(right)
+    bound = merged.error_bound()
+    assert bound == pytest.approx(0.01 * 40000, rel=0.01)
+    for key, count in exact_counts(a, b).items():
+        estimate = merged.estimate(key)
+        assert count <= estimate <= count + bound
+
+
+def test_count_min_refuses_to_merge_different_dimensions():
+    with pytest.raises(ValueError):
+        CountMinSketch(0.01, 0.01).merge(CountMinSketch(0.001, 0.01))
+
+
+def test_hyperloglog_merge_is_the_sketch_of_the_union():
+    left, right, whole = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+    for n in range(30000):
+        left.add(f"guest{n}")
+        whole.add(f"guest{n}")
+    for n in range(20000, 50000):  # overlaps the first 10,000 keys of the other half
+        right.add(f"guest{n}")
+        whole.add(f"guest{n}")
+    left.merge(right)
+    assert left.registers == whole.registers
+    assert abs(left.count() - 50000) <= 3 * left.relative_error() * 50000
+
+
+def test_hyperloglog_counts_small_sets_exactly_enough():
+    sketch = HyperLogLog(12)
+    for n in range(100):
+        sketch.add(n)
+        sketch.add(n)  # repeats do not count
+    assert abs(sketch.count() - 100) <= 2
+
+
+def test_hyperloglog_refuses_to_merge_different_precisions():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+
+def test_space_saving_merge_keeps_heavy_keys_within_the_bound():
+    a, b = stream(5, 30000), stream(6, 30000)
+    left, right = SpaceSaving(50), SpaceSaving(50)
+    for key in a:
+        left.add(key)
+    for key in b:
+        right.add(key)
+    merged = left.merge(right)
+    counts = exact_counts(a, b)
+    bound = merged.error_bound()
+    assert bound == 60000 / 50
+    for key, count in counts.items():
+        if count > bound:
+            assert key in merged.counts  # every key above N / k survives the merge
+    for key, estimate, error in merged.top(10):
+        assert estimate - error <= counts[key] <= estimate
+        assert error <= bound